@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'chatbot',
     'patients'
 ]
@@ -89,6 +90,14 @@ DATABASES = {
     }
 }
 
+# Holds the per-session history date lists. The default is per process; with several workers point it at a
+# shared backend (e.g. CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache and a directory).
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
 
 
 # Password validation
@@ -0,0 +1,188 @@
+"""
+Checkpoint read/write cost per chat turn: in-process MemorySaver vs the database checkpointer.
+
+Drives a graph with the same state and node layout as one HealthMate turn (history compaction, knowledge
+extractor, orchestrator tool call, tool message, assistant answer, final state; the pass-through nodes
+return the whole state like the real ones) for a number of turns on one thread, and reports the time spent
+in checkpoint reads and writes per turn, the bytes serialized per turn, and what the thread holds at the end.
+Runs against a throwaway SQLite database by default; --postgres uses the project settings (tables must
+be migrated, benchmark threads are deleted afterwards).
+
+    python benchmarks/bench_checkpointer.py [--turns 50] [--answer-chars 1500] [--keep-latest 10]
+    python benchmarks/bench_checkpointer.py --postgres
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Annotated
+
+from typing_extensions import TypedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_django(postgres):
+    import django
+    from django.conf import settings
+    if postgres:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "healthmate.settings")
+        django.setup()
+        return
+    settings.configure(
+        INSTALLED_APPS=["django.contrib.contenttypes", "django.contrib.auth", "chatbot", "patients"],
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": os.path.join(tempfile.mkdtemp(), "bench.sqlite3")}},
+        DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+        USE_TZ=True,
+    )
+    django.setup()
+    # Only the checkpoint tables: ConversationHistory's search columns and indexes are Postgres-only.
+    from django.db import connection
+    from chatbot.models import GraphCheckpoint, GraphCheckpointBlob, GraphCheckpointWrite
+    with connection.schema_editor() as editor:
+        for model in (GraphCheckpoint, GraphCheckpointBlob, GraphCheckpointWrite):
+            editor.create_model(model)
+
+
+def build_graph(answer_chars):
+    from langchain_core.messages import AIMessage, ToolMessage
+    from langgraph.graph import StateGraph, START, END
+    from langgraph.graph.message import add_messages
+
+    class State(TypedDict):
+        messages: Annotated[list, add_messages]
+        current_state: str
+        message_counter: int
+        summary: str
+        message_for_any_tool: str
+        route: str
+
+    def passthrough(state):
+        return state
+
+    def orchestrator(state):
+        call_id = f"call_{uuid.uuid4().hex[:24]}"
+        return {"messages": [AIMessage(content="", tool_calls=[{"name": "assistant_tool", "args": {}, "id": call_id}])], "route": "assistant_tool"}
+
+    def add_tool_message(state):
+        return {"messages": [ToolMessage(content="Calling Assistant", tool_call_id=state["messages"][-1].tool_calls[0]["id"])]}
+
+    def assistant(state):
+        return {"messages": [AIMessage(content=("Drink water, rest and see a doctor if it persists. " * 64)[:answer_chars])], "current_state": "assistant"}
+
+    g = StateGraph(State)
+    for name, node in [("compact_history", passthrough), ("knowledge_extractor", passthrough), ("orchestrator", orchestrator),
+                       ("add_assistant_tool_message", add_tool_message), ("assistant", assistant), ("final_state", passthrough)]:
+        g.add_node(name, node)
+    g.add_edge(START, "compact_history")
+    g.add_edge("compact_history", "knowledge_extractor")
+    g.add_edge("knowledge_extractor", "orchestrator")
+    g.add_edge("orchestrator", "add_assistant_tool_message")
+    g.add_edge("add_assistant_tool_message", "assistant")
+    g.add_edge("assistant", "final_state")
+    g.add_edge("final_state", END)
+    return g
+
+
+class Meter:
+    """
+    Wraps a saver's read/write methods and its serializer to time them and count serialized bytes.
+    """
+    def __init__(self, saver, dumps_attr):
+        self.read = 0.0
+        self.write = 0.0
+        self.bytes = 0
+        for name, kind in (("get_tuple", "read"), ("put", "write"), ("put_writes", "write")):
+            setattr(saver, name, self.timed(getattr(saver, name), kind))
+        owner = saver if dumps_attr == "_dumps" else saver.serde
+        name = "_dumps" if dumps_attr == "_dumps" else "dumps_typed"
+        setattr(owner, name, self.counted(getattr(owner, name)))
+
+    def timed(self, method, kind):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                setattr(self, kind, getattr(self, kind) + time.perf_counter() - started)
+        return wrapper
+
+    def counted(self, dumps):
+        def wrapper(obj):
+            type_, data = dumps(obj)
+            self.bytes += len(data or b"")
+            return type_, data
+        return wrapper
+
+    def take(self):
+        values = (self.read, self.write, self.bytes)
+        self.read = self.write = 0.0
+        self.bytes = 0
+        return values
+
+
+def stored_size(saver, thread_id):
+    from langgraph.checkpoint.memory import MemorySaver
+    if isinstance(saver, MemorySaver):
+        rows = [saved for ns in saver.storage[thread_id].values() for saved in ns.values()]
+        return len(rows), sum(len(checkpoint[1]) + len(metadata[1]) for checkpoint, metadata, _ in rows)
+    from chatbot.models import GraphCheckpoint, GraphCheckpointBlob
+    checkpoints = list(GraphCheckpoint.objects.filter(thread_id=thread_id).values_list("checkpoint", flat=True))
+    blobs = list(GraphCheckpointBlob.objects.filter(thread_id=thread_id).values_list("value", flat=True))
+    return len(checkpoints), sum(len(c) for c in checkpoints) + sum(len(b or b"") for b in blobs)
+
+
+def run(label, saver, meter, graph, turns):
+    from langchain_core.messages import HumanMessage
+    compiled = graph.compile(checkpointer=saver)
+    thread_id = f"bench-{uuid.uuid4()}"
+    config = {"configurable": {"thread_id": thread_id}}
+    reads, writes, sizes = [], [], []
+    for turn in range(turns):
+        message = {"messages": [HumanMessage(content=f"I have had a headache for {turn} days, what should I do?")]}
+        if turn == 0:
+            message.update(current_state="Orchestrator", message_counter=0)
+        compiled.invoke(message, config)
+        read, write, size = meter.take()
+        reads.append(read * 1000)
+        writes.append(write * 1000)
+        sizes.append(size)
+    checkpoints, stored = stored_size(saver, thread_id)
+    p95 = lambda values: sorted(values)[round(0.95 * (len(values) - 1))]
+    print(f"{label:<10} read {statistics.median(reads):6.2f} ms p50 {p95(reads):6.2f} ms p95 | "
+          f"write {statistics.median(writes):6.2f} ms p50 {p95(writes):6.2f} ms p95 | "
+          f"serialized {sizes[0] / 1024:7.1f} KiB first turn {sizes[-1] / 1024:7.1f} KiB last turn | "
+          f"holds {checkpoints} checkpoints, {stored / 1024:.1f} KiB")
+    return thread_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--answer-chars", type=int, default=1500)
+    parser.add_argument("--keep-latest", type=int, default=10)
+    parser.add_argument("--compress-min-bytes", type=int, default=1024)
+    parser.add_argument("--postgres", action="store_true", help="Use the project database instead of a temporary SQLite file.")
+    args = parser.parse_args()
+
+    setup_django(args.postgres)
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+    from chatbot.core.checkpointer import DjangoCheckpointSaver
+
+    graph = build_graph(args.answer_chars)
+    print(f"{args.turns} turns, {args.answer_chars}-character answers, no summarization (history keeps growing)")
+    # Its own serializer instance, so metering it does not also meter the database saver.
+    memory = MemorySaver(serde=JsonPlusSerializer())
+    run("memory", memory, Meter(memory, "dumps_typed"), graph, args.turns)
+    database = DjangoCheckpointSaver(keep_latest=args.keep_latest, compress_min_bytes=args.compress_min_bytes)
+    thread_id = run("database", database, Meter(database, "_dumps"), graph, args.turns)
+    if args.postgres:
+        database.delete_thread(thread_id)
+
+
+if __name__ == "__main__":
+    main()
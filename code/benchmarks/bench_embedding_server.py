@@ -0,0 +1,158 @@
+"""
+Memory per worker and throughput of the shared embedding server.
+
+Memory: resident set size of a fresh process that loads the model itself (what every Django worker
+did) against one that only talks to the server through EmbeddingClient.
+Throughput: queries/s and latency at 1/8/32 concurrent requests, embedding in-process one query at a
+time against going through the server, which coalesces concurrent requests into batched forward passes.
+
+By default the model is a randomly initialised BERT with the all-MiniLM-L6-v2 shape (6 layers, 384 hidden)
+and a hashing tokenizer, so the numbers are representative without downloading weights. Pass
+--model sentence-transformers/all-MiniLM-L6-v2 to use the real model.
+
+    python benchmarks/bench_embedding_server.py [--requests 256] [--concurrency 1 8 32] [--max-wait-ms 5]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+SYNTHETIC = "synthetic"
+
+
+class SyntheticMiniLM(Embeddings):
+    model_name = "synthetic/MiniLM-L6-384"
+
+    def __init__(self):
+        import torch
+        from transformers import BertConfig, BertModel
+        torch.manual_seed(0)
+        self.torch = torch
+        config = BertConfig(vocab_size=30522, hidden_size=384, num_hidden_layers=6, num_attention_heads=12, intermediate_size=1536)
+        self.model = BertModel(config).eval()
+
+    def tokenize(self, texts):
+        ids = [[101] + [500 + zlib.crc32(word.encode()) % 30000 for word in text.lower().split()][:126] + [102] for text in texts]
+        width = max(len(row) for row in ids)
+        input_ids = self.torch.tensor([row + [0] * (width - len(row)) for row in ids])
+        attention_mask = self.torch.tensor([[1] * len(row) + [0] * (width - len(row)) for row in ids])
+        return input_ids, attention_mask
+
+    def embed_documents(self, texts):
+        input_ids, attention_mask = self.tokenize(texts)
+        with self.torch.no_grad():
+            hidden = self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        mask = attention_mask.unsqueeze(-1).float()
+        pooled = (hidden * mask).sum(1) / mask.sum(1)
+        return self.torch.nn.functional.normalize(pooled, dim=1).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def load_embeddings(model):
+    if model == SYNTHETIC:
+        return SyntheticMiniLM()
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model)
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def in_process_worker(model, results):
+    embeddings = load_embeddings(model)
+    embeddings.embed_query("warm up the model")
+    results.put(rss_mb())
+
+
+def client_worker(socket_path, results):
+    from chatbot.core.embedding_server import EmbeddingClient
+    EmbeddingClient(socket_path).embed_query("warm up the connection")
+    results.put(rss_mb())
+
+
+def run_server(socket_path, model, max_batch, max_wait):
+    import asyncio
+    from chatbot.core.embedding_server import EmbeddingServer
+    asyncio.run(EmbeddingServer(load_embeddings(model), socket_path, max_batch, max_wait).serve())
+
+
+def measure_rss(context, target, *args):
+    results = context.Queue()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    value = results.get(timeout=600)
+    process.join()
+    return value
+
+
+def throughput(embed_query, requests, concurrency):
+    queries = [f"What are the side effects of medication number {i} when taken with food?" for i in range(requests)]
+    latencies = []
+
+    def one(query):
+        started = time.perf_counter()
+        embed_query(query)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, queries))
+    elapsed = time.perf_counter() - started
+    latencies = np.asarray(latencies) * 1000
+    return requests / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=SYNTHETIC)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    from chatbot.core.embedding_server import EmbeddingClient, wait_for_server
+
+    context = multiprocessing.get_context("spawn")
+    socket_path = os.path.join(tempfile.mkdtemp(), "embeddings.sock")
+    server = context.Process(target=run_server, args=(socket_path, args.model, args.max_batch, args.max_wait_ms / 1000), daemon=True)
+    server.start()
+    try:
+        wait_for_server(socket_path, timeout=600)
+
+        print("Resident memory per worker process:")
+        print(f"  model loaded in the worker   {measure_rss(context, in_process_worker, args.model):8.1f} MB")
+        print(f"  client of the shared server  {measure_rss(context, client_worker, socket_path):8.1f} MB")
+
+        local = load_embeddings(args.model)
+        client = EmbeddingClient(socket_path)
+        local.embed_query("warm up")
+        client.embed_query("warm up")
+        print(f"\nThroughput, {args.requests} queries (max batch {args.max_batch}, max wait {args.max_wait_ms} ms):")
+        for concurrency in args.concurrency:
+            for label, embed_query in (("in-process", local.embed_query), ("server", client.embed_query)):
+                qps, p50, p95 = throughput(embed_query, args.requests, concurrency)
+                print(f"  {label:<11} concurrency {concurrency:>3}   {qps:8.1f} q/s   p50 {p50:8.2f} ms   p95 {p95:8.2f} ms")
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
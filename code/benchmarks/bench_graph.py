@@ -0,0 +1,376 @@
+"""
+Per-node and end-to-end latency of chat turns through the compiled HealthMate graph, with fake backends.
+
+Runs scripted multi-turn conversations (general questions, knowledge graph lookups, an appointment change,
+a treatment change, an off-topic message, and a long conversation that triggers summaries and knowledge
+extraction) through compile_graph() the way the chat views do, one graph thread per conversation. The LLM
+provider, Neo4j and Pinecone are the deterministic stand-ins from fake_backends.py, each charging a fixed
+latency (0 by default, so the numbers are the application's own overhead); everything else is the real
+code: LLMManager, KnowledgeGraph and its subgraph cache, PineconeStore, the intent router, context packer,
+summarizer, extraction worker and semantic cache fills (which are waited for after every turn, outside the
+timings). Embeddings are hashed bags of words unless --embeddings synthetic (a randomly initialised
+MiniLM-shaped BERT, see bench_embedding_server.py).
+
+Reports p50/p95/p99 per graph node, per turn and per turn for each path, then, in a second pass under
+tracemalloc (which slows everything down, so it is kept out of the timings), the memory each node and, in
+a third pass, each turn allocates (medians): peak above what was in use when it started, and what it still
+holds when it returns.
+
+--save-baseline writes the results to a JSON file; --baseline compares against one and exits with status 1
+when a p50/p95 latency or the allocation peak grew by more than --tolerance (and by more than a small
+absolute amount, so noise on sub-millisecond nodes does not count). Baselines are only comparable on the
+same machine with the same options.
+
+    python benchmarks/bench_graph.py [--rounds 10] [--llm-latency-ms 0] [--kg-rtt-ms 0] [--vector-latency-ms 0] [--sync]
+    python benchmarks/bench_graph.py --save-baseline benchmarks/baselines/graph.json
+    python benchmarks/bench_graph.py --baseline benchmarks/baselines/graph.json [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+if not settings.configured:
+    # No database: patient contexts are seeded in the cache and checkpoints and pending summaries stay in memory.
+    os.environ.setdefault("GRAPH_CHECKPOINTER", "memory")
+    settings.configure(
+        INSTALLED_APPS=["django.contrib.contenttypes", "django.contrib.auth", "chatbot", "patients"],
+        DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+        USE_TZ=True,
+    )
+
+import django
+
+django.setup()
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langgraph.checkpoint.memory import MemorySaver
+
+from fake_backends import (
+    EXTRACTION, FakeNeo4j, FakePineconeIndex, HashingEmbeddings, ScriptedLLM, fake_knowledge_graph, fake_pinecone_store,
+    reference_corpus,
+)
+from chatbot.core.embedding_cache import CachedEmbeddings
+from chatbot.core.healthmate_graph import compile_graph
+from chatbot.core.intent_router import IntentRouter, seed_training_set
+from chatbot.core.llm_adapters.llm_cache import LLMResponseCache
+from chatbot.core.llm_adapters.llm_manager import LLMManager
+from chatbot.core.patient_context import DEFAULT_PATIENT_EMAIL, PatientContext, PatientContextProvider
+from chatbot.core.semantic_cache import SemanticResponseCache
+from chatbot.core.services import services
+from chatbot.views import build_input_message, turn_config
+
+# (user message, path). Paths ending in "_confirm" give the details the appointment/treatment node asked for.
+SCRIPTS = {
+    "assistant": [
+        ("What should I do about a headache that keeps coming back in the afternoon?", "assistant"),
+        ("Is it fine to exercise with a mild cold?", "assistant"),
+        ("How much water should I drink on a hot day?", "assistant"),
+    ],
+    "knowledge_graph": [
+        ("Which medication am I taking at the moment?", "knowledge_graph"),
+        ("Could that explain why I feel tired after lunch?", "knowledge_graph"),
+        ("What can I do about it?", "assistant"),
+    ],
+    "appointment": [
+        ("I need to reschedule my appointment with my doctor.", "appointment"),
+        ("Next Friday at 10 in the morning would be best.", "appointment_confirm"),
+    ],
+    "treatment": [
+        ("Can we change my medication? The current dose upsets my stomach.", "treatment"),
+        ("I would like to take 500mg of Metformin twice a day instead.", "treatment_confirm"),
+    ],
+    "end": [
+        ("Who do you think will win the football league this year?", "end"),
+    ],
+    "long": [
+        ("I have type 2 diabetes and I take Metformin every morning.", "assistant"),
+        ("My knee has been hurting when I climb stairs.", "assistant"),
+        ("I also sleep badly, maybe five hours a night.", "assistant"),
+        ("What medication am I taking again?", "knowledge_graph"),
+        ("Should I be worried about my blood sugar at night?", "assistant"),
+        ("I want to move my appointment.", "appointment"),
+        ("Tuesday afternoon at 3 works for me.", "appointment_confirm"),
+        ("Any tips for eating better at work?", "assistant"),
+        ("Is walking good for my knee?", "assistant"),
+        ("Thanks, what should I ask my doctor next time?", "assistant"),
+    ],
+}
+
+PATIENT = PatientContext(
+    patient_id=1, email=DEFAULT_PATIENT_EMAIL, first_name="John", last_name="Doe",
+    next_appointment=None, doctor_name="Dr. Smith",
+    context=("My name is John Doe. I was born on 1975-04-12. My medical condition is type 2 diabetes. "
+             "I am taking Metformin 500mg. My next appointment is on 2024-11-04 09:30 with Dr. Smith."),
+)
+
+
+def register_fakes(args):
+    paths = {message: path for script in SCRIPTS.values() for message, path in script}
+    if args.embeddings == "synthetic":
+        from bench_embedding_server import SYNTHETIC, load_embeddings
+        base = load_embeddings(SYNTHETIC)
+    else:
+        base = HashingEmbeddings()
+    embeddings = CachedEmbeddings(base, max_entries=4096)
+    neo4j = FakeNeo4j(rtt=args.kg_rtt_ms / 1000)
+    neo4j.seed(EXTRACTION["entities"], EXTRACTION["relationships"])
+    index = FakePineconeIndex(latency=args.vector_latency_ms / 1000)
+    store = fake_pinecone_store(embeddings, index)
+    store.add_texts(reference_corpus())
+    patients = PatientContextProvider(ttl_seconds=float("inf"))
+    patients._store(PATIENT.email, PATIENT)
+    llm = ScriptedLLM(paths, latency=args.llm_latency_ms / 1000, answer_chars=args.answer_chars)
+
+    # Without --warm-caches every turn does the full work: identical scripted turns would otherwise be
+    # answered from the exact-match LLM cache or the semantic cache from the second round on.
+    services.register("llm", lambda: LLMManager(llm_instance=llm, cache=LLMResponseCache(max_entries=512 if args.warm_caches else 0)))
+    services.register("kg", lambda: fake_knowledge_graph(neo4j))
+    services.register("embeddings", lambda: embeddings)
+    services.register("vector_store", lambda: store)
+    services.register("semantic_cache", lambda: SemanticResponseCache(threshold=0.92 if args.warm_caches else 2.0))
+    services.register("patient_contexts", lambda: patients)
+    # The scripts decide the route, so the local router runs (its cost is measured) but never answers.
+    services.register("intent_router", lambda: IntentRouter.fit(embeddings.embed_documents(seed_training_set()[0]), seed_training_set()[1], threshold=2.0))
+    return llm, neo4j, index
+
+
+class NodeTimer(BaseCallbackHandler):
+    """
+    Records the duration, or with `track_allocations` the allocations, of every graph node run.
+    """
+    run_inline = True
+
+    def __init__(self, track_allocations=False):
+        self.track_allocations = track_allocations
+        self.seconds = defaultdict(list)
+        self.peak_bytes = defaultdict(list)
+        self.net_bytes = defaultdict(list)
+        self._open = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, tags=None, metadata=None, **kwargs):
+        # Node runs are the direct children of the graph run, tagged with their superstep.
+        node = (metadata or {}).get("langgraph_node")
+        if not node or node.startswith("__") or not any(tag.startswith("graph:step:") for tag in tags or ()):
+            return
+        in_use = 0
+        if self.track_allocations:
+            # Resets the tracer's global peak, so this pass must not also measure whole turns.
+            tracemalloc.reset_peak()
+            in_use = tracemalloc.get_traced_memory()[0]
+        self._open[run_id] = (node, time.perf_counter(), in_use)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        entry = self._open.pop(run_id, None)
+        if entry is None:
+            return
+        node, started, in_use = entry
+        if self.track_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak_bytes[node].append(peak - in_use)
+            self.net_bytes[node].append(current - in_use)
+        else:
+            self.seconds[node].append(time.perf_counter() - started)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._open.pop(run_id, None)
+
+
+async def arun_turn(graph, message, thread_id, new_thread, callbacks):
+    config = {**turn_config(thread_id, DEFAULT_PATIENT_EMAIL), "callbacks": callbacks}
+    async for _ in graph.astream(build_input_message(message, new_thread), config=config, stream_mode="updates"):
+        pass
+
+
+def run_turn(graph, message, thread_id, new_thread, callbacks):
+    config = {**turn_config(thread_id, DEFAULT_PATIENT_EMAIL), "callbacks": callbacks}
+    for _ in graph.stream(build_input_message(message, new_thread), config=config, stream_mode="updates"):
+        pass
+
+
+# For each background worker: its counter of queued jobs, and the counters that reach it once they have all finished.
+FINISHED_JOBS = {
+    "summarizer": ("submitted", ("completed", "failed")),
+    "extraction_worker": ("submitted", ("processed", "failed")),
+    "semantic_cache": ("fills_submitted", ("fills", "fill_failures")),
+}
+
+
+def drain_background_work(timeout=30.0):
+    # Summaries, extractions and semantic cache fills finish between turns, so they neither overlap the next
+    # sample nor leak their allocations into it, and every turn sees the summary its predecessor queued.
+    deadline = time.monotonic() + timeout
+    for name, (queued, finished) in FINISHED_JOBS.items():
+        if not services.is_loaded(name):
+            continue
+        worker = services.get(name)
+        while True:
+            stats = worker.stats()
+            if sum(stats[key] for key in finished) >= stats[queued]:
+                break
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{name} did not finish its jobs within {timeout}s: {stats}")
+            time.sleep(0.0005)
+
+
+def run_conversations(rounds, use_sync, timer=None, track_turn_allocations=False):
+    """
+    Runs every script `rounds` times. Returns the per-turn samples keyed by "turn" and "turn:<path>": seconds,
+    or (peak, net) allocated bytes with `track_turn_allocations`. Node samples go to `timer`.
+    """
+    callbacks = [timer] if timer is not None else []
+    turns = defaultdict(list)
+
+    async def drive():
+        for _ in range(rounds):
+            for script in SCRIPTS.values():
+                # Each conversation gets its own in-memory checkpointer: a database checkpointer does not grow
+                # in process, and a shared MemorySaver would make later samples pay for its dicts resizing.
+                graph = compile_graph(MemorySaver())
+                thread_id = str(uuid.uuid4())
+                for position, (message, path) in enumerate(script):
+                    if track_turn_allocations:
+                        tracemalloc.reset_peak()
+                        in_use = tracemalloc.get_traced_memory()[0]
+                    started = time.perf_counter()
+                    if use_sync:
+                        run_turn(graph, message, thread_id, position == 0, callbacks)
+                    else:
+                        await arun_turn(graph, message, thread_id, position == 0, callbacks)
+                    if track_turn_allocations:
+                        current, peak = tracemalloc.get_traced_memory()
+                        sample = (peak - in_use, current - in_use)
+                    else:
+                        sample = time.perf_counter() - started
+                    turns["turn"].append(sample)
+                    turns[f"turn:{path.removesuffix('_confirm')}"].append(sample)
+                    drain_background_work()
+
+    asyncio.run(drive())
+    return turns
+
+
+def percentile(sorted_values, q):
+    return sorted_values[round(q * (len(sorted_values) - 1))]
+
+
+def latency_row(seconds):
+    values = sorted(value * 1000 for value in seconds)
+    return {"count": len(values), "p50_ms": percentile(values, 0.50), "p95_ms": percentile(values, 0.95), "p99_ms": percentile(values, 0.99)}
+
+
+def allocation_row(peaks, nets):
+    # Medians: the summarizer and extraction threads allocate too, and now and then land inside a sample.
+    return {"alloc_peak_kib": percentile(sorted(peaks), 0.5) / 1024, "alloc_net_kib": percentile(sorted(nets), 0.5) / 1024}
+
+
+def collect(args):
+    # Warm-up conversation: first-call costs (tool binding, tokenizer, subgraph load) are not per turn.
+    run_conversations(1, args.sync)
+    timer = NodeTimer()
+    turns = run_conversations(args.rounds, args.sync, timer)
+    results = {name: latency_row(samples) for name, samples in sorted(timer.seconds.items())}
+    results.update({name: latency_row(samples) for name, samples in sorted(turns.items())})
+    if not args.no_allocations:
+        # Nodes and whole turns are measured in separate passes: both need the tracer's peak reset at their start.
+        allocation_rounds = max(1, args.rounds // 2)
+        tracemalloc.start()
+        allocation_timer = NodeTimer(track_allocations=True)
+        run_conversations(allocation_rounds, args.sync, allocation_timer)
+        allocation_turns = run_conversations(allocation_rounds, args.sync, track_turn_allocations=True)
+        tracemalloc.stop()
+        for name in allocation_timer.peak_bytes:
+            results[name].update(allocation_row(allocation_timer.peak_bytes[name], allocation_timer.net_bytes[name]))
+        for name, samples in allocation_turns.items():
+            results[name].update(allocation_row([peak for peak, _ in samples], [net for _, net in samples]))
+    return results
+
+
+def report(results):
+    print(f"{'':<34} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'peak KiB':>9} {'net KiB':>8}")
+    for name, row in results.items():
+        allocations = f"{row['alloc_peak_kib']:9.1f} {row['alloc_net_kib']:8.1f}" if "alloc_peak_kib" in row else ""
+        if name == "turn":
+            print()
+        print(f"{name:<34} {row['count']:>6} {row['p50_ms']:8.2f} {row['p95_ms']:8.2f} {row['p99_ms']:8.2f} {allocations}")
+
+
+def compare(results, baseline, tolerance, min_ms, min_kib):
+    """
+    Prints what got slower or allocates more than the baseline; returns the number of regressions.
+    """
+    regressions = 0
+    for name, row in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key, floor in (("p50_ms", min_ms), ("p95_ms", min_ms), ("alloc_peak_kib", min_kib)):
+            if key not in row or key not in base:
+                continue
+            if key == "p95_ms" and row["count"] < 20:
+                continue  # With fewer samples p95 is the slowest one.
+            if row[key] > base[key] * (1 + tolerance) and row[key] - base[key] > floor:
+                regressions += 1
+                print(f"REGRESSION {name} {key}: {base[key]:.2f} -> {row[key]:.2f} ({row[key] / base[key] - 1:+.0%})" if base[key] else
+                      f"REGRESSION {name} {key}: {base[key]:.2f} -> {row[key]:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=10, help="Times every script is run (each time on a new thread).")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--kg-rtt-ms", type=float, default=0.0, help="Charged per Neo4j query and per commit.")
+    parser.add_argument("--vector-latency-ms", type=float, default=0.0)
+    parser.add_argument("--answer-chars", type=int, default=600)
+    parser.add_argument("--embeddings", choices=["hashing", "synthetic"], default="hashing")
+    parser.add_argument("--warm-caches", action="store_true", help="Let repeated turns hit the LLM response and semantic caches.")
+    parser.add_argument("--sync", action="store_true", help="Use graph.stream (WSGI) instead of graph.astream (ASGI).")
+    parser.add_argument("--no-allocations", action="store_true", help="Skip the tracemalloc pass.")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--baseline", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--min-delta-ms", type=float, default=0.2)
+    parser.add_argument("--min-delta-kib", type=float, default=32.0)
+    args = parser.parse_args()
+
+    llm, neo4j, index = register_fakes(args)
+    started = time.perf_counter()
+    results = collect(args)
+    turns = results["turn"]["count"]
+    print(f"{turns} turns in {time.perf_counter() - started:.1f}s ({'sync' if args.sync else 'async'}), "
+          f"LLM {args.llm_latency_ms:g} ms, Neo4j {args.kg_rtt_ms:g} ms, vector search {args.vector_latency_ms:g} ms; "
+          f"{llm.calls} LLM calls, {neo4j.queries} Neo4j queries, {index.queries} vector queries over all passes")
+    report(results)
+    services.get("extraction_worker").shutdown()
+    services.get("summarizer").shutdown()
+
+    options = {key: value for key, value in vars(args).items() if key not in ("save_baseline", "baseline", "tolerance", "min_delta_ms", "min_delta_kib")}
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump({"options": options, "python": platform.python_version(), "cpus": os.cpu_count(), "results": results}, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["options"] != options:
+            print(f"Note: baseline was recorded with different options: {baseline['options']}")
+        regressions = compare(results, baseline["results"], args.tolerance, args.min_delta_ms, args.min_delta_kib)
+        print(f"{regressions} regression(s) against {args.baseline}" if regressions else f"No regressions against {args.baseline}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Conversation history search on a large synthetic history: indexed database search vs the old scan.
+
+Fills ConversationHistory with synthetic turns for one benchmark session (1M rows by default, written with
+COPY) and times search_history for a rare term, a common term, a substring, a case-sensitive and a
+user-only search, next to the previous implementation: a Python loop lowercasing every message of the
+history on each request. Prints the query plan of each search so index use can be checked. Needs the
+project's Postgres database with migrations applied; the benchmark rows are deleted afterwards unless
+--keep is given.
+
+    python benchmarks/bench_history_search.py [--rows 1000000] [--runs 20] [--page-size 20]
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "healthmate.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from chatbot.history_search import search_history
+from chatbot.models import ConversationHistory
+
+PATIENT = "bench-history@example.com"
+SESSION = "bench-history"
+WORDS = ("headache fever cough sleep diet exercise stress blood pressure sugar insulin dose tablet water pain back knee "
+         "appointment doctor morning evening week month allergy rash vitamin iron heart rate walking anxiety").split()
+USER_TEMPLATES = ["I have had {a} and {b} since last {c}", "Can I take my {a} with {b}?", "What helps with {a} at {c}?"]
+BOT_TEMPLATES = ["For {a} try to keep your {b} steady and see your doctor if it lasts more than a {c}.",
+                 "Rest, drink water and track your {a}; {b} can make it worse."]
+RARE = "Zolmitriptan"
+
+
+def synthetic_rows(count, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        a, b, c = rng.sample(WORDS, 3)
+        user = rng.choice(USER_TEMPLATES).format(a=a, b=b, c=c)
+        bot = rng.choice(BOT_TEMPLATES).format(a=a, b=b, c=c)
+        if i % 50000 == 0:
+            user += f" Is {RARE} safe?"
+        yield user, bot, f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}"
+
+
+def load(count, batch=100000):
+    table = ConversationHistory._meta.db_table
+    rows = synthetic_rows(count)
+    with connection.cursor() as cursor:
+        for start in range(0, count, batch):
+            buffer = io.StringIO()
+            for user, bot, date in (next(rows) for _ in range(min(batch, count - start))):
+                buffer.write(f"{user}\t{bot}\t{date} 12:00:00+00\t{date}\t{SESSION}\t{PATIENT}\t\n")
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"COPY {table} (user_message, bot_response, timestamp, date, session_id, patient_email, route) FROM STDIN", buffer,
+            )
+        cursor.execute(f"ANALYZE {table}")
+
+
+def old_scan(history, keyword, case_sensitive=False, filter_user=False, filter_bot=False):
+    """
+    The previous search_conversation_history loop, over the same history.
+    """
+    matches = []
+    search_keyword = keyword.lower()
+    for date, conversations in history.items():
+        for convo in conversations:
+            message, sender = convo["message"], convo["sender"]
+            if not case_sensitive:
+                message = message.lower()
+            if filter_user and sender != "user":
+                continue
+            if filter_bot and sender != "bot":
+                continue
+            if search_keyword in message:
+                matches.append({"date": date, "sender": sender, "message": convo["message"]})
+    return matches
+
+
+def session_history():
+    history = {}
+    for user, bot, date in ConversationHistory.objects.filter(session_id=SESSION).values_list("user_message", "bot_response", "date").iterator(chunk_size=20000):
+        history.setdefault(str(date), []).extend([{"sender": "user", "message": user}, {"sender": "bot", "message": bot}])
+    return history
+
+
+def timed(function, runs):
+    timings = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[round(0.95 * (len(timings) - 1))], result
+
+
+def query_plan(function):
+    with CaptureQueriesContext(connection) as queries:
+        function()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN " + queries.captured_queries[-1]["sql"])
+        return [line for line, in cursor.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--scan-runs", type=int, default=3, help="Runs of the old Python scan, which is slow.")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic rows for another run.")
+    args = parser.parse_args()
+
+    history = ConversationHistory.objects.filter(session_id=SESSION)
+    existing = history.count()
+    if existing != args.rows:
+        history.delete()
+        started = time.perf_counter()
+        load(args.rows)
+        print(f"Loaded {args.rows} rows in {time.perf_counter() - started:.1f}s")
+    searches = [
+        ("rare word", dict(keyword=RARE)),
+        ("common word", dict(keyword="headache")),
+        ("substring", dict(keyword="ache")),
+        ("case-sensitive", dict(keyword=RARE, case_sensitive=True)),
+        ("user only", dict(keyword="insulin", filter_user=True)),
+    ]
+    print(f"{args.rows} turns, page size {args.page_size}")
+    print(f"{'search':<16} {'indexed p50':>12} {'p95':>9} {'old scan p50':>13}")
+    scanned = session_history() if args.scan_runs else None
+    try:
+        for label, options in searches:
+            p50, p95, _ = timed(lambda: search_history(history, page_size=args.page_size, **options), args.runs)
+            scan = timed(lambda: old_scan(scanned, **options), args.scan_runs)[0] if scanned is not None else float("nan")
+            print(f"{label:<16} {p50:9.1f} ms {p95:6.1f} ms {scan:10.1f} ms")
+        for label, options in searches:
+            print(f"\n{label}:")
+            print("\n".join(query_plan(lambda: search_history(history, page_size=args.page_size, **options))))
+    finally:
+        if not args.keep:
+            history.delete()
+
+
+if __name__ == "__main__":
+    main()
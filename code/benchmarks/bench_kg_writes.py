@@ -0,0 +1,186 @@
+"""
+Per-item vs batched knowledge graph writes.
+
+The old `store_entities_and_relationships` opened one session and ran one auto-commit query per
+entity and per relationship; the batched path sends UNWIND batches inside a single write transaction.
+By default both run against an in-memory Neo4j stand-in that charges a fixed round-trip per query
+and per commit, so the numbers show the round-trip savings without a database. Pass --uri to run
+against a real (scratch!) Neo4j instead.
+
+    python benchmarks/bench_kg_writes.py [--entities 15] [--relationships 15] [--rtt-ms 1.0] [--runs 20]
+    python benchmarks/bench_kg_writes.py --uri bolt://localhost:7687 --user neo4j --password secret
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot.core.knowledge_graph import (
+    KnowledgeGraph, PoolMetrics, MERGE_ENTITIES_QUERY, MERGE_RELATIONSHIPS_QUERY, MERGE_ENTITY_QUERY, MERGE_RELATIONSHIP_QUERY,
+)
+
+
+class FakeResult:
+    def __init__(self, merged, nodes_created, relationships_created):
+        self.merged = merged
+        self.summary = SimpleNamespace(counters=SimpleNamespace(nodes_created=nodes_created, relationships_created=relationships_created))
+
+    def single(self):
+        return {"merged": self.merged}
+
+    def consume(self):
+        return self.summary
+
+
+class FakeGraph:
+    """
+    Just enough of Neo4j's MERGE semantics for the two write paths, plus simulated network latency.
+    """
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.nodes = set()
+        self.edges = set()
+        self.round_trips = 0
+
+    def round_trip(self):
+        self.round_trips += 1
+        time.sleep(self.rtt)
+
+    def merge_entity(self, name, type):
+        created = (name, type) not in self.nodes
+        self.nodes.add((name, type))
+        return created
+
+    def merge_relationship(self, entity1, relationship, entity2):
+        sources = [node for node in self.nodes if node[0] == entity1]
+        targets = [node for node in self.nodes if node[0] == entity2]
+        merged = created = 0
+        for source in sources:
+            for target in targets:
+                merged += 1
+                if (source, relationship, target) not in self.edges:
+                    self.edges.add((source, relationship, target))
+                    created += 1
+        return merged, created
+
+    def run(self, query, **params):
+        self.round_trip()
+        if query == MERGE_ENTITIES_QUERY:
+            created = sum(self.merge_entity(e["name"], e["type"]) for e in params["entities"])
+            return FakeResult(len(params["entities"]), created, 0)
+        if query == MERGE_RELATIONSHIPS_QUERY:
+            merged = created = 0
+            for rel in params["relationships"]:
+                m, c = self.merge_relationship(rel["from"], rel["relationship"], rel["to"])
+                merged += m
+                created += c
+            return FakeResult(merged, 0, created)
+        if "name" in params:
+            return FakeResult(1, int(self.merge_entity(params["name"], params["type"])), 0)
+        merged, created = self.merge_relationship(params["entity1"], params["relationship"], params["entity2"])
+        return FakeResult(merged, 0, created)
+
+
+class FakeSession:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, **params):
+        return self.graph.run(query, **params)
+
+    def execute_write(self, work, *args):
+        result = work(self.graph, *args)
+        self.graph.round_trip()  # COMMIT
+        return result
+
+
+class FakeDriver:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def session(self):
+        return FakeSession(self.graph)
+
+
+def fake_knowledge_graph(rtt, batch_size):
+    kg = KnowledgeGraph.__new__(KnowledgeGraph)
+    kg.driver = FakeDriver(FakeGraph(rtt))
+    kg.write_batch_size = batch_size
+    kg.metrics = PoolMetrics()
+    return kg
+
+
+def make_extraction(run, entities, relationships):
+    names = [f"bench-{run}-entity-{i}" for i in range(entities)]
+    entity_list = [{"name": name, "type": "Condition"} for name in names]
+    relationship_list = [
+        {"from": names[i % entities], "relationship": "RELATED_TO", "to": names[(i + 1) % entities]}
+        for i in range(relationships)
+    ]
+    return entity_list, relationship_list
+
+
+def per_item_store(kg, entities, relationships):
+    # The old path: a new session and an auto-commit query per entity and per relationship.
+    for entity in entities:
+        with kg.driver.session() as session:
+            session.run(MERGE_ENTITY_QUERY, name=entity['name'], type=entity['type']).consume()
+    for relationship in relationships:
+        with kg.driver.session() as session:
+            session.run(MERGE_RELATIONSHIP_QUERY, entity1=relationship['from'], entity2=relationship['to'], relationship=relationship['relationship']).consume()
+
+
+def measure(label, kg, store, args, offset):
+    timings = []
+    for run in range(args.runs):
+        entities, relationships = make_extraction(offset + run, args.entities, args.relationships)
+        started = time.perf_counter()
+        counts = store(kg, entities, relationships)
+        timings.append(time.perf_counter() - started)
+    timings = sorted(t * 1000 for t in timings)
+    p95 = timings[round(0.95 * (len(timings) - 1))]
+    print(f"{label:<10} mean {statistics.mean(timings):8.2f} ms   p95 {p95:8.2f} ms")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=15)
+    parser.add_argument("--relationships", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="Simulated round-trip per query/commit.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--uri")
+    parser.add_argument("--user", default="neo4j")
+    parser.add_argument("--password", default="")
+    args = parser.parse_args()
+
+    if args.uri:
+        kg = KnowledgeGraph(args.uri, args.user, args.password, write_batch_size=args.batch_size)
+        per_item_kg = batched_kg = kg
+    else:
+        per_item_kg = fake_knowledge_graph(args.rtt_ms / 1000, args.batch_size)
+        batched_kg = fake_knowledge_graph(args.rtt_ms / 1000, args.batch_size)
+
+    print(f"{args.entities} entities + {args.relationships} relationships per extraction, {args.runs} runs")
+    measure("per-item", per_item_kg, per_item_store, args, 0)
+    counts = measure("batched", batched_kg, KnowledgeGraph.store_entities_and_relationships, args, args.runs)
+    print(f"last batched write: {counts}")
+    if not args.uri:
+        print(f"round-trips: per-item {per_item_kg.driver.graph.round_trips}, batched {batched_kg.driver.graph.round_trips}")
+    else:
+        kg.close()
+
+
+if __name__ == "__main__":
+    main()
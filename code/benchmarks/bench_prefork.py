@@ -0,0 +1,121 @@
+"""
+Memory per worker and throughput scaling of the preforking server mode.
+
+Forks worker processes the way gunicorn does with gunicorn.conf.py (chatbot.core.prefork.preload in the
+master, after_fork in each worker) and has every worker embed queries as fast as it can for a fixed time,
+so the numbers cover the CPU-bound part of a chat turn that runs in the worker. Each worker count runs
+twice: with the model preloaded in the master and shared copy-on-write, and with every worker loading its
+own copy (what happens without preload_app). Memory is read from /proc/<pid>/smaps_rollup: RSS counts
+shared pages in full in every worker, PSS splits them between the processes sharing them, USS is what a
+worker holds on its own.
+
+The model is the synthetic MiniLM-shaped BERT from bench_embedding_server.py unless --model is given.
+
+    python benchmarks/bench_prefork.py [--workers 1 2 4] [--seconds 5] [--model sentence-transformers/all-MiniLM-L6-v2]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from bench_embedding_server import SYNTHETIC, load_embeddings
+from chatbot.core.prefork import after_fork, preload, set_torch_threads
+from chatbot.core.services import services
+
+
+def memory_mb(pid="self"):
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1]) / 1024
+    return {
+        "rss": values.get("Rss", 0.0),
+        "pss": values.get("Pss", 0.0),
+        "uss": values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0),
+    }
+
+
+def worker(preloaded, seconds, ready_w, start_r, result_w):
+    after_fork()
+    embeddings = services.get("embeddings")
+    if not preloaded:
+        embeddings.embed_query("warmup")
+    os.write(ready_w, b"r")
+    os.read(start_r, 1)
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        embeddings.embed_query(f"Is it safe to take ibuprofen number {count} after a meal with high blood pressure?")
+        count += 1
+    os.write(result_w, (json.dumps({"queries": count, **memory_mb()}) + "\n").encode())
+    os._exit(0)
+
+
+def run(workers, preloaded, seconds):
+    ready_r, ready_w = os.pipe()
+    start_r, start_w = os.pipe()
+    result_r, result_w = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            worker(preloaded, seconds, ready_w, start_r, result_w)
+        pids.append(pid)
+    for _ in range(workers):
+        os.read(ready_r, 1)
+    started = time.perf_counter()
+    os.write(start_w, b"s" * workers)
+    results = []
+    with os.fdopen(result_r) as lines:
+        os.close(result_w)
+        for _ in range(workers):
+            results.append(json.loads(lines.readline()))
+    elapsed = time.perf_counter() - started
+    for pid in pids:
+        os.waitpid(pid, 0)
+    for fd in (ready_r, ready_w, start_r, start_w):
+        os.close(fd)
+    average = lambda key: sum(result[key] for result in results) / workers
+    return sum(result["queries"] for result in results) / elapsed, average("rss"), average("pss"), average("uss")
+
+
+def report(label, workers, result, baseline):
+    throughput, rss, pss, uss = result
+    print(f"{label:<10} {workers:>7} {throughput:9.1f} q/s {throughput / baseline:6.2f}x {rss:9.1f} {pss:9.1f} {uss:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=SYNTHETIC)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    services.register("embeddings", lambda: load_embeddings(args.model), fork_safe=True)
+    print(f"{os.cpu_count()} CPU(s), {args.seconds:.0f}s per run, memory per worker in MB")
+    print(f"{'mode':<10} {'workers':>7} {'throughput':>13} {'scaling':>7} {'RSS':>9} {'PSS':>9} {'USS':>9}")
+    # Without preloading first, while the master still has no model of its own.
+    set_torch_threads(1)
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, False, args.seconds)
+        baseline = baseline or result[0] / workers
+        report("per-worker", workers, result, baseline)
+    preload(["embeddings"])
+    print(f"master after preload: RSS {memory_mb()['rss']:.1f} MB")
+    for workers in args.workers:
+        report("preloaded", workers, run(workers, True, args.seconds), baseline)
+
+
+if __name__ == "__main__":
+    main()
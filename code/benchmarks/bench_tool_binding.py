@@ -0,0 +1,88 @@
+"""
+Per-call overhead of tool binding in LLMManager.
+
+Compares the old bind -> generate -> reset sequence, which rebuilt the chat client on every
+routing call, against the cached bound runnables handed out by `LLMManager.get_runnable`.
+Only client construction and binding are measured, no request is sent to the provider.
+
+    python benchmarks/bench_tool_binding.py [--calls 2000] [--threads 16]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.tools import tool
+from langchain_openai import ChatOpenAI
+from chatbot.core.llm_adapters.openai_adapter import OpenAIAdapter
+from chatbot.core.llm_adapters.llm_manager import LLMManager
+
+
+@tool
+def change_request_tool():
+    "This is the change_request_tool"
+
+@tool
+def assistant_tool():
+    "This is the assistant_tool"
+
+@tool
+def change_state_tool(state):
+    """This is the "change_state_tool"."""
+
+TOOL_SETS = [[change_request_tool, assistant_tool], [change_state_tool]]
+
+
+def legacy_call(adapter, tools):
+    # LLMManager.bind_tools, generate_response(bind_tools=True) and the two reset_tools calls
+    adapter.client = adapter.client.bind_tools(tools)
+    adapter.client = adapter.client.bind_tools(tools)
+    adapter.client = ChatOpenAI(api_key=adapter.api_key, model=adapter.model_name)
+    adapter.client = ChatOpenAI(api_key=adapter.api_key, model=adapter.model_name)
+
+
+def cached_call(manager, tools):
+    manager.get_runnable(tools)
+
+
+def measure(label, fn, target, calls):
+    started = time.perf_counter()
+    for i in range(calls):
+        fn(target, TOOL_SETS[i % len(TOOL_SETS)])
+    per_call = (time.perf_counter() - started) / calls
+    print(f"{label:<10} {per_call * 1e6:10.1f} us/call")
+    return per_call
+
+
+def check_concurrent_bindings(manager, threads, calls):
+    def worker(i):
+        tools = TOOL_SETS[i % len(TOOL_SETS)]
+        bound = manager.get_runnable(tools)
+        names = [t["function"]["name"] for t in bound.kwargs["tools"]]
+        return names == [t.name for t in tools]
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(worker, range(calls)))
+    print(f"concurrent bindings correct: {all(results)} ({calls} calls on {threads} threads)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    adapter = OpenAIAdapter(api_key="sk-benchmark", model_name="gpt-4")
+    manager = LLMManager(OpenAIAdapter(api_key="sk-benchmark", model_name="gpt-4"))
+
+    legacy = measure("legacy", legacy_call, adapter, args.calls)
+    cached = measure("cached", cached_call, manager, args.calls)
+    print(f"speedup    {legacy / cached:10.1f}x")
+    check_concurrent_bindings(manager, args.threads, args.calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Recall and latency of the local memory-mapped vector store.
+
+Builds a LocalVectorStore from synthetic clustered embeddings (MiniLM-sized by default) in a temporary
+directory, then compares IVF search at several nprobe settings against exact brute-force search.
+No embedding model or network access is needed.
+
+    python benchmarks/bench_vector_store.py [--vectors 100000] [--dim 384] [--queries 200] [--k 4]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot.core.local_vector_store import LocalVectorStore
+
+
+def clustered_vectors(rng, count, dim, clusters):
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(clusters, size=count)
+    return centers[labels] + 0.6 * rng.normal(size=(count, dim)).astype(np.float32)
+
+
+def timed_search(store, queries, k, **kwargs):
+    results = []
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        rows, _ = store.search_rows(query, k, **kwargs)
+        timings.append(time.perf_counter() - started)
+        results.append(set(rows.tolist()))
+    timings = np.asarray(timings) * 1000
+    return results, np.percentile(timings, 50), np.percentile(timings, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=10000, help="Rows per append, exercises incremental appends.")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(rng, args.vectors, args.dim, args.clusters)
+    queries = vectors[rng.choice(args.vectors, args.queries, replace=False)] + 0.3 * rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStore(path, embeddings=None, ivf_min_vectors=args.vectors + 1)
+        started = time.perf_counter()
+        for offset in range(0, args.vectors, args.batch):
+            batch = vectors[offset:offset + args.batch]
+            store.add_embeddings([f"doc {offset + i}" for i in range(len(batch))], batch)
+        print(f"appended {len(store)} x {args.dim} vectors in {time.perf_counter() - started:.2f} s")
+        started = time.perf_counter()
+        store.build_index()
+        print(f"built IVF index with {len(store.ivf.centroids)} lists in {time.perf_counter() - started:.2f} s")
+
+        exact, p50, p95 = timed_search(store, queries, args.k, exact=True)
+        print(f"{'exact':<12} recall@{args.k} 1.000   p50 {p50:7.2f} ms   p95 {p95:7.2f} ms")
+        for nprobe in args.nprobe:
+            approximate, p50, p95 = timed_search(store, queries, args.k, nprobe=nprobe)
+            recall = np.mean([len(a & e) / len(e) for a, e in zip(approximate, exact)])
+            print(f"{'ivf/' + str(nprobe):<12} recall@{args.k} {recall:.3f}   p50 {p50:7.2f} ms   p95 {p95:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
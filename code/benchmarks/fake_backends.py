@@ -0,0 +1,404 @@
+"""
+Deterministic in-process stand-ins for the LLM provider, Neo4j and Pinecone, for driving the compiled graph
+without network services. Each one replaces only the transport: the graph still goes through the real
+LLMManager, KnowledgeGraph (with its subgraph cache) and PineconeStore code, and every call can be charged
+a fixed latency.
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+import zlib
+from types import SimpleNamespace
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from chatbot.core.knowledge_graph import (
+    KnowledgeGraph, LOAD_DESCENDANTS_QUERY, LOAD_USER_SUBGRAPH_QUERY, MERGE_ENTITIES_QUERY, MERGE_RELATIONSHIPS_QUERY,
+)
+from chatbot.core.llm_adapters.llm_interface import LLMInterface
+from chatbot.core.pinecone_store import PineconeStore
+
+
+def pause(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+async def apause(seconds):
+    if seconds > 0:
+        await asyncio.sleep(seconds)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Bag of hashed words, L2-normalised: texts sharing words are similar, which is all the router, the
+    context packer and the semantic cache need from the vectors here. No model, no download.
+    """
+    model_name = "hashing-384"
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def embed_query(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            digest = zlib.crc32(word.strip(".,;:!?\"'()").encode())
+            vector[digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+# Path of each scripted user message; decides which tool the scripted LLM calls.
+ORCHESTRATOR_TOOLS = {
+    "assistant": "assistant_tool",
+    "knowledge_graph": "query_knowledge_graph_tool",
+    "appointment": "change_request_tool",
+    "treatment": "change_request_tool",
+    "end": "end_tool",
+}
+
+ANSWER = (
+    "Staying hydrated, sleeping seven to nine hours and keeping a regular meal schedule help most people "
+    "feel better. If the symptoms persist for more than a few days, get worse, or come with a high fever, "
+    "chest pain or shortness of breath, contact your doctor or seek urgent care. Keep taking your regular "
+    "medication as prescribed unless your doctor tells you otherwise, and note down when the symptoms "
+    "started and what makes them better or worse so you can share it at your next appointment. "
+)
+
+EXTRACTION = {
+    "entities": [
+        {"name": "User", "type": "Person"},
+        {"name": "Metformin", "type": "Medication"},
+        {"name": "Type 2 Diabetes", "type": "Condition"},
+        {"name": "Knee Pain", "type": "Symptom"},
+    ],
+    "relationships": [
+        {"from": "User", "to": "Metformin", "relationship": "takes"},
+        {"from": "User", "to": "Type 2 Diabetes", "relationship": "has"},
+        {"from": "User", "to": "Knee Pain", "relationship": "experiences"},
+    ],
+}
+
+
+def tool_call(name, args):
+    # Same shape as the provider adapters return, tool calls mirrored in additional_kwargs.
+    call_id = f"call_{uuid.uuid4().hex[:24]}"
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": name, "args": args, "id": call_id}],
+        additional_kwargs={"tool_calls": [{"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}]},
+    )
+
+
+def last_human_message(messages):
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content
+    return ""
+
+
+class ScriptedLLM(LLMInterface):
+    """
+    Answers like the provider would for each prompt the graph sends, following `paths`, which maps a user
+    message to its path ("assistant", "knowledge_graph", "appointment", "treatment", "end"; the last two with
+    a "_confirm" suffix when the message gives the details and the change_state_tool should be called).
+    Every call sleeps `latency` seconds first.
+    """
+    model_name = "scripted"
+    temperature = 0
+
+    def __init__(self, paths, latency=0.0, answer_chars=600):
+        self.paths = paths
+        self.latency = latency
+        self.answer = (ANSWER * (answer_chars // len(ANSWER) + 1))[:answer_chars]
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def bind_tools(self, tools):
+        return SimpleNamespace(
+            invoke=lambda messages, config=None: self.invoke(messages, config, tools),
+            ainvoke=lambda messages, config=None: self.ainvoke(messages, config, tools),
+        )
+
+    def invoke(self, messages, config=None, tools=()):
+        pause(self.latency)
+        return self.respond(messages, tools)
+
+    async def ainvoke(self, messages, config=None, tools=()):
+        await apause(self.latency)
+        return self.respond(messages, tools)
+
+    def respond(self, messages, tools=()):
+        with self._lock:
+            self.calls += 1
+        tool_names = {tool.name for tool in tools}
+        text = last_human_message(messages)
+        path = self.paths.get(text, "assistant")
+        if "assistant_tool" in tool_names:
+            return tool_call(ORCHESTRATOR_TOOLS[path.removesuffix("_confirm")], {})
+        if "appt_rescheduler_tool" in tool_names:
+            return tool_call("appt_rescheduler_tool" if path.startswith("appointment") else "treatment_change_tool", {})
+        if "change_state_tool" in tool_names:
+            if path == "appointment_confirm":
+                return tool_call("change_state_tool", {"state": "2024-11-08 10:00:00"})
+            if path == "treatment_confirm":
+                return tool_call("change_state_tool", {"state": json.dumps({"medication": "Metformin", "dosage": "500mg twice a day"})})
+            return AIMessage(content="Could you tell me which date, time or change you have in mind?")
+        system = messages[0].content if messages and isinstance(messages[0], SystemMessage) else ""
+        if text.startswith("Update the running summary"):
+            return AIMessage(content="The patient has type 2 diabetes, takes Metformin and asked about knee pain, sleep and an appointment change.")
+        if "Extract all health-related information" in system:
+            return AIMessage(content=json.dumps(EXTRACTION))
+        if "expert in querying graph databases" in system:
+            return AIMessage(content=json.dumps({"template": "entities", "types": ["Condition", "Medication"], "names": [], "relationships": []}))
+        return AIMessage(content=self.answer)
+
+
+class FakeResult:
+    def __init__(self, records=(), merged=0, nodes_created=0, relationships_created=0):
+        self.records = list(records)
+        self.merged = merged
+        self.summary = SimpleNamespace(counters=SimpleNamespace(nodes_created=nodes_created, relationships_created=relationships_created))
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def single(self):
+        return {"merged": self.merged}
+
+    def consume(self):
+        return self.summary
+
+
+class FakeAsyncResult:
+    def __init__(self, result):
+        self.result = result
+
+    async def __aiter__(self):
+        for record in self.result.records:
+            yield record
+
+    async def single(self):
+        return self.result.single()
+
+    async def consume(self):
+        return self.result.consume()
+
+
+class FakeNeo4j:
+    """
+    The (:Entity {name, type})-[:RELATIONSHIP {type}]->(:Entity) graph in memory, answering the queries
+    KnowledgeGraph sends: subgraph loads and the UNWIND merges. Generated Cypher returns no rows. Every
+    query costs one `rtt` and every commit another.
+    """
+    def __init__(self, rtt=0.0):
+        self.rtt = rtt
+        self.edges = {}
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def merge_entity(self, name, entity_type):
+        created = (name, entity_type) not in self.edges
+        self.edges.setdefault((name, entity_type), set())
+        return created
+
+    def merge_relationship(self, source_name, relationship, target_name):
+        sources = [node for node in self.edges if node[0] == source_name]
+        targets = [node for node in self.edges if node[0] == target_name]
+        merged = created = 0
+        for source in sources:
+            for target in targets:
+                merged += 1
+                if (relationship, target) not in self.edges[source]:
+                    self.edges[source].add((relationship, target))
+                    created += 1
+        return merged, created
+
+    def seed(self, entities, relationships):
+        for entity in entities:
+            self.merge_entity(entity["name"], entity["type"])
+        for rel in relationships:
+            self.merge_relationship(rel["from"], rel["relationship"], rel["to"])
+
+    def reachable_rows(self, starts):
+        seen, stack = set(), list(starts)
+        while stack:
+            node = stack.pop()
+            if node in seen or node not in self.edges:
+                continue
+            seen.add(node)
+            stack.extend(target for _, target in self.edges[node])
+        return [
+            {"name": node[0], "type": node[1], "edges": [[relationship, target[0], target[1]] for relationship, target in sorted(self.edges[node])] or [[None, None, None]]}
+            for node in sorted(seen)
+        ]
+
+    def run(self, query, params):
+        with self._lock:
+            self.queries += 1
+            if query == LOAD_USER_SUBGRAPH_QUERY:
+                return FakeResult(self.reachable_rows([(params["user_name"], "Person")]))
+            if query == LOAD_DESCENDANTS_QUERY:
+                return FakeResult(self.reachable_rows([node for node in self.edges if node[0] in params["names"]]))
+            if query == MERGE_ENTITIES_QUERY:
+                created = sum(self.merge_entity(entity["name"], entity["type"]) for entity in params["entities"])
+                return FakeResult(merged=len(params["entities"]), nodes_created=created)
+            if query == MERGE_RELATIONSHIPS_QUERY:
+                merged = created = 0
+                for rel in params["relationships"]:
+                    m, c = self.merge_relationship(rel["from"], rel["relationship"], rel["to"])
+                    merged += m
+                    created += c
+                return FakeResult(merged=merged, relationships_created=created)
+            return FakeResult()
+
+
+class FakeTransaction:
+    def __init__(self, neo4j):
+        self.neo4j = neo4j
+
+    def run(self, query, parameters=None, **kwargs):
+        pause(self.neo4j.rtt)
+        return self.neo4j.run(query, {**(parameters or {}), **kwargs})
+
+
+class FakeAsyncTransaction(FakeTransaction):
+    async def run(self, query, parameters=None, **kwargs):
+        await apause(self.neo4j.rtt)
+        return FakeAsyncResult(self.neo4j.run(query, {**(parameters or {}), **kwargs}))
+
+
+class FakeSession:
+    def __init__(self, neo4j):
+        self.neo4j = neo4j
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute_read(self, work, *args):
+        return work(FakeTransaction(self.neo4j), *args)
+
+    def execute_write(self, work, *args):
+        result = work(FakeTransaction(self.neo4j), *args)
+        pause(self.neo4j.rtt)  # COMMIT
+        return result
+
+
+class FakeAsyncSession(FakeSession):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute_read(self, work, *args):
+        return await work(FakeAsyncTransaction(self.neo4j), *args)
+
+    async def execute_write(self, work, *args):
+        result = await work(FakeAsyncTransaction(self.neo4j), *args)
+        await apause(self.neo4j.rtt)
+        return result
+
+
+class FakeDriver:
+    def __init__(self, neo4j, session_class=FakeSession):
+        self.neo4j = neo4j
+        self.session_class = session_class
+
+    def session(self):
+        return self.session_class(self.neo4j)
+
+    def close(self):
+        pass
+
+
+class FakeAsyncDriver(FakeDriver):
+    def __init__(self, neo4j):
+        super().__init__(neo4j, FakeAsyncSession)
+
+    async def close(self):
+        pass
+
+
+def fake_knowledge_graph(neo4j, subgraph_cache_mb=None):
+    """
+    A KnowledgeGraph configured as in production whose drivers talk to `neo4j` instead of a server.
+    """
+    kg = KnowledgeGraph("bolt://fake:7687", "neo4j", "fake", subgraph_cache_mb=subgraph_cache_mb)
+    # The real drivers have not connected yet (they do on first use), so closing them is immediate.
+    kg.shutdown()
+    kg.closed = False
+    kg.driver = FakeDriver(neo4j)
+    kg.async_driver = FakeAsyncDriver(neo4j)
+    return kg
+
+
+class FakePineconeIndex:
+    """
+    Exact cosine search over the upserted vectors, returning matches shaped like Pinecone's query response.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.ids = []
+        self.metadata = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.queries = 0
+
+    def upsert(self, vectors):
+        rows = [np.asarray(values, dtype=np.float32) for _, values, _ in vectors]
+        self.vectors = np.vstack([self.vectors.reshape(-1, rows[0].shape[0])] + [row[None, :] for row in rows])
+        self.ids.extend(id for id, _, _ in vectors)
+        self.metadata.extend(dict(metadata) for _, _, metadata in vectors)
+
+    def query(self, vector, top_k, include_metadata=False, include_values=False):
+        pause(self.latency)
+        self.queries += 1
+        scores = self.vectors @ np.asarray(vector, dtype=np.float32)
+        top = np.argsort(-scores)[:top_k]
+        return {"matches": [
+            {
+                "id": self.ids[i],
+                "score": float(scores[i]),
+                "metadata": self.metadata[i] if include_metadata else None,
+                "values": self.vectors[i].tolist() if include_values else [],
+            }
+            for i in top
+        ]}
+
+
+def fake_pinecone_store(embeddings, index):
+    """
+    A PineconeStore whose index is `index`; search and upserts run the real store code.
+    """
+    store = PineconeStore.__new__(PineconeStore)
+    store.embeddings = embeddings
+    store.index_name = "healthmate"
+    store.index = index
+    store.vector_store = SimpleNamespace(_text_key="text")
+    return store
+
+
+TOPICS = ["headache", "blood pressure", "type 2 diabetes", "knee pain", "sleep", "seasonal allergies", "cold and flu",
+          "stress", "diet", "exercise", "back pain", "heartburn", "vitamin D", "asthma", "skin rash", "dehydration"]
+ASPECTS = ["common causes of", "home care for", "when to see a doctor about", "medication options for",
+           "lifestyle changes that help with", "warning signs of", "how to prevent", "tracking symptoms of"]
+
+
+def reference_corpus():
+    """
+    Short synthetic reference passages, one per topic and aspect.
+    """
+    return [
+        f"{aspect.capitalize()} {topic}: {ANSWER[:200 + 13 * (i % 7)]}"
+        for i, (topic, aspect) in enumerate((topic, aspect) for topic in TOPICS for aspect in ASPECTS)
+    ]
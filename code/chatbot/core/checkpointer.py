@@ -0,0 +1,204 @@
+import json
+import random
+import zlib
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from langgraph.checkpoint.base import WRITES_IDX_MAP, BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id
+from langgraph.checkpoint.serde.types import TASKS
+from chatbot.models import GraphCheckpoint, GraphCheckpointBlob, GraphCheckpointWrite
+
+def thread_config(thread_id, checkpoint_ns, checkpoint_id):
+    return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+class DjangoCheckpointSaver(BaseCheckpointSaver):
+    """
+    LangGraph checkpointer stored through the Django ORM in the project database.
+
+    Writes are kept small: channel values go to a blob table keyed by channel version, so a checkpoint
+    only writes the channels that changed (the message list is not rewritten by every node); blobs over
+    `compress_min_bytes` are zlib compressed; and the node outputs LangGraph copies into checkpoint
+    metadata, which nothing reads back, are not stored. Once per turn the thread is pruned to its
+    `keep_latest` newest checkpoints along with the writes and blobs only older checkpoints used.
+    """
+    def __init__(self, keep_latest=10, compress_min_bytes=1024, serde=None):
+        super().__init__(serde=serde)
+        self.keep_latest = keep_latest
+        self.compress_min_bytes = compress_min_bytes
+
+    def get_next_version(self, current, channel):
+        # A random fraction keeps versions unique when a thread is re-run from an older checkpoint,
+        # so a blob written by the abandoned run is never mistaken for the new value.
+        number = 0 if current is None else int(str(current).split(".")[0])
+        return f"{number + 1:032}.{random.random():016}"
+
+    def _dumps(self, obj):
+        type_, data = self.serde.dumps_typed(obj)
+        if self.compress_min_bytes and len(data) >= self.compress_min_bytes:
+            return f"{type_}+zlib", zlib.compress(data, 1)
+        return type_, data
+
+    def _loads(self, type_, data):
+        data = bytes(data)
+        if type_.endswith("+zlib"):
+            type_, data = type_[:-len("+zlib")], zlib.decompress(data)
+        return self.serde.loads_typed((type_, data))
+
+    def _channel_values(self, thread_id, checkpoint_ns, channel_versions):
+        if not channel_versions:
+            return {}
+        wanted = {(channel, str(version)) for channel, version in channel_versions.items()}
+        blobs = GraphCheckpointBlob.objects.filter(
+            thread_id=thread_id, checkpoint_ns=checkpoint_ns,
+            channel__in=[channel for channel, _ in wanted], version__in=[version for _, version in wanted],
+        ).values_list("channel", "version", "type", "value")
+        return {
+            channel: self._loads(type_, value)
+            for channel, version, type_, value in blobs
+            if (channel, version) in wanted and type_ != "empty"
+        }
+
+    def _tuple(self, row):
+        checkpoint = self._loads(row.type, row.checkpoint)
+        checkpoint["channel_values"] = self._channel_values(row.thread_id, row.checkpoint_ns, checkpoint["channel_versions"])
+        ids = [row.checkpoint_id] + ([row.parent_checkpoint_id] if row.parent_checkpoint_id else [])
+        writes = GraphCheckpointWrite.objects.filter(
+            thread_id=row.thread_id, checkpoint_ns=row.checkpoint_ns, checkpoint_id__in=ids,
+        ).order_by("checkpoint_id", "task_id", "idx").values_list("checkpoint_id", "task_id", "channel", "type", "value")
+        pending_writes = []
+        pending_sends = []
+        for checkpoint_id, task_id, channel, type_, value in writes:
+            if checkpoint_id == row.checkpoint_id:
+                pending_writes.append((task_id, channel, self._loads(type_, value)))
+            elif channel == TASKS:
+                pending_sends.append(self._loads(type_, value))
+        checkpoint["pending_sends"] = pending_sends
+        return CheckpointTuple(
+            config=thread_config(row.thread_id, row.checkpoint_ns, row.checkpoint_id),
+            checkpoint=checkpoint,
+            metadata=self.serde.loads(json.dumps(row.metadata).encode("utf-8")),
+            parent_config=thread_config(row.thread_id, row.checkpoint_ns, row.parent_checkpoint_id) if row.parent_checkpoint_id else None,
+            pending_writes=pending_writes,
+        )
+
+    def get_tuple(self, config):
+        configurable = config["configurable"]
+        rows = GraphCheckpoint.objects.filter(thread_id=configurable["thread_id"], checkpoint_ns=configurable.get("checkpoint_ns", ""))
+        if checkpoint_id := get_checkpoint_id(config):
+            row = rows.filter(checkpoint_id=checkpoint_id).first()
+        else:
+            row = rows.order_by("-checkpoint_id").first()
+        return self._tuple(row) if row is not None else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        rows = GraphCheckpoint.objects.order_by("-checkpoint_id")
+        if config:
+            configurable = config["configurable"]
+            rows = rows.filter(thread_id=configurable["thread_id"])
+            if configurable.get("checkpoint_ns") is not None:
+                rows = rows.filter(checkpoint_ns=configurable["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                rows = rows.filter(checkpoint_id=checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            rows = rows.filter(checkpoint_id__lt=before_id)
+        if filter:
+            rows = rows.filter(**{f"metadata__{key}": value for key, value in filter.items()})
+        if limit is not None:
+            rows = rows[:limit]
+        for row in rows.iterator():
+            yield self._tuple(row)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        stored = {key: value for key, value in checkpoint.items() if key not in ("channel_values", "pending_sends")}
+        values = checkpoint["channel_values"]
+        blobs = []
+        for channel, version in new_versions.items():
+            type_, value = self._dumps(values[channel]) if channel in values else ("empty", None)
+            blobs.append(GraphCheckpointBlob(
+                thread_id=thread_id, checkpoint_ns=checkpoint_ns, channel=channel, version=str(version), type=type_, value=value,
+            ))
+        type_, data = self._dumps(stored)
+        row = GraphCheckpoint(
+            thread_id=thread_id, checkpoint_ns=checkpoint_ns, checkpoint_id=checkpoint["id"],
+            parent_checkpoint_id=configurable.get("checkpoint_id"), type=type_, checkpoint=data,
+            metadata=json.loads(self.serde.dumps({key: value for key, value in metadata.items() if key != "writes"})),
+        )
+        with transaction.atomic():
+            if blobs:
+                GraphCheckpointBlob.objects.bulk_create(blobs, ignore_conflicts=True)
+            GraphCheckpoint.objects.bulk_create(
+                [row], update_conflicts=True,
+                unique_fields=["thread_id", "checkpoint_ns", "checkpoint_id"],
+                update_fields=["parent_checkpoint_id", "type", "checkpoint", "metadata"],
+            )
+        if metadata.get("source") == "input":
+            self.prune(thread_id, checkpoint_ns)
+        return thread_config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def put_writes(self, config, writes, task_id):
+        configurable = config["configurable"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, data = self._dumps(value)
+            rows.append(GraphCheckpointWrite(
+                thread_id=configurable["thread_id"], checkpoint_ns=configurable.get("checkpoint_ns", ""),
+                checkpoint_id=configurable["checkpoint_id"], task_id=task_id, idx=WRITES_IDX_MAP.get(channel, idx),
+                channel=channel, type=type_, value=data,
+            ))
+        if all(channel in WRITES_IDX_MAP for channel, _ in writes):
+            # Errors and interrupts are overwritten by a retry of the same task; regular writes are written once.
+            GraphCheckpointWrite.objects.bulk_create(
+                rows, update_conflicts=True,
+                unique_fields=["thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"],
+                update_fields=["channel", "type", "value"],
+            )
+        else:
+            GraphCheckpointWrite.objects.bulk_create(rows, ignore_conflicts=True)
+
+    def prune(self, thread_id, checkpoint_ns=""):
+        """
+        Deletes all but the newest `keep_latest` checkpoints of a thread, with the pending writes and channel
+        blobs nothing kept refers to any more.
+        """
+        rows = GraphCheckpoint.objects.filter(thread_id=thread_id, checkpoint_ns=checkpoint_ns)
+        kept = list(rows.order_by("-checkpoint_id").values_list("checkpoint_id", "parent_checkpoint_id", "type", "checkpoint")[:self.keep_latest + 1])
+        if len(kept) <= self.keep_latest:
+            return 0
+        kept = kept[:self.keep_latest]
+        oldest_id, oldest_parent_id = kept[-1][0], kept[-1][1]
+        referenced = set()
+        for _, _, type_, data in kept:
+            referenced.update((channel, str(version)) for channel, version in self._loads(type_, data)["channel_versions"].items())
+        with transaction.atomic():
+            deleted, _ = rows.filter(checkpoint_id__lt=oldest_id).delete()
+            # The oldest kept checkpoint still reads its parent's writes for pending sends.
+            GraphCheckpointWrite.objects.filter(
+                thread_id=thread_id, checkpoint_ns=checkpoint_ns, checkpoint_id__lt=oldest_parent_id or oldest_id,
+            ).delete()
+            blobs = GraphCheckpointBlob.objects.filter(thread_id=thread_id, checkpoint_ns=checkpoint_ns)
+            stale = [id for id, channel, version in blobs.values_list("id", "channel", "version") if (channel, version) not in referenced]
+            if stale:
+                GraphCheckpointBlob.objects.filter(id__in=stale).delete()
+        return deleted
+
+    def delete_thread(self, thread_id):
+        with transaction.atomic():
+            for model in (GraphCheckpoint, GraphCheckpointBlob, GraphCheckpointWrite):
+                model.objects.filter(thread_id=thread_id).delete()
+
+    # The ORM is synchronous; the async API runs the same code on Django's database thread.
+    async def aget_tuple(self, config):
+        return await sync_to_async(self.get_tuple)(config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        tuples = await sync_to_async(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))()
+        for checkpoint_tuple in tuples:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await sync_to_async(self.put)(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id):
+        await sync_to_async(self.put_writes)(config, writes, task_id)
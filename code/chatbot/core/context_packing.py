@@ -0,0 +1,144 @@
+import logging
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=None)
+def load_encoding(model_name):
+    """
+    tiktoken encoding for the chat model, None when it cannot be loaded (unknown model and no cached BPE file offline).
+    """
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.warning("No tiktoken encoding available, estimating context tokens as characters / 4")
+        return None
+
+class TokenCounter:
+    def __init__(self, model_name):
+        self.encoding = load_encoding(model_name or "gpt-4")
+
+    def count(self, text):
+        if self.encoding is None:
+            return (len(text) + 3) // 4
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, tokens):
+        if self.encoding is None:
+            return text[:tokens * 4]
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:tokens])
+
+def normalize_rows(matrix):
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def mmr_order(query_embedding, doc_embeddings, mmr_lambda=0.7, duplicate_threshold=0.95):
+    """
+    Orders candidates by maximal marginal relevance: similarity to the query minus similarity to what is
+    already picked. Candidates nearly identical to a picked one are dropped altogether.
+    """
+    if len(doc_embeddings) == 0:
+        return []
+    docs = normalize_rows(doc_embeddings)
+    relevance = docs @ normalize_rows(query_embedding)[0]
+    similarity = docs @ docs.T
+    remaining = list(range(len(docs)))
+    order = []
+    while remaining:
+        if order:
+            redundancy = similarity[np.ix_(remaining, order)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining), dtype=np.float32)
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        best = int(np.argmax(scores))
+        index = remaining.pop(best)
+        if redundancy[best] < duplicate_threshold:
+            order.append(index)
+    return order
+
+@dataclass
+class PackedContext:
+    docs: list
+    tokens: int
+    candidates: int
+
+    @property
+    def text(self):
+        return "\n\n---\n\n".join(doc.page_content for doc in self.docs)
+
+class ContextPacker:
+    """
+    Picks retrieved chunks for the assistant prompt: over-fetched candidates are re-ranked with MMR and
+    packed in that order until the token budget is spent. Keeps running totals of tokens used per turn.
+    """
+    def __init__(self, token_budget=1500, fetch_k=12, mmr_lambda=0.7, model_name=None):
+        self.token_budget = token_budget
+        self.fetch_k = fetch_k
+        self.mmr_lambda = mmr_lambda
+        self.counter = TokenCounter(model_name)
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.context_tokens = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.docs_packed = 0
+        self.docs_dropped = 0
+
+    def pack(self, query_embedding, candidates):
+        """
+        `candidates` are (document, embedding) pairs from the vector store, best first.
+        """
+        docs = [doc for doc, _ in candidates]
+        order = mmr_order(query_embedding, [embedding for _, embedding in candidates], self.mmr_lambda) if candidates else []
+        packed = []
+        used = 0
+        for index in order:
+            doc = docs[index]
+            tokens = self.counter.count(doc.page_content)
+            if used + tokens <= self.token_budget:
+                packed.append(doc)
+                used += tokens
+            elif not packed:
+                # The best chunk alone is over budget: keep its beginning rather than send no context.
+                doc = doc.model_copy(update={"page_content": self.counter.truncate(doc.page_content, self.token_budget)})
+                packed.append(doc)
+                used = self.counter.count(doc.page_content)
+        with self._lock:
+            self.docs_packed += len(packed)
+            self.docs_dropped += len(docs) - len(packed)
+        return PackedContext(packed, used, len(docs))
+
+    def record(self, context, messages):
+        """
+        Counts the full prompt of a turn (system prompt with the packed context plus the conversation).
+        """
+        prompt_tokens = sum(self.counter.count(message.content) for message in messages if isinstance(message.content, str))
+        with self._lock:
+            self.turns += 1
+            self.context_tokens += context.tokens
+            self.prompt_tokens += prompt_tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+        return prompt_tokens
+
+    def stats(self):
+        with self._lock:
+            turns = self.turns or 1
+            return {
+                "token_budget": self.token_budget,
+                "fetch_k": self.fetch_k,
+                "turns": self.turns,
+                "avg_context_tokens": self.context_tokens / turns,
+                "avg_prompt_tokens": self.prompt_tokens / turns,
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "docs_packed": self.docs_packed,
+                "docs_dropped": self.docs_dropped,
+            }
@@ -0,0 +1,279 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+from chatbot.models import PendingSummary
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SummaryJob:
+    thread_id: str
+    summary: str
+    messages: list
+    watermark: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+@dataclass
+class ReadySummary:
+    summary: str
+    watermark: str
+
+def summary_cut(messages, keep_last):
+    """
+    Index of the first message left uncompacted: the last `keep_last` messages stay, and a tool result
+    never loses the AI message that called it.
+    """
+    cut = max(0, len(messages) - keep_last)
+    while cut > 0 and isinstance(messages[cut], ToolMessage):
+        cut -= 1
+    return cut
+
+def transcript_messages(messages):
+    # Only what was actually said; tool plumbing adds tokens and nothing worth remembering.
+    return [
+        message for message in messages
+        if isinstance(message, (HumanMessage, AIMessage)) and isinstance(message.content, str) and message.content.strip()
+    ]
+
+class MemorySummaryStore:
+    """
+    Pending summaries in process memory, for a single process with the in-memory checkpointer. A claim or
+    finished summary older than `ttl_seconds` is dropped, so a lost job or an ended conversation frees its slot.
+    """
+    def __init__(self, ttl_seconds=600):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # thread_id -> (claimed_at, ReadySummary or None while in flight)
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        for thread_id in [thread_id for thread_id, (claimed_at, _) in self._entries.items() if now - claimed_at >= self.ttl_seconds]:
+            del self._entries[thread_id]
+
+    def claim(self, thread_id):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if thread_id in self._entries:
+                return False
+            self._entries[thread_id] = (now, None)
+            return True
+
+    def release(self, thread_id):
+        with self._lock:
+            self._entries.pop(thread_id, None)
+
+    def finish(self, thread_id, ready):
+        """
+        Stores a finished summary, or frees the claim when `ready` is None (the job failed).
+        """
+        with self._lock:
+            entry = self._entries.get(thread_id)
+            if entry is None:
+                return
+            if ready is None:
+                del self._entries[thread_id]
+            else:
+                self._entries[thread_id] = (entry[0], ready)
+
+    def take(self, thread_id):
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(thread_id)
+            if entry is None or entry[1] is None:
+                return None
+            del self._entries[thread_id]
+            return entry[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+class DatabaseSummaryStore:
+    """
+    Pending summaries as PendingSummary rows, so a summary finished in one worker is applied by the next turn
+    wherever it runs, and a conversation has one job in flight across all workers. Rows older than
+    `ttl_seconds` are deleted by the next claim.
+    """
+    def __init__(self, ttl_seconds=600):
+        self.ttl_seconds = ttl_seconds
+
+    def _stale_before(self):
+        return timezone.now() - timedelta(seconds=self.ttl_seconds)
+
+    def claim(self, thread_id):
+        with transaction.atomic():
+            PendingSummary.objects.filter(claimed_at__lt=self._stale_before()).delete()
+            _, created = PendingSummary.objects.get_or_create(thread_id=thread_id)
+        return created
+
+    def release(self, thread_id):
+        PendingSummary.objects.filter(thread_id=thread_id, summary__isnull=True).delete()
+
+    def finish(self, thread_id, ready):
+        # Runs on the summarizer thread, which lives as long as the process.
+        close_old_connections()
+        pending = PendingSummary.objects.filter(thread_id=thread_id, summary__isnull=True)
+        if ready is None:
+            pending.delete()
+        else:
+            pending.update(summary=ready.summary, watermark=ready.watermark)
+
+    def take(self, thread_id):
+        row = (PendingSummary.objects.filter(thread_id=thread_id, summary__isnull=False, claimed_at__gte=self._stale_before())
+               .values_list("id", "summary", "watermark").first())
+        # Only the turn whose delete removed the row applies it.
+        if row is None or not PendingSummary.objects.filter(id=row[0]).delete()[0]:
+            return None
+        return ReadySummary(row[1], row[2])
+
+_STOP = object()
+
+class ConversationSummarizer:
+    """
+    Folds old messages of a conversation into its running summary on a background thread.
+    `maybe_submit` hands over the messages added since the last watermark at the end of a turn; the result
+    goes to `store` and is applied by `compaction` at the start of a later turn, which removes the summarized
+    messages from the state, so the next job only sees what came after. The store allows at most one summary
+    per conversation in flight or waiting to be applied.
+    """
+    def __init__(self, summarize, store=None, trigger_messages=14, keep_last=2, max_queue=100, enqueue_timeout=0.05):
+        self.summarize = summarize
+        self.store = store if store is not None else MemorySummaryStore()
+        self.trigger_messages = trigger_messages
+        self.keep_last = keep_last
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.applied = 0
+        self.discarded = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="conversation-summary", daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def maybe_submit(self, thread_id, summary, messages):
+        """
+        Queues a summary of everything but the last few messages once the conversation is long enough.
+        Returns True when a job was queued.
+        """
+        if len(messages) <= self.trigger_messages:
+            return False
+        cut = summary_cut(messages, self.keep_last)
+        if cut == 0:
+            return False
+        if not self.store.claim(thread_id):
+            return False
+        self._ensure_started()
+        job = SummaryJob(thread_id, summary, transcript_messages(messages[:cut]), messages[cut - 1].id)
+        try:
+            self._queue.put(job, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self.store.release(thread_id)
+            self.dropped += 1
+            logger.warning("Summary queue full, skipping summary for thread %s", thread_id)
+            return False
+        self.submitted += 1
+        return True
+
+    def take(self, thread_id):
+        """
+        Returns the finished summary for the conversation, if any, and frees it for the next job.
+        """
+        return self.store.take(thread_id)
+
+    def compaction(self, thread_id, messages):
+        """
+        State update that applies a finished summary: the new summary plus removal of every message up to
+        its watermark. None when there is nothing to apply.
+        """
+        if len(messages) <= self.trigger_messages:
+            # No job was ever queued for a conversation this short, so the store is not asked.
+            return None
+        ready = self.take(thread_id)
+        if ready is None:
+            return None
+        ids = [message.id for message in messages]
+        if ready.watermark not in ids:
+            # The conversation was reset or compacted some other way since the job was queued.
+            self.discarded += 1
+            return None
+        self.applied += 1
+        return {"summary": ready.summary, "messages": [RemoveMessage(id=id) for id in ids[:ids.index(ready.watermark) + 1]]}
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job):
+        lag = time.monotonic() - job.enqueued_at
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        try:
+            summary = self.summarize(job.summary, job.messages)
+        except Exception:
+            # Nothing is removed, so the next turn simply queues the same messages again.
+            self.failed += 1
+            logger.exception("Summarizing thread %s failed", job.thread_id)
+            self._finish(job.thread_id, None)
+            return
+        if self._finish(job.thread_id, ReadySummary(summary, job.watermark)):
+            self.completed += 1
+        else:
+            self.failed += 1
+
+    def _finish(self, thread_id, ready):
+        try:
+            self.store.finish(thread_id, ready)
+            return True
+        except Exception:
+            # The claim expires on its own, after which a later turn queues the messages again.
+            logger.exception("Storing the summary of thread %s failed", thread_id)
+            return False
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "applied": self.applied,
+            "discarded": self.discarded,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "last_lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+        }
+
+    def shutdown(self, timeout=10.0):
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
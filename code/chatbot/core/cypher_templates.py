@@ -0,0 +1,182 @@
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+from langchain_core.messages import SystemMessage
+
+# Every template returns path1/path2 like the free-form queries did, so format_path_record is unchanged.
+# The query text never varies, only the parameters, so Neo4j plans each template once and reuses it.
+PATH_QUERY = """
+    MATCH path1 = (u:Entity {{name: $user_name, type: 'Person'}})-[*]->(target:Entity)
+    {where}
+    OPTIONAL MATCH path2 = (target)-[*]->(end:Entity)
+    RETURN path1, path2
+    LIMIT $limit
+    """
+
+@dataclass(frozen=True)
+class CypherTemplate:
+    name: str
+    description: str
+    query: str
+
+TEMPLATES = {template.name: template for template in [
+    CypherTemplate(
+        "entities",
+        "Facts about specific entity types and/or entity names (e.g. the user's medications, or 'Lisinopril').",
+        PATH_QUERY.format(where="WHERE target.type IN $types OR toLower(target.name) IN $names"),
+    ),
+    CypherTemplate(
+        "relationships",
+        "Facts reached through specific relationship types (e.g. everything the user 'takes' or 'owns').",
+        PATH_QUERY.format(where="WHERE any(rel IN relationships(path1) WHERE toLower(rel.type) IN $relationships)"),
+    ),
+    CypherTemplate(
+        "overview",
+        "Everything stored about the user, for broad questions about their health or history.",
+        PATH_QUERY.format(where=""),
+    ),
+]}
+
+DEFAULT_LIMIT = 50
+
+# Words patients use for the entity types the extraction prompt produces.
+TYPE_KEYWORDS = {
+    "medication": ["medication", "medicine", "meds", "pill", "drug", "prescription", "dosage", "dose", "taking"],
+    "condition": ["condition", "diagnosed", "diagnosis", "disease", "illness", "health problem"],
+    "symptom": ["symptom", "pain", "ache", "complaint", "feeling"],
+    "allergy": ["allergy", "allergies", "allergic"],
+    "treatment": ["treatment", "therapy", "protocol"],
+    "pet": ["pet", "dog", "cat"],
+    "lifestyle": ["lifestyle", "exercise", "diet", "habit", "sleep", "smoke", "drink"],
+    "event": ["event", "appointment", "visit"],
+}
+
+OVERVIEW_KEYWORDS = ["about me", "what do you know", "my health", "my history", "everything", "my records", "summary"]
+
+# Relationship types too generic to say anything about the question on their own.
+GENERIC_RELATIONSHIPS = {"has", "have", "is", "are", "related_to", "relationship"}
+
+@dataclass
+class UserVocabulary:
+    """
+    Entity names, entity types and relationship types stored for a user, used to fill template parameters.
+    """
+    names: list = field(default_factory=list)
+    types: list = field(default_factory=list)
+    relationships: list = field(default_factory=list)
+
+    @classmethod
+    def from_records(cls, records):
+        vocabulary = cls()
+        for name, entity_type, relationship_type in records:
+            if name and name not in vocabulary.names:
+                vocabulary.names.append(name)
+            if entity_type and entity_type not in vocabulary.types:
+                vocabulary.types.append(entity_type)
+            if relationship_type and relationship_type not in vocabulary.relationships:
+                vocabulary.relationships.append(relationship_type)
+        return vocabulary
+
+@dataclass(frozen=True)
+class CypherSelection:
+    """
+    Either a template with its parameters or, when no template fits, a free-form query from the LLM.
+    """
+    template: Optional[str]
+    params: dict
+    query: str
+
+    @property
+    def source(self):
+        return self.template or "free-form"
+
+def select_template(name, user_name="User", types=(), names=(), relationships=(), limit=DEFAULT_LIMIT):
+    params = {"user_name": user_name, "types": list(types), "names": [n.lower() for n in names],
+              "relationships": [r.lower() for r in relationships], "limit": limit}
+    return CypherSelection(name, params, TEMPLATES[name].query)
+
+def mentions(text, phrase):
+    return re.search(r"\b" + re.escape(phrase.lower()) + r"s?\b", text) is not None
+
+def known(values, vocabulary_values):
+    """
+    Keeps the values that exist in the user's graph, in the spelling stored there.
+    """
+    lookup = {value.lower(): value for value in vocabulary_values}
+    return [lookup[value.lower()] for value in values if isinstance(value, str) and value.lower() in lookup]
+
+def match_template(message, vocabulary, user_name="User"):
+    """
+    Picks a template and its parameters locally from the user's message, or returns None.
+    """
+    text = message.lower()
+    names = [name for name in vocabulary.names if name != user_name and mentions(text, name)]
+    types = []
+    for entity_type in vocabulary.types:
+        keywords = [entity_type] + TYPE_KEYWORDS.get(entity_type.lower(), [])
+        if any(mentions(text, keyword) for keyword in keywords):
+            types.append(entity_type)
+    if names or types:
+        return select_template("entities", user_name, types=types, names=names)
+    relationships = [r for r in vocabulary.relationships if r.lower() not in GENERIC_RELATIONSHIPS and mentions(text, r)]
+    if relationships:
+        return select_template("relationships", user_name, relationships=relationships)
+    if any(keyword in text for keyword in OVERVIEW_KEYWORDS):
+        return select_template("overview", user_name)
+    return None
+
+def template_selection_messages(conversation, vocabulary):
+    templates = "\n".join(f'    - "{template.name}": {template.description}' for template in TEMPLATES.values())
+    system_message_content = f"""
+    You are an expert in querying graph databases.
+    The user's facts are stored in Neo4j as (:Entity {{name, type}}) nodes connected by [:RELATIONSHIP {{type}}] relationships.
+    Entity names: {vocabulary.names}
+    Entity types: {vocabulary.types}
+    Relationship types: {vocabulary.relationships}
+    Pick the query template that retrieves what the conversation asks about:
+{templates}
+    Reply with JSON only, for example:
+    {{"template": "entities", "types": ["Medication"], "names": ["Lisinopril"], "relationships": []}}
+    Only use names and types from the lists above. If no template fits, write the Cypher query yourself and reply:
+    {{"template": "none", "query": "MATCH path1 = (u:Entity {{name: 'User', type: 'Person'}})-[*]->(target:Entity) WHERE target.type = 'Event' OR target.name = 'Cold' OPTIONAL MATCH path2 = (target)-[*]->(end:Entity) RETURN path1, path2"}}
+
+    Conversation: "{conversation}"
+    """
+    return [SystemMessage(content=system_message_content)]
+
+def strip_code_fence(content):
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`")
+        content = content.split("\n", 1)[1] if "\n" in content else content
+    return content.strip()
+
+def parse_template_selection(content, vocabulary, user_name="User"):
+    """
+    Turns the LLM's reply into a selection. Template parameters are checked against the vocabulary;
+    a reply that cannot be used falls back to the overview template.
+    """
+    content = strip_code_fence(content)
+    try:
+        reply = json.loads(content)
+    except json.JSONDecodeError:
+        # Older prompts answered with bare Cypher.
+        if content.upper().startswith("MATCH"):
+            return CypherSelection(None, {}, content)
+        return select_template("overview", user_name)
+    if not isinstance(reply, dict):
+        return select_template("overview", user_name)
+    name = reply.get("template")
+    if name == "none" and reply.get("query"):
+        return CypherSelection(None, {}, reply["query"])
+    if name == "entities":
+        types = known(reply.get("types") or [], vocabulary.types)
+        names = known(reply.get("names") or [], vocabulary.names)
+        if types or names:
+            return select_template("entities", user_name, types=types, names=names)
+    if name == "relationships":
+        relationships = known(reply.get("relationships") or [], vocabulary.relationships)
+        if relationships:
+            return select_template("relationships", user_name, relationships=relationships)
+    return select_template("overview", user_name)
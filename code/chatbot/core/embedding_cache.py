@@ -0,0 +1,198 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process appends, as before
+    fcntl = None
+
+def normalize_text(text, lowercase=True):
+    text = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+    return text.lower() if lowercase else text
+
+class EmbeddingDiskCache:
+    """
+    Append-only on-disk tier: vectors in one flat float16/float32 file, a text index of "key row" lines next to it.
+    The index is loaded into memory at startup; vectors are read through a memory map. Appends hold an
+    exclusive lock on the index and first read what other worker processes appended, so several
+    processes can share one directory.
+    """
+    def __init__(self, path, dtype="float16"):
+        os.makedirs(path, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.vectors_path = os.path.join(path, f"vectors.{self.dtype.name}")
+        self.index_path = os.path.join(path, f"index.{self.dtype.name}.txt")
+        self.dim = None
+        self.rows = {}
+        self._matrix = None
+        self._index_offset = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self._read_index(f)
+        self._count = self._stored_rows()
+        # Drop index entries whose vector never made it to disk.
+        self.rows = {key: row for key, row in self.rows.items() if row < self._count}
+
+    def _read_index(self, f):
+        f.seek(self._index_offset)
+        for line in iter(f.readline, ""):
+            if not line.endswith("\n"):
+                break
+            parts = line.split()
+            if len(parts) == 3:
+                self.dim = int(parts[2])
+                self.rows[parts[0]] = int(parts[1])
+            self._index_offset = f.tell()
+
+    def _stored_rows(self):
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (self.dim * self.dtype.itemsize)
+
+    def get(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        if self._matrix is None or row >= len(self._matrix):
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(self._count, self.dim))
+        return self._matrix[row].astype(np.float32).tolist()
+
+    def put_many(self, items):
+        with open(self.index_path, "a+") as index:
+            if fcntl is not None:
+                fcntl.flock(index, fcntl.LOCK_EX)
+            # Catch up with rows other processes appended since we last looked.
+            self._read_index(index)
+            self._count = self._stored_rows()
+            items = [(key, vector) for key, vector in items if key not in self.rows]
+            if not items:
+                return
+            vectors = np.asarray([vector for _, vector in items], dtype=self.dtype)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            with open(self.vectors_path, "ab") as f:
+                # Cut off a half-written row left by a crash before appending.
+                f.truncate(self._count * self.dim * self.dtype.itemsize)
+                f.write(vectors.tobytes())
+            index.seek(0, os.SEEK_END)
+            index.write("".join(f"{key} {self._count + i} {self.dim}\n" for i, (key, _) in enumerate(items)))
+            index.flush()
+            self._index_offset = index.tell()
+            for i, (key, _) in enumerate(items):
+                self.rows[key] = self._count + i
+            self._count += len(items)
+
+    def __len__(self):
+        return len(self.rows)
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with a bounded in-memory LRU and an optional disk tier, keyed on the model
+    name and the normalized text. Query and document embeddings share entries, which holds for the
+    symmetric sentence-transformers models used here. Lowercasing is only safe for uncased models
+    such as all-MiniLM-L6-v2.
+    """
+    def __init__(self, embeddings, max_entries=4096, path=None, dtype="float16", lowercase=True):
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+        self.max_entries = max_entries
+        self.lowercase = lowercase
+        # One directory per model, so vectors of different sizes never share a file.
+        self.disk = EmbeddingDiskCache(os.path.join(path, re.sub(r"\W+", "_", self.model_name)), dtype) if path else None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.forward_passes = 0
+        self.forward_passes_saved = 0
+
+    def key(self, text):
+        return hashlib.sha1(f"{self.model_name}\0{normalize_text(text, self.lowercase)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _get(self, key):
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return vector
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector
+        return None
+
+    def lookup(self, text):
+        """
+        Returns the cached embedding or None, without ever running the model.
+        """
+        with self._lock:
+            vector = self._get(self.key(text))
+            if vector is not None:
+                self.forward_passes_saved += 1
+            return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.key(text) for text in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                if key not in vectors:
+                    vector = self._get(key)
+                    if vector is not None:
+                        vectors[key] = vector
+        # One batched forward pass for everything not cached, duplicates in the batch embedded once.
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            with self._lock:
+                self.misses += len(missing)
+                self.forward_passes += 1
+                for key, vector in zip(missing, computed):
+                    vector = list(vector)
+                    vectors[key] = vector
+                    self._remember(key, vector)
+                if self.disk is not None:
+                    self.disk.put_many([(key, vectors[key]) for key in missing])
+        else:
+            with self._lock:
+                self.forward_passes_saved += 1
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        if callable(getattr(self.embeddings, "after_fork", None)):
+            self.embeddings.after_fork()
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "model": self.model_name,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "embeddings_saved": self.hits + self.disk_hits,
+            "forward_passes": self.forward_passes,
+            "forward_passes_saved": self.forward_passes_saved,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
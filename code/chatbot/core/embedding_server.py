@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Wire format, both directions: 4-byte big-endian header length, JSON header, then for responses
+# `shape[0] * shape[1]` float32 values. Requests are {"texts": [...]}, responses {"shape": [n, dim]}
+# or {"error": "..."}; {"info": true} returns the model name instead of embeddings.
+HEADER = struct.Struct(">I")
+
+def pack(header, payload=b""):
+    data = json.dumps(header).encode("utf-8")
+    return HEADER.pack(len(data)) + data + payload
+
+class MicroBatcher:
+    """
+    Collects concurrent embedding requests and runs them as one forward pass. A batch closes when it
+    holds `max_batch` texts or `max_wait` seconds after its first request, whichever comes first.
+    """
+    def __init__(self, embeddings, max_batch=64, max_wait=0.005):
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = asyncio.Queue()
+        # The model is the bottleneck; one thread keeps forward passes from competing for the CPU.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-batch")
+        self.batches = 0
+        self.texts = 0
+
+    async def embed(self, texts):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                vectors = await loop.run_in_executor(self._executor, self.embeddings.embed_documents, texts)
+                vectors = np.asarray(vectors, dtype=np.float32)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[start:start + len(item_texts)])
+                start += len(item_texts)
+
+class EmbeddingServer:
+    """
+    Serves one embeddings model to every worker process on the machine over a Unix socket.
+    """
+    def __init__(self, embeddings, socket_path, max_batch=64, max_wait=0.005):
+        self.embeddings = embeddings
+        self.model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+        self.socket_path = socket_path
+        self.batcher = MicroBatcher(embeddings, max_batch, max_wait)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    size = HEADER.unpack(await reader.readexactly(HEADER.size))[0]
+                    request = json.loads(await reader.readexactly(size))
+                except asyncio.IncompleteReadError:
+                    return
+                if request.get("info"):
+                    writer.write(pack({"model": self.model_name}))
+                else:
+                    try:
+                        vectors = await self.batcher.embed(request["texts"])
+                        writer.write(pack({"shape": list(vectors.shape)}, vectors.tobytes()))
+                    except Exception as e:
+                        logger.exception("Embedding request failed")
+                        writer.write(pack({"error": str(e)}))
+                await writer.drain()
+        except ConnectionError:
+            # Clients drop their connection after a timeout; the reply has nobody to go to.
+            logger.debug("Embedding client went away before its reply was sent")
+        finally:
+            writer.close()
+
+    async def serve(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle, path=self.socket_path)
+        batcher = asyncio.create_task(self.batcher.run())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+class EmbeddingServerError(RuntimeError):
+    pass
+
+def read_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Embedding server closed the connection")
+        data.extend(chunk)
+    return bytes(data)
+
+class EmbeddingClient(Embeddings):
+    """
+    Embeddings backed by the shared embedding server. Each thread keeps its own connection and
+    reconnects once if the server was restarted.
+    """
+    def __init__(self, socket_path, model_name=None, timeout=30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.model_name = model_name or self.info()["model"]
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def after_fork(self):
+        # A forked worker must not talk over the parent's sockets.
+        self._local = threading.local()
+
+    def _drop_connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _exchange(self, sock, request):
+        sock.sendall(pack(request))
+        header = json.loads(read_exactly(sock, HEADER.unpack(read_exactly(sock, HEADER.size))[0]))
+        if "shape" not in header:
+            return header, None
+        rows, dim = header["shape"]
+        return header, np.frombuffer(read_exactly(sock, rows * dim * 4), dtype=np.float32).reshape(rows, dim)
+
+    def _request(self, request):
+        for attempt in range(2):
+            try:
+                header, vectors = self._exchange(self._connection(), request)
+                break
+            except (ConnectionError, FileNotFoundError):
+                # The server was restarted: reconnect and send the request once more.
+                self._drop_connection()
+                if attempt == 1:
+                    raise
+            except (OSError, ValueError):
+                # A timeout or a garbled reply leaves the socket mid-response; the next request must not read the rest.
+                self._drop_connection()
+                raise
+        if "error" in header:
+            raise EmbeddingServerError(header["error"])
+        return header, vectors
+
+    def info(self):
+        return self._request({"info": True})[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._request({"texts": list(texts)})[1].tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+def wait_for_server(socket_path, timeout=60.0):
+    """
+    Blocks until the server at `socket_path` accepts connections (the model load takes a while).
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            EmbeddingClient(socket_path, timeout=5.0).info()
+            return
+        except (ConnectionError, FileNotFoundError, OSError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
@@ -0,0 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+
+# Embedding is CPU bound, keep it off the event loop and bound how many run at once.
+embedding_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('EMBEDDING_THREADS', 2)),
+    thread_name_prefix="embedding",
+)
+
+async def aembed_query(embeddings, text):
+    # A cache hit needs no thread hop.
+    lookup = getattr(embeddings, "lookup", None)
+    if lookup is not None:
+        embedding = lookup(text)
+        if embedding is not None:
+            return embedding
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(embedding_executor, embeddings.embed_query, text)
@@ -0,0 +1,125 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ExtractionJob:
+    session_id: str
+    human_messages: list
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+_STOP = object()
+
+class KnowledgeExtractionWorker:
+    """
+    Runs knowledge extraction (LLM call + Neo4j writes) on a small thread pool off the request path.
+    The queue is bounded: when it is full `submit` waits up to `enqueue_timeout` and then drops the job,
+    so a slow LLM or Neo4j can never stall chat turns. Failed jobs are retried with exponential backoff.
+    """
+    def __init__(self, extract, workers=2, max_queue=100, max_retries=3, retry_backoff=1.0, enqueue_timeout=0.05):
+        self.extract = extract
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"knowledge-extraction-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.shutdown)
+
+    def submit(self, session_id, human_messages):
+        """
+        Queues an extraction for the given message window. Returns False when the job was dropped.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put(ExtractionJob(session_id, list(human_messages)), timeout=self.enqueue_timeout)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning("Knowledge extraction queue full, dropping job for session %s", session_id)
+            return False
+        self.submitted += 1
+        return True
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                if job.attempts == 0:
+                    lag = time.monotonic() - job.enqueued_at
+                    self.last_lag = lag
+                    self.max_lag = max(self.max_lag, lag)
+                    self._total_lag += lag
+                self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job):
+        while True:
+            try:
+                self.extract(job.human_messages)
+                self.processed += 1
+                return
+            except Exception:
+                job.attempts += 1
+                if job.attempts > self.max_retries:
+                    self.failed += 1
+                    logger.exception("Knowledge extraction failed for session %s after %d attempts", job.session_id, job.attempts)
+                    return
+                self.retried += 1
+                time.sleep(self.retry_backoff * 2 ** (job.attempts - 1))
+
+    def stats(self):
+        started = self.processed + self.failed
+        return {
+            "queue_depth": self._queue.qsize(),
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "last_lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "avg_lag_seconds": self._total_lag / started if started else 0.0,
+        }
+
+    def shutdown(self, timeout=10.0):
+        """
+        Lets the workers drain what is already queued, then stops them.
+        """
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                break
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
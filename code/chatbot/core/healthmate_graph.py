@@ -1,5 +1,5 @@
+import logging
 import os
-from langchain_openai import ChatOpenAI
 from typing import Annotated
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
@@ -7,29 +7,22 @@ from langgraph.graph.message import add_messages
 from typing import List, Literal
 from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, SystemMessage, RemoveMessage
 from pydantic import BaseModel
-from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.tools import tool
 from langgraph.prebuilt import ToolNode
+from langgraph.utils.runnable import RunnableCallable
 import json
+import uuid
 from langchain_core.prompts.prompt import PromptTemplate
 from dotenv import load_dotenv
-from .knowledge_graph import KnowledgeGraph
-from .pinecone_store import PineconeStore
-from patients.models import Patient
+from .patient_context import patient_email_from_config
+from .services import get_llm, get_kg, get_embeddings, get_vector_store, get_patient_contexts, get_semantic_cache, get_context_packer, get_intent_router, get_extraction_worker, get_summarizer, get_checkpointer
+from .embedding_utils import aembed_query
+from .semantic_cache import document_set_key
+from .cypher_templates import match_template, template_selection_messages, parse_template_selection
+from .intent_router import routing_text
 from datetime import datetime
-from IPython.display import Image, display
-from .llm_adapters.llm_manager import LLMManager
 
-
-PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
-NEO4J_URI = os.getenv('NEO4J_URI')
-NEO4J_USER = os.getenv('NEO4J_USER')
-NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD')
-
-llm = LLMManager()
-kg = KnowledgeGraph(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
-pc = PineconeStore(api_key=PINECONE_API_KEY, index_name="healthmate")
-patient = Patient.objects.get(first_name="John")
+logger = logging.getLogger(__name__)
 
 def parse_messages(messages):
     formatted_messages = []
@@ -53,39 +46,19 @@ def extract_state_from_toolcalls(message):
                     arguments_dict = json.loads(arguments)
                     return arguments_dict.get('state', None)
                 except json.JSONDecodeError:
-                    print("Error parsing JSON from arguments.")
+                    logger.debug("Could not parse tool call arguments as JSON: %s", arguments)
                     return None
     return None
 
 
-def generate_cypher_query_with_llm(user_message, entities, relationships):
-    system_message_content = f"""
-    You are an expert in querying graph databases.
-    Based on the available entities related to the user in the Neo4j database:
-    Entities: {entities}
-    Modify the where condition by only using OR conditions in the example query below so that it extracts relevant entities from the graph database about user based on a given conversation.
-    Example query:
-    MATCH path1 = (u:Entity {{name: 'User', type: 'Person'}})-[*]->(target:Entity)
-    WHERE target.type = 'Event' OR target.name = 'Cold'
-    OPTIONAL MATCH path2 = (target)-[*]->(end:Entity)
-    RETURN path1, path2
-
-    Conversation: "{user_message}"
-    Return just the Cypher query without adding "cypher" or any quotes so that it can be executed by a tool.
-    """
-    messages = [
-        SystemMessage(content=system_message_content)]
-    response = llm.generate_response(messages, bind_tools=False)
-    return response.content
-
-
-
 class State(TypedDict):
     messages: Annotated[list, add_messages]
     current_state: str
     message_counter: int
     summary: str
     message_for_any_tool: str
+    # Tool picked by the LLM orchestrator this turn, logged as a training label for the intent router.
+    route: str
 
 @tool
 def change_request_tool():
@@ -116,17 +89,16 @@ def change_state_tool(state):
     """This is the "change_state_tool"."""
 
 
-def knowledge_extractor(state):
-    state["message_counter"]=state["message_counter"]+1
-    if(state["message_counter"]<3): return state
-    state["message_counter"]=0
+def recent_human_messages(messages):
     human_messages_reversed = []
-    for message in reversed(state["messages"]):
+    for message in reversed(messages):
         if isinstance(message, HumanMessage):
             human_messages_reversed.append(message.content)
         if len(human_messages_reversed) == 5: 
             break
-    human_messages = human_messages_reversed[::-1]
+    return human_messages_reversed[::-1]
+
+def extraction_messages(human_messages):
     system_message = f"""
 
 Extract all health-related information about the user, including their conditions, symptoms, medications, treatment preferences, and lifestyle factors that could impact their health, such as pet ownership, exercise habits, or dietary choices. Ensure that all relevant entities and relationships are captured, even if they do not directly mention health issues, but could be related (e.g., "I have a dog named Martha" could be relevant for pet allergies).
@@ -155,8 +127,9 @@ if none return empty JSON:
     ]
 }}
     """
-    messages = [SystemMessage(content=system_message)]
-    entities_and_relationships = llm.generate_response(messages, bind_tools=False)
+    return [SystemMessage(content=system_message)]
+
+def parse_extraction(entities_and_relationships):
     try:
         if "entities" not in entities_and_relationships.content:
             data = {"entities": [], "relationships": []}
@@ -164,22 +137,45 @@ if none return empty JSON:
             data = json.loads(entities_and_relationships.content)
     except:
         data = {"entities": [], "relationships": []}
-    kg.store_entities_and_relationships(data['entities'], data['relationships'])
+    return data
+
+def should_extract(state):
+    # A session whose checkpoints are gone (memory checkpointer after a restart) starts counting again.
+    state["message_counter"]=state.get("message_counter", 0)+1
+    if(state["message_counter"]<3): return False
+    state["message_counter"]=0
+    return True
+
+def extract_knowledge(human_messages):
+    """
+    Runs on the extraction worker threads, never on the request path.
+    """
+    entities_and_relationships = get_llm().generate_response(extraction_messages(human_messages))
+    data = parse_extraction(entities_and_relationships)
+    get_kg().store_entities_and_relationships(data['entities'], data['relationships'])
+
+def knowledge_extractor(state, config):
+    if not should_extract(state): return state
+    get_extraction_worker().submit(config["configurable"]["thread_id"], recent_human_messages(state["messages"]))
     return state
 
-def change_request(state):
-    prompt = """You are just an Orchestrator who will call just ONE TOOL and, you DO NOT PROIDE ANY MESSAGE.
+CHANGE_REQUEST_PROMPT = """You are just an Orchestrator who will call just ONE TOOL and, you DO NOT PROIDE ANY MESSAGE.
                 Rules to call tools:
                 - **"appt_rescheduler_tool"**: Call this tool if the user expresses any intention to schedule, reschedule, or inquire about an appointment. Example triggers: "I want to reschedule my appointment to next Friday," or "Can I change my appointment time?"
                 - **"treatment_change_tool"**: Call this tool when the user is requesting changes to their treatment plan, medication regimen, or other medical interventions. Example triggers: "I need to change my medication," or "Can you adjust my treatment plan?"
                 """
-    llm.bind_tools([appt_rescheduler_tool, treatment_change_tool])
-    messages = [SystemMessage(content=prompt)] + state["messages"]
-    response = llm.generate_response(messages, bind_tools=True)
-    llm.reset_tools()
+
+def change_request(state, config):
+    messages = [SystemMessage(content=CHANGE_REQUEST_PROMPT)] + state["messages"]
+    response = get_llm().generate_response(messages, tools=[appt_rescheduler_tool, treatment_change_tool], cache=True, config=config)
     return {"messages": [response], "current_state": "change_request"}
 
-def appt_rescheduler(state):
+async def achange_request(state, config):
+    messages = [SystemMessage(content=CHANGE_REQUEST_PROMPT)] + state["messages"]
+    response = await get_llm().agenerate_response(messages, tools=[appt_rescheduler_tool, treatment_change_tool], cache=True, config=config)
+    return {"messages": [response], "current_state": "change_request"}
+
+def appt_rescheduler_messages(state):
     summary = state.get("summary", "")
     if summary:
         system_message = f"Summary of conversation earlier: {summary}"
@@ -188,17 +184,31 @@ def appt_rescheduler(state):
     day_name = datetime.now().strftime("%A") 
     prompt = f"""Today's date is: {today_date} and day is: {day_name}. Gather information about new date and time user wants to reschedule appointment to, once you have it,
                 call the tool with name "change_state_tool" and pass the new time as argument in "%Y-%m-%d %H:%M:%S" format."""
-    messages = [SystemMessage(content=prompt)]+state["messages"]
-    llm.bind_tools([change_state_tool])
-    response = llm.generate_response(messages, bind_tools=True)
-    llm.reset_tools()
+    return [SystemMessage(content=prompt)]+state["messages"]
+
+def appt_rescheduler_update(response, patient):
     message_for_next_tool = ""
     if 'tool_calls' in response.additional_kwargs:
-        message_for_next_tool = f"""Patient {patient.first_name} {patient.last_name} is requesting an appointment change from {patient.next_appointment} to {extract_state_from_toolcalls(response)}."""
+        if patient is None:
+            message_for_next_tool = f"""A user without a patient record is requesting an appointment change to {extract_state_from_toolcalls(response)}."""
+        else:
+            message_for_next_tool = f"""Patient {patient.first_name} {patient.last_name} is requesting an appointment change from {patient.next_appointment} to {extract_state_from_toolcalls(response)}."""
     return {"messages": [response], "current_state": "appt_rescheduler", "message_for_any_tool": message_for_next_tool}
 
+def appt_rescheduler(state, config):
+    patient = get_patient_contexts().get(patient_email_from_config(config))
+    messages = appt_rescheduler_messages(state)
+    response = get_llm().generate_response(messages, tools=[change_state_tool], config=config)
+    return appt_rescheduler_update(response, patient)
 
-def treatment_change(state):
+async def aappt_rescheduler(state, config):
+    patient = await get_patient_contexts().aget(patient_email_from_config(config))
+    messages = appt_rescheduler_messages(state)
+    response = await get_llm().agenerate_response(messages, tools=[change_state_tool], config=config)
+    return appt_rescheduler_update(response, patient)
+
+
+def treatment_change_messages(state):
     summary = state.get("summary", "")
     if summary:
         system_message = f"Summary of conversation earlier: {summary}"
@@ -208,22 +218,30 @@ def treatment_change(state):
     prompt = f"""Today's date is: {today_date} and day is: {day_name}. Gather information about what specific treatment changes the user is requesting. 
     Once you have the necessary details (e.g., medication changes, dosage adjustments, etc.), call the tool with name "change_state_tool" 
     and pass the changes in a structured format like JSON or key-value pairs."""
-    messages = [SystemMessage(content=prompt)] + state["messages"]
-    llm.bind_tools([change_state_tool])
-    response = llm.generate_response(messages, bind_tools=True)
-    llm.reset_tools()  
+    return [SystemMessage(content=prompt)] + state["messages"]
+
+def treatment_change_update(response, patient):
     message_for_next_tool = ""
     if 'tool_calls' in response.additional_kwargs:
         treatment_changes = extract_state_from_toolcalls(response)
-        message_for_next_tool = f"""Patient {patient.first_name} {patient.last_name} is requesting the following treatment changes: {treatment_changes}."""
+        requester = "A user without a patient record" if patient is None else f"Patient {patient.first_name} {patient.last_name}"
+        message_for_next_tool = f"""{requester} is requesting the following treatment changes: {treatment_changes}."""
     return {"messages": [response], "current_state": "treatment_change", "message_for_any_tool": message_for_next_tool}
 
+def treatment_change(state, config):
+    patient = get_patient_contexts().get(patient_email_from_config(config))
+    messages = treatment_change_messages(state)
+    response = get_llm().generate_response(messages, tools=[change_state_tool], config=config)
+    return treatment_change_update(response, patient)
 
-def change_state(state):
-    try:
-        doctor_name = patient.doctor_name
-    except Patient.DoesNotExist:
-        doctor_name = "Doctor"
+async def atreatment_change(state, config):
+    patient = await get_patient_contexts().aget(patient_email_from_config(config))
+    messages = treatment_change_messages(state)
+    response = await get_llm().agenerate_response(messages, tools=[change_state_tool], config=config)
+    return treatment_change_update(response, patient)
+
+
+def change_state_update(state, doctor_name):
     return {"messages": [ToolMessage(
                     content=state["message_for_any_tool"],
                     tool_call_id=state["messages"][-1].tool_calls[0]["id"]),
@@ -231,42 +249,133 @@ def change_state(state):
                     content=f"""I will convey your request to {doctor_name}."""
                         )], "current_state": "assistant", "message_for_any_tool": ""}
 
+def doctor_name(patient):
+    return patient.doctor_name if patient is not None else "Doctor"
+
+def change_state(state, config):
+    return change_state_update(state, doctor_name(get_patient_contexts().get(patient_email_from_config(config))))
 
-def assistant(state):
+async def achange_state(state, config):
+    return change_state_update(state, doctor_name(await get_patient_contexts().aget(patient_email_from_config(config))))
+
+
+def patient_context_text(patient):
+    return patient.context if patient is not None else "No patient record."
+
+def assistant_history(state, patient_context):
     summary = state.get("summary", "")
-    patient_context = (
-    f"My name is {patient.first_name} {patient.last_name}. "
-    f"I was born on {patient.date_of_birth.strftime('%Y-%m-%d')}. "
-    f"My phone number is {patient.phone_number}. "
-    f"My email address is {patient.email}. "
-    f"My medical condition is {patient.medical_condition}. "
-    f"I am taking {patient.medication_regimen}. "
-    f"My last appointment was on {patient.last_appointment.strftime('%Y-%m-%d %H:%M')}. "
-    f"My next appointment is on {patient.next_appointment.strftime('%Y-%m-%d %H:%M')} "
-    f"with {patient.doctor_name}."
-        )
     system_message = f"Summary of conversation earlier: {summary} \n\n Patient context: {patient_context}"
     state["messages"] = [SystemMessage(content=system_message)] + state["messages"]
     for message in reversed(state["messages"]):
             if isinstance(message, HumanMessage):
                 last_human_message = message.content
                 break
-    docs = pc.search(last_human_message)
-    context = []
-    for doc in docs:
-        context.append(doc.page_content)
+    return last_human_message
+
+def assistant_messages(state, context):
     prompt = f"""You are a health bot assigned to help users with health related and lifestyle queries and give medical advice. Use the following context to assist the user further.
                         If you don't know the answer, just say that you don't know, don't try to make up an answer.
-                        Context: {context}"""
-    response = llm.generate_response([SystemMessage(content=prompt)] + state["messages"], bind_tools=False)
+                        Context:
+{context.text}"""
+    return [SystemMessage(content=prompt)] + state["messages"]
+
+def with_context_metadata(response, context, prompt_tokens):
+    metadata = {"context_tokens": context.tokens, "context_docs": len(context.docs), "context_candidates": context.candidates, "prompt_tokens": prompt_tokens}
+    return response.model_copy(update={"response_metadata": {**response.response_metadata, **metadata}})
+
+def is_cacheable_route(state):
+    """
+    Only general questions the orchestrator sent through assistant_tool may share answers;
+    answers that follow a knowledge graph lookup are built from the patient's own data.
+    """
+    messages = state["messages"]
+    if len(messages) < 2 or not isinstance(messages[-1], ToolMessage):
+        return False
+    previous = messages[-2]
+    return isinstance(previous, AIMessage) and bool(previous.tool_calls) and previous.tool_calls[0].get("name") == "assistant_tool"
+
+def is_opening_question(state):
+    # Anything said earlier (or summarized) may be what the question refers to.
+    return not state.get("summary") and sum(isinstance(message, HumanMessage) for message in state["messages"]) == 1
+
+def is_shared_answer(state):
+    """
+    Turns whose question may be answered from, and add to, the semantic cache: a general question that opens
+    the conversation. The patient still gets the answer to their personalized prompt on a miss; the cache gets
+    a separate answer generated from the question and the retrieved documents alone.
+    """
+    return is_cacheable_route(state) and is_opening_question(state)
+
+def shared_answer_messages(question, context):
+    return assistant_messages({"messages": [HumanMessage(content=question)]}, context)
+
+def fill_shared_answer(embedding, doc_key, question, context):
+    messages = shared_answer_messages(question, context)
+    get_semantic_cache().fill_later(embedding, doc_key, lambda: get_llm().generate_response(messages).content)
+
+def cached_assistant_update(answer):
+    return {"messages": [AIMessage(content=answer, response_metadata={"semantic_cache": True})], "current_state": "assistant"}
+
+def assistant(state, config):
+    shared = is_shared_answer(state)
+    last_human_message = assistant_history(state, patient_context_text(get_patient_contexts().get(patient_email_from_config(config))))
+    embedding = get_vector_store().embed_query(last_human_message)
+    packer = get_context_packer()
+    context = packer.pack(embedding, get_vector_store().search_with_embeddings(embedding, packer.fetch_k))
+    doc_key = document_set_key(context.docs)
+    if shared:
+        answer = get_semantic_cache().lookup(embedding, doc_key)
+        if answer is not None:
+            return cached_assistant_update(answer)
+    messages = assistant_messages(state, context)
+    prompt_tokens = packer.record(context, messages)
+    response = get_llm().generate_response(messages, config=config)
+    response = with_context_metadata(response, context, prompt_tokens)
+    if shared:
+        fill_shared_answer(embedding, doc_key, last_human_message, context)
     return {"messages": [response], "current_state": "assistant"}
 
-def query_knowledge_graph(state):
-    messages = parse_messages(state["messages"])
-    entities, relationships = kg.fetch_entities_and_relationships_for_user("User")
-    cypher_query = generate_cypher_query_with_llm(messages, entities, relationships)
-    print(f"Generated Cypher Query: {cypher_query}")
-    results = kg.execute_cypher_query(cypher_query)
+async def aassistant(state, config):
+    shared = is_shared_answer(state)
+    last_human_message = assistant_history(state, patient_context_text(await get_patient_contexts().aget(patient_email_from_config(config))))
+    embedding = await get_vector_store().aembed_query(last_human_message)
+    packer = get_context_packer()
+    context = packer.pack(embedding, await get_vector_store().asearch_with_embeddings(embedding, packer.fetch_k))
+    doc_key = document_set_key(context.docs)
+    if shared:
+        answer = get_semantic_cache().lookup(embedding, doc_key)
+        if answer is not None:
+            return cached_assistant_update(answer)
+    messages = assistant_messages(state, context)
+    prompt_tokens = packer.record(context, messages)
+    response = await get_llm().agenerate_response(messages, config=config)
+    response = with_context_metadata(response, context, prompt_tokens)
+    if shared:
+        fill_shared_answer(embedding, doc_key, last_human_message, context)
+    return {"messages": [response], "current_state": "assistant"}
+
+def query_knowledge_graph(state, config):
+    # A local match on the last message avoids the LLM; otherwise it picks a template, or writes Cypher if none fits.
+    vocabulary = get_kg().fetch_user_vocabulary("User")
+    selection = match_template(last_human_message_content(state["messages"]), vocabulary)
+    if selection is None:
+        response = get_llm().generate_response(template_selection_messages(parse_messages(state["messages"]), vocabulary), cache=True, config=config)
+        selection = parse_template_selection(response.content, vocabulary)
+    logger.debug("Knowledge graph query (%s): %s", selection.source, selection.params or selection.query)
+    results = get_kg().execute_selection(selection)
+    return query_knowledge_graph_update(state, results)
+
+async def aquery_knowledge_graph(state, config):
+    vocabulary = await get_kg().afetch_user_vocabulary("User")
+    selection = match_template(last_human_message_content(state["messages"]), vocabulary)
+    if selection is None:
+        response = await get_llm().agenerate_response(template_selection_messages(parse_messages(state["messages"]), vocabulary), cache=True, config=config)
+        selection = parse_template_selection(response.content, vocabulary)
+    logger.debug("Knowledge graph query (%s): %s", selection.source, selection.params or selection.query)
+    results = await get_kg().aexecute_selection(selection)
+    return query_knowledge_graph_update(state, results)
+
+def query_knowledge_graph_update(state, results):
     return {"messages": [
                 ToolMessage(
                     content="\n".join(results),
@@ -275,8 +384,7 @@ def query_knowledge_graph(state):
             ], "current_state": "assistant"}
 
 
-def orchestrator(state):
-    prompt = """You are just an Orchestrator who will just call ONE tool, and you DONOT PROVIDE ANY MESSAGE
+ORCHESTRATOR_PROMPT = """You are just an Orchestrator who will just call ONE tool, and you DONOT PROVIDE ANY MESSAGE
                 Rules to call tools:
                 - "change_request_tool": Call this tool if the user expresses any intention to change their treatment or appointment. Example triggers: "I want to reschedule my appointment to next Friday," or "Can we change my medication?"
                 - "query_knowledge_graph_tool": Call this tool when the user's query is seeking specific information about their health conditions, medications, or other stored health-related details. This is typically triggered by questions about the user's own medical history or related entities. Example triggers: "What medication am I currently taking?" or "Tell me more about my condition."
@@ -284,43 +392,95 @@ def orchestrator(state):
                 - "end_tool": If the user message is off-topic, unrelated, sensitive, or controversial.
 topics"
                 """
-    llm.bind_tools([change_request_tool, query_knowledge_graph_tool, assistant_tool, end_tool])
-    messages = [SystemMessage(content=prompt)] + state["messages"]
-    response = llm.generate_response(messages, bind_tools=True)
-    llm.reset_tools()
-    return {"messages": [response], "current_state": "orchestrator"}
 
+def last_human_message_content(messages):
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content
+    return ""
 
+def routed_tool_update(tool_name):
+    """
+    Builds the same tool call the LLM orchestrator would have made, so router2 and the tool message nodes are unchanged.
+    """
+    call_id = f"call_{uuid.uuid4().hex[:24]}"
+    response = AIMessage(
+        content="",
+        tool_calls=[{"name": tool_name, "args": {}, "id": call_id}],
+        additional_kwargs={"tool_calls": [{"id": call_id, "type": "function", "function": {"name": tool_name, "arguments": "{}"}}]},
+    )
+    return {"messages": [response], "current_state": "orchestrator", "route": ""}
+
+def orchestrator_update(response):
+    route = response.tool_calls[0].get("name") if response.tool_calls else ""
+    return {"messages": [response], "current_state": "orchestrator", "route": route}
+
+def routing_input(messages):
+    """
+    The router's text for the last human message: with the previous human message and the reply to it, when
+    there was one, since the LLM orchestrator sees the whole history.
+    """
+    human = [index for index, message in enumerate(messages) if isinstance(message, HumanMessage)]
+    if not human:
+        return ""
+    if len(human) == 1:
+        return routing_text(messages[human[-1]].content)
+    replies = [message.content for message in messages[human[-2] + 1:human[-1]]
+               if isinstance(message, AIMessage) and isinstance(message.content, str) and message.content.strip()]
+    return routing_text(messages[human[-1]].content, messages[human[-2]].content, replies[-1] if replies else "")
+
+def orchestrator(state, config):
+    router = get_intent_router()
+    tool_name = router.route(get_embeddings().embed_query(routing_input(state["messages"]))) if router is not None else None
+    if tool_name:
+        return routed_tool_update(tool_name)
+    messages = [SystemMessage(content=ORCHESTRATOR_PROMPT)] + state["messages"]
+    response = get_llm().generate_response(messages, tools=[change_request_tool, query_knowledge_graph_tool, assistant_tool, end_tool], cache=True, config=config)
+    return orchestrator_update(response)
+
+async def aorchestrator(state, config):
+    router = get_intent_router()
+    tool_name = router.route(await aembed_query(get_embeddings(), routing_input(state["messages"]))) if router is not None else None
+    if tool_name:
+        return routed_tool_update(tool_name)
+    messages = [SystemMessage(content=ORCHESTRATOR_PROMPT)] + state["messages"]
+    response = await get_llm().agenerate_response(messages, tools=[change_request_tool, query_knowledge_graph_tool, assistant_tool, end_tool], cache=True, config=config)
+    return orchestrator_update(response)
+
+
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a patient and a health assistant with the new messages above.
+Never miss important user information and medical insights. Reply with the updated summary only, in at most {max_words} words.
+
+Summary so far: {summary}"""
+
+def summary_messages(summary, messages, max_tokens):
+    # Roughly three words per four tokens; the result is also cut at max_tokens afterwards.
+    prompt = SUMMARY_PROMPT.format(max_words=max_tokens * 3 // 4, summary=summary or "(none yet)")
+    return messages + [HumanMessage(content=prompt)]
+
+def summarize_conversation(summary, messages):
+    """
+    Runs on the summarizer thread, never on the request path.
+    """
+    max_tokens = int(os.getenv('SUMMARY_MAX_TOKENS', 400))
+    response = get_llm().generate_response(summary_messages(summary, messages, max_tokens))
+    return get_context_packer().counter.truncate(response.content.strip(), max_tokens)
 
-def final_state(state):
-    messages = state["messages"]
-    if len(messages) > 14:
-        summary = state.get("summary", "")
-        if summary:
-            summary_message = (
-                f"This is summary of the conversation to date: {summary}\n\n"
-                "Including the previous summary, summarize the new messages above, never miss important user information and medical insights:"
-            )
-        else:
-            summary_message = "Create a summary of the conversation above:"
-
-        messages = state["messages"] + [HumanMessage(content=summary_message)]
-        response = llm.generate_response(messages, bind_tools=False)
-        delete_messages = []
-        for i, m in enumerate(state["messages"][:-2]):
-            delete_messages.append(RemoveMessage(id=m.id))
-            if isinstance(m, AIMessage) and "tool_calls" in m.additional_kwargs and (i + 1 < len(state["messages"])) and isinstance(state["messages"][i + 1], ToolMessage):
-                delete_messages.append(RemoveMessage(id=state["messages"][i + 1].id))
-        kg.close()
-        return {"summary": state.get("summary", "")+response.content, "messages": delete_messages}
-    kg.close()
+def compact_history(state, config):
+    # Applies a summary finished since the last turn before anything reads the messages.
+    update = get_summarizer().compaction(config["configurable"]["thread_id"], state["messages"])
+    return update or state
+
+def final_state(state, config):
+    get_summarizer().maybe_submit(config["configurable"]["thread_id"], state.get("summary", ""), state["messages"])
     return state
 
 
 def router1(state) -> Literal["orchestrator", "appt_rescheduler", "treatment_change"]:
-    if state["current_state"] == "appt_rescheduler":
+    if state.get("current_state") == "appt_rescheduler":
         return "appt_rescheduler"
-    elif state["current_state"] == "treatment_change":
+    elif state.get("current_state") == "treatment_change":
         return "treatment_change"
     else:
         return "orchestrator"
@@ -355,11 +515,12 @@ def router5(state) -> Literal["change_state", "final_state"]:
     return "final_state"
 
 
-memory = MemorySaver()
 g = StateGraph(State)
+# Nodes that call out to the LLM, Neo4j or Pinecone get an async implementation used by graph.astream.
+g.add_node("compact_history", compact_history)
 g.add_node("knowledge_extractor", knowledge_extractor)
-g.add_node("orchestrator", orchestrator)
-g.add_node("assistant", assistant)
+g.add_node("orchestrator", RunnableCallable(orchestrator, aorchestrator))
+g.add_node("assistant", RunnableCallable(assistant, aassistant))
 @g.add_node
 def add_change_request_tool_message(state: State):
     return {
@@ -400,14 +561,15 @@ def add_end_tool_message(state: State):
             )
         ]
     }
-g.add_node("change_state", change_state)
-g.add_node("change_request", change_request)
-g.add_node("appt_rescheduler", appt_rescheduler)
-g.add_node("treatment_change", treatment_change)
-g.add_node("query_knowledge_graph", query_knowledge_graph)
+g.add_node("change_state", RunnableCallable(change_state, achange_state))
+g.add_node("change_request", RunnableCallable(change_request, achange_request))
+g.add_node("appt_rescheduler", RunnableCallable(appt_rescheduler, aappt_rescheduler))
+g.add_node("treatment_change", RunnableCallable(treatment_change, atreatment_change))
+g.add_node("query_knowledge_graph", RunnableCallable(query_knowledge_graph, aquery_knowledge_graph))
 g.add_node("final_state", final_state)
 
-g.add_edge(START, "knowledge_extractor")
+g.add_edge(START, "compact_history")
+g.add_edge("compact_history", "knowledge_extractor")
 g.add_conditional_edges("knowledge_extractor", router1)
 g.add_conditional_edges("orchestrator", router2)
 g.add_conditional_edges("add_tool_message", router3)
@@ -422,13 +584,5 @@ g.add_edge("add_end_tool_message", "final_state")
 g.add_edge("assistant", "final_state")
 g.add_edge("final_state", END)
 
-def compile_graph():
-    return g.compile(checkpointer=memory)
-
-def save_graph(graph, file_name='graph.png', output_dir='graphs'):
-    os.makedirs(output_dir, exist_ok=True)
-    graph_image = graph.get_graph().draw_mermaid_png()
-    file_path = os.path.join(output_dir, file_name)
-    with open(file_path, 'wb') as f:
-        f.write(graph_image)
-    print(f"Graph saved at: {file_path}")
\ No newline at end of file
+def compile_graph(checkpointer=None):
+    return g.compile(checkpointer=checkpointer or get_checkpointer())
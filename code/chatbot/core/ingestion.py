@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from itertools import islice
+
+@dataclass
+class Chunk:
+    id: str
+    text: str
+    metadata: dict
+
+@dataclass
+class SourceFile:
+    path: str
+    mtime: float
+    size: int
+    pending_chunks: int = 0
+    chunked: bool = False
+    failed: bool = False
+    chunks: int = 0
+
+@dataclass
+class IngestStats:
+    files: int = 0
+    files_skipped: int = 0
+    chunks: int = 0
+    chunks_skipped: int = 0
+    upserted: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    errors: list = field(default_factory=list)
+
+def chunk_id(source, text):
+    # Content addressed: an unchanged chunk keeps its id across runs, so upserts are idempotent.
+    return hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()
+
+def iter_files(paths, extensions):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in extensions:
+                    yield os.path.join(root, name)
+
+def iter_blocks(path, block_chars=1_000_000):
+    """
+    Reads a file in blocks that end on a paragraph break where possible, so one huge file never sits in memory.
+    """
+    carry = ""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        while True:
+            data = f.read(block_chars)
+            if not data:
+                break
+            block = carry + data
+            cut = block.rfind("\n\n")
+            if cut <= 0:
+                cut = len(block)
+            carry = block[cut:]
+            yield block[:cut]
+    if carry.strip():
+        yield carry
+
+def iter_chunks(source, splitter):
+    index = 0
+    for block in iter_blocks(source.path):
+        for text in splitter.split_text(block):
+            yield Chunk(chunk_id(source.path, text), text, {"source": source.path, "chunk": index})
+            index += 1
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+class IngestState:
+    """
+    SQLite checkpoint of an ingestion: content hashes of upserted chunks and files that were fully ingested.
+    """
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, source TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, chunks INTEGER NOT NULL)")
+        self.db.commit()
+
+    def file_done(self, source):
+        row = self.db.execute("SELECT mtime, size FROM files WHERE path = ?", (source.path,)).fetchone()
+        return row is not None and row[0] == source.mtime and row[1] == source.size
+
+    def has_chunk(self, id):
+        return self.db.execute("SELECT 1 FROM chunks WHERE id = ?", (id,)).fetchone() is not None
+
+    def mark_chunks(self, chunks):
+        self.db.executemany("INSERT OR IGNORE INTO chunks (id, source) VALUES (?, ?)", [(c.id, c.metadata["source"]) for c in chunks])
+        self.db.commit()
+
+    def mark_file(self, source):
+        self.db.execute("INSERT OR REPLACE INTO files (path, mtime, size, chunks) VALUES (?, ?, ?, ?)",
+                        (source.path, source.mtime, source.size, source.chunks))
+        self.db.commit()
+
+    def reset(self):
+        self.db.execute("DELETE FROM chunks")
+        self.db.execute("DELETE FROM files")
+        self.db.commit()
+
+class CorpusIngestor:
+    """
+    Streams files -> chunks -> embedding batches -> parallel upserts. At most `max_in_flight` batches are
+    held at any time, so memory stays flat however big the corpus is. Progress is checkpointed only after
+    a batch's upsert succeeded, so an interrupted run resumes where it stopped.
+    """
+    def __init__(self, vector_store, state, splitter, batch_size=64, upsert_workers=4, max_in_flight=None, progress=None):
+        self.vector_store = vector_store
+        self.state = state
+        self.splitter = splitter
+        self.batch_size = batch_size
+        self.upsert_workers = upsert_workers
+        self.max_in_flight = max_in_flight or upsert_workers * 2
+        self.progress = progress or (lambda stats: None)
+        self.stats = IngestStats()
+
+    def new_chunks(self, paths, extensions):
+        """
+        Yields (source, chunk) for every chunk not ingested yet, skipping unchanged files without reading them.
+        """
+        for path in iter_files(paths, extensions):
+            stat = os.stat(path)
+            source = SourceFile(path, stat.st_mtime, stat.st_size)
+            if self.state.file_done(source):
+                self.stats.files_skipped += 1
+                continue
+            self.stats.files += 1
+            for chunk in iter_chunks(source, self.splitter):
+                source.chunks += 1
+                if self.state.has_chunk(chunk.id):
+                    self.stats.chunks_skipped += 1
+                    continue
+                self.stats.chunks += 1
+                # Counted when yielded, so the file is never marked done while a batch is still being filled.
+                source.pending_chunks += 1
+                yield source, chunk
+            source.chunked = True
+            self._maybe_finish(source)
+
+    def _maybe_finish(self, source):
+        if source.chunked and not source.failed and source.pending_chunks == 0:
+            self.state.mark_file(source)
+
+    def _upsert(self, batch):
+        chunks = [chunk for _, chunk in batch]
+        texts = [chunk.text for chunk in chunks]
+        embeddings = self.vector_store.embeddings.embed_documents(texts)
+        self.vector_store.add_embeddings(texts, embeddings, [chunk.metadata for chunk in chunks], [chunk.id for chunk in chunks])
+
+    def _settle(self, future, batch):
+        sources = list({id(source): source for source, _ in batch}.values())
+        try:
+            future.result()
+            self.state.mark_chunks([chunk for _, chunk in batch])
+            self.stats.upserted += len(batch)
+            self.stats.batches += 1
+        except Exception as e:
+            # Its chunks stay out of the checkpoint, so the next run retries them; the file is not marked done.
+            self.stats.failed_batches += 1
+            self.stats.errors.append(str(e))
+            for source in sources:
+                source.failed = True
+        for source, _ in batch:
+            source.pending_chunks -= 1
+        for source in sources:
+            self._maybe_finish(source)
+        self.progress(self.stats)
+
+    def run(self, paths, extensions):
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.upsert_workers, thread_name_prefix="ingest") as pool:
+            for batch in batched(self.new_chunks(paths, extensions), self.batch_size):
+                pending[pool.submit(self._upsert, batch)] = batch
+                while len(pending) >= self.max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._settle(future, pending.pop(future))
+            for future in list(pending):
+                self._settle(future, pending.pop(future))
+        return self.stats
@@ -0,0 +1,160 @@
+import os
+import numpy as np
+
+INTENT_TOOLS = ("change_request_tool", "query_knowledge_graph_tool", "assistant_tool", "end_tool")
+
+# Seed examples taken from the orchestrator prompt, extended with common phrasings.
+SEED_EXAMPLES = {
+    "change_request_tool": [
+        "I want to reschedule my appointment to next Friday",
+        "Can we change my medication?",
+        "Can I move my appointment to Monday morning?",
+        "I need to change my appointment time",
+        "Please book me a different slot with the doctor",
+        "Can you adjust my treatment plan?",
+        "I would like to lower the dosage of my medicine",
+        "Can we increase my current cholesterol medicines dosage?",
+        "I want to switch to a different medication",
+        "Cancel my appointment and set a new one next week",
+    ],
+    "query_knowledge_graph_tool": [
+        "What medication am I currently taking?",
+        "Tell me more about my condition",
+        "What allergies do I have?",
+        "What did I tell you about my symptoms last time?",
+        "Which conditions have I been diagnosed with?",
+        "What is my dosage of Lisinopril?",
+        "Do you remember the name of my dog?",
+        "What treatments am I on right now?",
+        "Remind me what my exercise habits are",
+        "What health problems do I have?",
+    ],
+    "assistant_tool": [
+        "What should I do if I have a cold?",
+        "Can you tell me more about managing stress?",
+        "How much water should I drink every day?",
+        "What are good exercises for knee pain?",
+        "Is it safe to take ibuprofen with food?",
+        "How can I sleep better at night?",
+        "What foods help lower cholesterol?",
+        "Hi, how are you today?",
+        "Thank you for your help!",
+        "What are the symptoms of the flu?",
+    ],
+    "end_tool": [
+        "Who will win the football game tonight?",
+        "Write me a poem about the ocean",
+        "What do you think about the election?",
+        "Tell me a joke about politicians",
+        "How do I fix my car engine?",
+        "What is the capital of France?",
+        "Can you help me with my math homework?",
+        "Recommend a good movie to watch",
+        "What is the price of bitcoin?",
+        "Which religion is the right one?",
+    ],
+}
+
+def routing_text(message, previous_message="", previous_reply=""):
+    """
+    What the router classifies: the message, preceded on a follow-up by the previous turn, which a short
+    message like "and for my knee?" only makes sense with. Training and routing build it the same way.
+    """
+    if not previous_message:
+        return message
+    return f"{previous_message}\n{previous_reply[:300]}\n{message}"
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class IntentRouter:
+    """
+    Nearest-centroid classifier over sentence embeddings that picks the orchestrator tool locally.
+    Confidence is a softmax over the cosine similarity to each centroid; below the threshold, or when
+    the message is not close to any centroid at all, the caller should fall back to the LLM orchestrator.
+    `evaluation` holds the held-out report of a trained model: {"examples", "threshold", "local_accuracy"}.
+    """
+    def __init__(self, centroids, labels, threshold=0.85, temperature=0.05, min_similarity=0.3, evaluation=None):
+        self.centroids = normalize_rows(np.asarray(centroids, dtype=np.float32))
+        self.labels = list(labels)
+        self.threshold = threshold
+        self.temperature = temperature
+        self.min_similarity = min_similarity
+        self.evaluation = evaluation
+
+    @classmethod
+    def fit(cls, embeddings, labels, **kwargs):
+        embeddings = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        labels = np.asarray(labels)
+        classes = [label for label in INTENT_TOOLS if label in set(labels)]
+        centroids = np.stack([embeddings[labels == label].mean(axis=0) for label in classes])
+        return cls(centroids, classes, **kwargs)
+
+    def similarities(self, embeddings):
+        embeddings = normalize_rows(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        return embeddings @ self.centroids.T
+
+    def predict_proba(self, embeddings):
+        logits = self.similarities(embeddings) / self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict(self, embedding):
+        """
+        Returns (tool name, confidence) for a single embedding.
+        """
+        probabilities = self.predict_proba(embedding)[0]
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+    def route(self, embedding):
+        """
+        Returns the tool name when the prediction clears the threshold, otherwise None.
+        """
+        label, confidence = self.predict(embedding)
+        if confidence < self.threshold or self.similarities(embedding).max() < self.min_similarity:
+            return None
+        return label
+
+    def confident(self, embeddings):
+        """
+        Mask of the embeddings `route` would send without the LLM orchestrator.
+        """
+        probabilities = self.predict_proba(embeddings)
+        return (probabilities.max(axis=1) >= self.threshold) & (self.similarities(embeddings).max(axis=1) >= self.min_similarity)
+
+    def trusted(self, min_accuracy, min_examples):
+        """
+        Whether the held-out evaluation shows local routes accurate enough, on enough messages, at a threshold
+        no lower than the one routing now.
+        """
+        evaluation = self.evaluation
+        return (evaluation is not None and evaluation["examples"] >= min_examples
+                and evaluation["local_accuracy"] >= min_accuracy and self.threshold >= evaluation["threshold"])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        evaluation = {f"evaluation_{key}": value for key, value in (self.evaluation or {}).items()}
+        np.savez(path, centroids=self.centroids, labels=np.asarray(self.labels), temperature=self.temperature, **evaluation)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        data = np.load(path)
+        kwargs.setdefault("temperature", float(data["temperature"]))
+        if "evaluation_examples" in data:
+            kwargs.setdefault("evaluation", {
+                "examples": int(data["evaluation_examples"]),
+                "threshold": float(data["evaluation_threshold"]),
+                "local_accuracy": float(data["evaluation_local_accuracy"]),
+            })
+        return cls(data["centroids"], [str(label) for label in data["labels"]], **kwargs)
+
+def seed_training_set():
+    texts, labels = [], []
+    for label, examples in SEED_EXAMPLES.items():
+        texts.extend(examples)
+        labels.extend([label] * len(examples))
+    return texts, labels
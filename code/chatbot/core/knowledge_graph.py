@@ -1,77 +1,455 @@
-from neo4j import GraphDatabase
+import asyncio
+import logging
+import os
+import threading
+import time
+from neo4j import GraphDatabase, AsyncGraphDatabase
+from .cypher_templates import UserVocabulary
+from .subgraph_cache import QueryBudgetExceeded, SubgraphCache, UserSubgraph, build_subgraph
+
+logger = logging.getLogger(__name__)
+
+def process_path(path, end):
+    path_description = []
+    if path:
+        nodes = path.nodes
+        relationships = path.relationships
+        for i in range(len(nodes)-end):
+            node = nodes[i]
+            name = node.get('name')
+            entity_type = node.get('type')
+            path_description.append(f"{name} ({entity_type})")
+            if i < len(relationships):
+                relationship = relationships[i]
+                relationship_type = relationship.get('type')
+                path_description.append(f"--[{relationship_type}]-->")
+    path_sentence = " ".join(path_description)
+    return path_sentence
+
+def format_path_record(record):
+    path1 = record.get('path1')
+    path2 = record.get('path2')
+    sentence = ""
+    if path2: sentence = sentence+process_path(path1, 1)
+    else: sentence = sentence+process_path(path1, 0)
+    sentence = sentence+process_path(path2, 0)
+    return sentence
+
+FETCH_USER_ENTITIES_QUERY = """
+    MATCH (u:Entity {name: $user_name, type: "Person"})-[r]->(e:Entity)
+    RETURN DISTINCT e.type AS entity_labels, r.type AS relationship_type
+    """
+
+FETCH_USER_VOCABULARY_QUERY = """
+    MATCH (u:Entity {name: $user_name, type: "Person"})-[r]->(e:Entity)
+    RETURN DISTINCT e.name AS name, e.type AS type, r.type AS relationship_type
+    """
+
+SUBGRAPH_ROWS = """
+    WITH DISTINCT n
+    OPTIONAL MATCH (n)-[r]->(m:Entity)
+    RETURN n.name AS name, n.type AS type, collect([r.type, m.name, m.type]) AS edges
+    """
+
+LOAD_USER_SUBGRAPH_QUERY = """
+    MATCH (u:Entity {name: $user_name, type: "Person"})-[*0..]->(n:Entity)
+    """ + SUBGRAPH_ROWS
+
+LOAD_DESCENDANTS_QUERY = """
+    MATCH (s:Entity) WHERE s.name IN $names
+    MATCH (s)-[*0..]->(n:Entity)
+    """ + SUBGRAPH_ROWS
+
+MERGE_ENTITIES_QUERY = """
+    UNWIND $entities AS entity
+    MERGE (e:Entity {name: entity.name, type: entity.type})
+    RETURN count(*) AS merged
+    """
+
+MERGE_RELATIONSHIPS_QUERY = """
+    UNWIND $relationships AS rel
+    MATCH (e1:Entity {name: rel.from})
+    MATCH (e2:Entity {name: rel.to})
+    MERGE (e1)-[:RELATIONSHIP {type: rel.relationship}]->(e2)
+    RETURN count(*) AS merged
+    """
+
+MERGE_ENTITY_QUERY = """
+    MERGE (e:Entity {name: $name, type: $type})
+    """
+
+MERGE_RELATIONSHIP_QUERY = """
+    MATCH (e1:Entity {name: $entity1})
+    MATCH (e2:Entity {name: $entity2})
+    MERGE (e1)-[:RELATIONSHIP {type: $relationship}]->(e2)
+    """
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def entity_params(entities):
+    return [{"name": entity['name'], "type": entity['type']} for entity in entities]
+
+def relationship_params(relationships):
+    return [{"from": rel['from'], "relationship": rel['relationship'], "to": rel['to']} for rel in relationships]
+
+def empty_write_counts():
+    return {"entities_merged": 0, "relationships_merged": 0, "nodes_created": 0, "relationships_created": 0}
+
+def add_write_counts(counts, key, merged, summary):
+    counts[key] += merged
+    counts["nodes_created"] += summary.counters.nodes_created
+    counts["relationships_created"] += summary.counters.relationships_created
+
+def write_batches(tx, entities, relationships, batch_size):
+    """
+    Runs inside one managed write transaction. Entities go first so the relationship MATCHes see them.
+    """
+    counts = empty_write_counts()
+    for batch in chunked(entities, batch_size):
+        result = tx.run(MERGE_ENTITIES_QUERY, entities=batch)
+        add_write_counts(counts, "entities_merged", result.single()["merged"], result.consume())
+    for batch in chunked(relationships, batch_size):
+        result = tx.run(MERGE_RELATIONSHIPS_QUERY, relationships=batch)
+        add_write_counts(counts, "relationships_merged", result.single()["merged"], result.consume())
+    return counts
+
+async def awrite_batches(tx, entities, relationships, batch_size):
+    counts = empty_write_counts()
+    for batch in chunked(entities, batch_size):
+        result = await tx.run(MERGE_ENTITIES_QUERY, entities=batch)
+        record = await result.single()
+        add_write_counts(counts, "entities_merged", record["merged"], await result.consume())
+    for batch in chunked(relationships, batch_size):
+        result = await tx.run(MERGE_RELATIONSHIPS_QUERY, relationships=batch)
+        record = await result.single()
+        add_write_counts(counts, "relationships_merged", record["merged"], await result.consume())
+    return counts
+
+def merge_entity(tx, entity_name, entity_type):
+    tx.run(MERGE_ENTITY_QUERY, name=entity_name, type=entity_type).consume()
+
+async def amerge_entity(tx, entity_name, entity_type):
+    await (await tx.run(MERGE_ENTITY_QUERY, name=entity_name, type=entity_type)).consume()
+
+def merge_relationship(tx, entity1, relationship, entity2):
+    tx.run(MERGE_RELATIONSHIP_QUERY, entity1=entity1, entity2=entity2, relationship=relationship).consume()
+
+async def amerge_relationship(tx, entity1, relationship, entity2):
+    await (await tx.run(MERGE_RELATIONSHIP_QUERY, entity1=entity1, entity2=entity2, relationship=relationship)).consume()
+
+def split_user_entities(records):
+    entities = []
+    relationships = []
+    for record in records:
+        entity_labels = record.get("entity_labels")
+        relationship_type = record.get("relationship_type")
+        if entity_labels:
+            entities.append(entity_labels)
+        if relationship_type:
+            relationships.append(relationship_type)
+    return entities, relationships
+
+def fetch_user_entities(tx, user_name):
+    return split_user_entities(list(tx.run(FETCH_USER_ENTITIES_QUERY, user_name=user_name)))
+
+async def afetch_user_entities(tx, user_name):
+    result = await tx.run(FETCH_USER_ENTITIES_QUERY, user_name=user_name)
+    return split_user_entities([record async for record in result])
+
+def vocabulary_records(records):
+    return UserVocabulary.from_records((record.get("name"), record.get("type"), record.get("relationship_type")) for record in records)
+
+def fetch_user_vocabulary(tx, user_name):
+    return vocabulary_records(list(tx.run(FETCH_USER_VOCABULARY_QUERY, user_name=user_name)))
+
+async def afetch_user_vocabulary(tx, user_name):
+    result = await tx.run(FETCH_USER_VOCABULARY_QUERY, user_name=user_name)
+    return vocabulary_records([record async for record in result])
+
+def run_path_query(tx, query, params):
+    return [format_path_record(record) for record in tx.run(query, params)]
+
+async def arun_path_query(tx, query, params):
+    result = await tx.run(query, params)
+    return [format_path_record(record) async for record in result]
+
+def subgraph_rows(records):
+    return [(record["name"], record["type"], record["edges"]) for record in records]
+
+def fetch_subgraph_rows(tx, query, params):
+    return subgraph_rows(list(tx.run(query, params)))
+
+async def afetch_subgraph_rows(tx, query, params):
+    result = await tx.run(query, params)
+    return subgraph_rows([record async for record in result])
+
+def connection_counts(driver):
+    """
+    Open and in-use connections of a driver's pool. The driver has no public API for this,
+    so it reads the pool internals and returns None when they are not there.
+    """
+    try:
+        connections = [connection for pooled in list(driver._pool.connections.values()) for connection in list(pooled)]
+    except AttributeError:
+        return None
+    return {"open": len(connections), "in_use": sum(1 for connection in connections if connection.in_use)}
+
+class PoolMetrics:
+    """
+    Acquisition wait is the time from opening a transaction until the transaction function first runs,
+    which is when the driver has handed out a pooled connection.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.transactions = 0
+        self.active = 0
+        self.peak_active = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def started(self):
+        with self._lock:
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+        return time.perf_counter()
+
+    def acquired(self, started):
+        wait = time.perf_counter() - started
+        with self._lock:
+            self.transactions += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def finished(self):
+        with self._lock:
+            self.active -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "transactions": self.transactions,
+                "active": self.active,
+                "peak_active": self.peak_active,
+                "avg_acquisition_wait_ms": self.total_wait / self.transactions * 1000 if self.transactions else 0.0,
+                "max_acquisition_wait_ms": self.max_wait * 1000,
+            }
+
 class KnowledgeGraph:
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    """
+    Owns one pooled sync driver (extraction worker threads) and one pooled async driver (request path)
+    for the lifetime of the process. Reads go through execute_read, writes through execute_write,
+    so the driver retries transient failures and routes them correctly on a cluster.
+    """
+    def __init__(self, uri, user, password, write_batch_size=None, max_pool_size=None,
+                 acquisition_timeout=None, liveness_check_timeout=None, max_connection_lifetime=None, max_retry_time=None,
+                 subgraph_cache_mb=None, subgraph_cache_ttl=None):
+        self.write_batch_size = write_batch_size or int(os.getenv('KG_WRITE_BATCH_SIZE', 500))
+        self.max_pool_size = max_pool_size or int(os.getenv('NEO4J_MAX_POOL_SIZE', 50))
+        driver_config = {
+            "max_connection_pool_size": self.max_pool_size,
+            "connection_acquisition_timeout": acquisition_timeout or float(os.getenv('NEO4J_ACQUISITION_TIMEOUT', 10)),
+            # Connections idle for longer than this are pinged before they are handed out.
+            "liveness_check_timeout": liveness_check_timeout or float(os.getenv('NEO4J_LIVENESS_CHECK_TIMEOUT', 30)),
+            "max_connection_lifetime": max_connection_lifetime or float(os.getenv('NEO4J_MAX_CONNECTION_LIFETIME', 3600)),
+            # How long execute_read/execute_write keep retrying transient errors before giving up.
+            "max_transaction_retry_time": max_retry_time or float(os.getenv('NEO4J_MAX_RETRY_TIME', 5)),
+        }
+        self.driver = GraphDatabase.driver(uri, auth=(user, password), **driver_config)
+        self.async_driver = AsyncGraphDatabase.driver(uri, auth=(user, password), **driver_config)
+        self.metrics = PoolMetrics()
+        self.closed = False
+        # Per-user subgraphs answer vocabulary and template queries without Neo4j; 0 turns the cache off.
+        cache_mb = subgraph_cache_mb if subgraph_cache_mb is not None else float(os.getenv('KG_SUBGRAPH_CACHE_MB', 64))
+        cache_ttl = subgraph_cache_ttl if subgraph_cache_ttl is not None else float(os.getenv('KG_SUBGRAPH_CACHE_TTL', 30))
+        self.subgraphs = SubgraphCache(int(cache_mb * 1024 * 1024), cache_ttl) if cache_mb > 0 else None
 
     def close(self):
         self.driver.close()
 
+    async def aclose(self):
+        await self.async_driver.close()
+
+    def shutdown(self):
+        """
+        Closes both drivers, registered with atexit. The async driver is closed on a fresh loop
+        because the server's loop is already gone by then; failing that the OS closes its sockets.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.close()
+        try:
+            asyncio.run(self.aclose())
+        except Exception:
+            pass
+
+    def _execute(self, access, work, *args):
+        started = self.metrics.started()
+        acquired = []
+        def timed_work(tx, *work_args):
+            if not acquired:
+                acquired.append(True)
+                self.metrics.acquired(started)
+            return work(tx, *work_args)
+        try:
+            with self.driver.session() as session:
+                return getattr(session, access)(timed_work, *args)
+        finally:
+            self.metrics.finished()
+
+    async def _aexecute(self, access, work, *args):
+        started = self.metrics.started()
+        acquired = []
+        async def timed_work(tx, *work_args):
+            if not acquired:
+                acquired.append(True)
+                self.metrics.acquired(started)
+            return await work(tx, *work_args)
+        try:
+            async with self.async_driver.session() as session:
+                return await getattr(session, access)(timed_work, *args)
+        finally:
+            self.metrics.finished()
+
+    def read(self, work, *args):
+        return self._execute("execute_read", work, *args)
+
+    def write(self, work, *args):
+        return self._execute("execute_write", work, *args)
+
+    async def aread(self, work, *args):
+        return await self._aexecute("execute_read", work, *args)
+
+    async def awrite(self, work, *args):
+        return await self._aexecute("execute_write", work, *args)
+
+    def stats(self):
+        return {
+            "max_pool_size": self.max_pool_size,
+            "sync_pool": connection_counts(self.driver),
+            "async_pool": connection_counts(self.async_driver),
+            **self.metrics.snapshot(),
+            "subgraph_cache": self.subgraphs.stats() if self.subgraphs is not None else None,
+        }
+
+    def user_subgraph(self, user_name):
+        subgraph = self.subgraphs.get(user_name)
+        if subgraph is None:
+            generation = self.subgraphs.generation
+            rows = self.read(fetch_subgraph_rows, LOAD_USER_SUBGRAPH_QUERY, {"user_name": user_name})
+            subgraph = UserSubgraph(user_name, build_subgraph(rows))
+            self.subgraphs.put(subgraph, generation)
+        return subgraph
+
+    async def auser_subgraph(self, user_name):
+        subgraph = self.subgraphs.get(user_name)
+        if subgraph is None:
+            generation = self.subgraphs.generation
+            rows = await self.aread(afetch_subgraph_rows, LOAD_USER_SUBGRAPH_QUERY, {"user_name": user_name})
+            subgraph = UserSubgraph(user_name, build_subgraph(rows))
+            self.subgraphs.put(subgraph, generation)
+        return subgraph
+
+    def write_through(self, relationships):
+        """
+        Brings the cached subgraphs up to date after a committed write: loads what now hangs below
+        the new relationship targets and attaches it to every cached user that reaches the source.
+        """
+        if self.subgraphs is None or not relationships:
+            return
+        targets = self.subgraphs.write_targets(relationships)
+        if targets:
+            self.subgraphs.apply_write(relationships, self.read(fetch_subgraph_rows, LOAD_DESCENDANTS_QUERY, {"names": targets}))
+
+    async def awrite_through(self, relationships):
+        if self.subgraphs is None or not relationships:
+            return
+        targets = self.subgraphs.write_targets(relationships)
+        if targets:
+            self.subgraphs.apply_write(relationships, await self.aread(afetch_subgraph_rows, LOAD_DESCENDANTS_QUERY, {"names": targets}))
+
     def create_entity(self, entity_name, entity_type):
-        with self.driver.session() as session:
-            session.run("""
-                MERGE (e:Entity {name: $name, type: $type})
-            """, name=entity_name, type=entity_type)
+        self.write(merge_entity, entity_name, entity_type)
 
     def create_relationship(self, entity1, relationship, entity2):
-        with self.driver.session() as session:
-            session.run("""
-                MATCH (e1:Entity {name: $entity1})
-                MATCH (e2:Entity {name: $entity2})
-                MERGE (e1)-[:RELATIONSHIP {type: $relationship}]->(e2)
-            """, entity1=entity1, entity2=entity2, relationship=relationship)
+        self.write(merge_relationship, entity1, relationship, entity2)
+        self.write_through([{"from": entity1, "relationship": relationship, "to": entity2}])
 
     def store_entities_and_relationships(self, entities, relationships):
+        """
+        Merges all entities and relationships in a single write transaction using UNWIND batches,
+        and returns how many rows were merged and how many nodes and relationships were created.
+        """
         if(len(entities) == 0 and len(relationships) == 0):
-            return
-        for entity in entities:
-            self.create_entity(entity['name'], entity['type'])
-        for relationship in relationships:
-            self.create_relationship(relationship['from'], relationship['relationship'], relationship['to'])
+            return empty_write_counts()
+        counts = self.write(write_batches, entity_params(entities), relationship_params(relationships), self.write_batch_size)
+        self.write_through(relationships)
+        return counts
 
+    async def acreate_entity(self, entity_name, entity_type):
+        await self.awrite(amerge_entity, entity_name, entity_type)
+
+    async def acreate_relationship(self, entity1, relationship, entity2):
+        await self.awrite(amerge_relationship, entity1, relationship, entity2)
+        await self.awrite_through([{"from": entity1, "relationship": relationship, "to": entity2}])
+
+    async def astore_entities_and_relationships(self, entities, relationships):
+        if(len(entities) == 0 and len(relationships) == 0):
+            return empty_write_counts()
+        counts = await self.awrite(awrite_batches, entity_params(entities), relationship_params(relationships), self.write_batch_size)
+        await self.awrite_through(relationships)
+        return counts
 
     def fetch_entities_and_relationships_for_user(self, user_name):
-        with self.driver.session() as session:
-            result = session.run("""
-              MATCH (u:Entity {name: $user_name, type: "Person"})-[r]->(e:Entity)
-              RETURN DISTINCT e.type AS entity_labels, r.type AS relationship_type
-              """, user_name=user_name)
-            entities = []
-            relationships = []
-            for record in result:
-                entity_labels = record.get("entity_labels")
-                relationship_type = record.get("relationship_type")
-                if entity_labels:
-                    entities.append(entity_labels)
-                if relationship_type:
-                    relationships.append(relationship_type)
-        return entities, relationships
-
-    def execute_cypher_query(self, query):
-        with self.driver.session() as session:
-            result = session.run(query)
-            formatted_results = []
-            for record in result:
-                path1 = record.get('path1')
-                path2 = record.get('path2')
-                sentence = ""
-                def process_path(path, path_name, end):
-                    path_description = []
-                    if path:
-                        nodes = path.nodes
-                        relationships = path.relationships
-                        for i in range(len(nodes)-end):
-                            node = nodes[i]
-                            name = node.get('name')
-                            entity_type = node.get('type')
-                            path_description.append(f"{name} ({entity_type})")
-                            if i < len(relationships):
-                                relationship = relationships[i]
-                                relationship_type = relationship.get('type')
-                                path_description.append(f"--[{relationship_type}]-->")
-                    path_sentence = " ".join(path_description)
-                    return path_sentence
-                if path2: sentence = sentence+process_path(path1, "Path1", 1)
-                else: sentence = sentence+process_path(path1, "Path1", 0)
-                sentence = sentence+process_path(path2, "Path2", 0)
-                formatted_results.append(sentence)
-            return formatted_results
+        if self.subgraphs is not None:
+            return self.user_subgraph(user_name).entities_and_relationships()
+        return self.read(fetch_user_entities, user_name)
+
+    async def afetch_entities_and_relationships_for_user(self, user_name):
+        if self.subgraphs is not None:
+            return (await self.auser_subgraph(user_name)).entities_and_relationships()
+        return await self.aread(afetch_user_entities, user_name)
+
+    def fetch_user_vocabulary(self, user_name):
+        if self.subgraphs is not None:
+            return self.user_subgraph(user_name).vocabulary()
+        return self.read(fetch_user_vocabulary, user_name)
+
+    async def afetch_user_vocabulary(self, user_name):
+        if self.subgraphs is not None:
+            return (await self.auser_subgraph(user_name)).vocabulary()
+        return await self.aread(afetch_user_vocabulary, user_name)
+
+    def execute_cypher_query(self, query, params=None):
+        # A read transaction also keeps a generated query from writing to the graph.
+        return self.read(run_path_query, query, params or {})
+
+    async def aexecute_cypher_query(self, query, params=None):
+        return await self.aread(arun_path_query, query, params or {})
+
+    def execute_selection(self, selection):
+        """
+        Runs a query picked by the Cypher template matcher, from the cached subgraph when it is a template.
+        Subgraphs too densely linked to walk within the step budget are queried in Neo4j instead.
+        """
+        if self.subgraphs is not None and selection.template:
+            subgraph = self.user_subgraph(selection.params["user_name"])
+            try:
+                return [format_path_record(record) for record in subgraph.query(selection.template, selection.params)]
+            except QueryBudgetExceeded:
+                logger.info("Subgraph of %s too dense to walk locally, querying Neo4j", selection.params["user_name"])
+        return self.execute_cypher_query(selection.query, selection.params)
+
+    async def aexecute_selection(self, selection):
+        if self.subgraphs is not None and selection.template:
+            subgraph = await self.auser_subgraph(selection.params["user_name"])
+            # The walk is CPU-bound, so it runs off the event loop.
+            loop = asyncio.get_running_loop()
+            try:
+                records = await loop.run_in_executor(None, subgraph.query, selection.template, selection.params)
+                return [format_path_record(record) for record in records]
+            except QueryBudgetExceeded:
+                logger.info("Subgraph of %s too dense to walk locally, querying Neo4j", selection.params["user_name"])
+        return await self.aexecute_cypher_query(selection.query, selection.params)
@@ -1,4 +1,5 @@
-from typing import List
+from typing import List, Optional
+from langchain_core.runnables import RunnableConfig
 from langchain_google_genai import ChatGoogleGenerativeAI
 from .llm_interface import LLMInterface
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
@@ -7,16 +8,14 @@ class GoogleAIAdapter(LLMInterface):
     def __init__(self, api_key, model_name="gemini-1.5-flash", temperature=0):
         self.api_key = api_key
         self.model_name = model_name
-        self.client = ChatGoogleGenerativeAI(api_key=self.api_key, model=self.model_name)
-        self.bound_tools = []
+        self.temperature = temperature
+        self.client = ChatGoogleGenerativeAI(api_key=self.api_key, model=self.model_name, temperature=self.temperature)
 
     def bind_tools(self, tools):
-        self.client = self.client.bind_tools(tools)
-        return self
+        return self.client.bind_tools(tools)
 
-    def unbind_tools(self):
-        self.client = ChatGoogleGenerativeAI(api_key=self.api_key, model=self.model_name)
-        self.bound_tools = []
+    def invoke(self, messages: List, config: Optional[RunnableConfig] = None) -> AIMessage:
+        return self.client.invoke(messages, config=config)
 
-    def invoke(self, messages: List) -> AIMessage:
-        return self.client.invoke(messages)
+    async def ainvoke(self, messages: List, config: Optional[RunnableConfig] = None) -> AIMessage:
+        return await self.client.ainvoke(messages, config=config)
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+from langchain_core.messages import AIMessage, BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+logger = logging.getLogger(__name__)
+
+def serialize_message(message: BaseMessage) -> dict:
+    # Message and tool call ids are left out on purpose, they differ between otherwise identical conversations.
+    serialized = {"type": message.type, "content": message.content}
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        serialized["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in tool_calls]
+    return serialized
+
+def make_cache_key(model_name: str, temperature, tools: Optional[List], messages: List[BaseMessage]) -> str:
+    payload = {
+        "model": model_name,
+        "temperature": temperature,
+        "tools": [convert_to_openai_tool(tool) for tool in tools or []],
+        "messages": [serialize_message(message) for message in messages],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def fresh_copy(message: AIMessage) -> AIMessage:
+    """
+    Returns the cached message with new message and tool call ids, so reusing an answer never
+    replaces an earlier message in the graph state or repeats a tool call id in the history.
+    """
+    id_map = {call["id"]: f"call_{uuid.uuid4().hex[:24]}" for call in message.tool_calls if call.get("id")}
+    additional_kwargs = dict(message.additional_kwargs)
+    if "tool_calls" in additional_kwargs:
+        additional_kwargs["tool_calls"] = [
+            {**call, "id": id_map.get(call.get("id"), call.get("id"))} for call in additional_kwargs["tool_calls"]
+        ]
+    return message.model_copy(update={
+        "id": None,
+        "tool_calls": [{**call, "id": id_map.get(call.get("id"), call.get("id"))} for call in message.tool_calls],
+        "additional_kwargs": additional_kwargs,
+    })
+
+class LLMResponseCache:
+    """
+    Exact-match cache for deterministic LLM calls: an in-memory LRU in front of an optional SQLite file.
+    Identical calls that are in flight at the same time share one provider round-trip.
+    """
+    def __init__(self, max_entries=512, sqlite_path=None):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, message TEXT NOT NULL)")
+            self._db.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[AIMessage]:
+        with self._lock:
+            message = self._memory.get(key)
+            if message is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return message
+            if self._db is not None:
+                row = self._db.execute("SELECT message FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    message = messages_from_dict([json.loads(row[0])])[0]
+                    self._remember(key, message)
+                    self.disk_hits += 1
+                    return message
+            return None
+
+    def put(self, key: str, message: AIMessage):
+        with self._lock:
+            self._remember(key, message)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO llm_cache (key, message) VALUES (?, ?)", (key, json.dumps(message_to_dict(message))))
+                self._db.commit()
+
+    def _remember(self, key, message):
+        self._memory[key] = message
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _claim(self, key):
+        """
+        Returns (future, is_leader). The leader makes the call, everyone else waits on its future.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            self.misses += 1
+            return future, True
+
+    def _settle(self, key, future, message=None, error=None):
+        # Whatever happens to the cache write, the waiters get the leader's outcome.
+        try:
+            if error is None:
+                self.put(key, message)
+        except Exception:
+            logger.exception("Storing an LLM response in the cache failed")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            if error is None:
+                future.set_result(message)
+            else:
+                future.set_exception(error)
+
+    def get_or_call(self, key: str, call) -> AIMessage:
+        message = self.get(key)
+        if message is None:
+            future, is_leader = self._claim(key)
+            if not is_leader:
+                return fresh_copy(future.result())
+            try:
+                message = call()
+            except BaseException as e:
+                self._settle(key, future, error=e)
+                raise
+            self._settle(key, future, message)
+            return message
+        return fresh_copy(message)
+
+    async def aget_or_call(self, key: str, call) -> AIMessage:
+        message = self.get(key)
+        if message is None:
+            future, is_leader = self._claim(key)
+            if not is_leader:
+                return fresh_copy(await asyncio.wrap_future(future))
+            try:
+                message = await call()
+            except BaseException as e:
+                self._settle(key, future, error=e)
+                raise
+            self._settle(key, future, message)
+            return message
+        return fresh_copy(message)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.disk_hits + self.coalesced) / lookups if lookups else 0.0,
+        }
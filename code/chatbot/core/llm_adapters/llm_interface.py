@@ -1,7 +1,8 @@
 # llminterface.py
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional
 from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableConfig
 
 class LLMInterface(ABC):
     """
@@ -11,30 +12,38 @@ class LLMInterface(ABC):
     @abstractmethod
     def bind_tools(self, tools):
         """
-        Binds tools to the LLM instance (if the LLM supports it).
+        Binds tools to the LLM client (if the LLM supports it) without modifying the instance.
         
         Args:
             tools (list): List of tools to bind.
         
         Returns:
-            The LLM instance with tools bound.
+            A new runnable with the tools bound, safe to share between requests.
         """
         pass
 
     @abstractmethod
-    def unbind_tools(self):
+    def invoke(self, messages: List, config: Optional[RunnableConfig] = None) -> AIMessage:
         """
-        Unbinds or clears all tools from the LLM instance.
+        Sends the messages to the LLM instance and returns the response.
+        
+        Args:
+            messages (List[SystemMessage]): A list of messages to send to the LLM.
+            config (RunnableConfig): Config of the calling graph node, so its callbacks (token streaming) see the call.
+        
+        Returns:
+            AIMessage: The response from the LLM.
         """
         pass
 
     @abstractmethod
-    def invoke(self, messages: List) -> AIMessage:
+    async def ainvoke(self, messages: List, config: Optional[RunnableConfig] = None) -> AIMessage:
         """
-        Sends the messages to the LLM instance and returns the response.
+        Asynchronously sends the messages to the LLM instance and returns the response.
         
         Args:
             messages (List[SystemMessage]): A list of messages to send to the LLM.
+            config (RunnableConfig): Config of the calling graph node, so its callbacks (token streaming) see the call.
         
         Returns:
             AIMessage: The response from the LLM.
@@ -1,42 +1,86 @@
 from .llm_factory import LLMFactory
-from typing import List
+from typing import List, Optional
+from langchain_core.runnables import RunnableConfig
 from langchain_core.messages import SystemMessage, AIMessage
 from .llm_interface import LLMInterface
+from .llm_cache import LLMResponseCache, make_cache_key
+import threading
+import os
+
+def tool_set_key(tools: List) -> tuple:
+    """
+    Identifies a tool set by the tool names, in binding order since that is the order sent to the provider.
+    """
+    return tuple(getattr(tool, "name", None) or getattr(tool, "__name__", repr(tool)) for tool in tools)
 
 class LLMManager:
-    def __init__(self):
-        self.llm_instance = LLMFactory.create_llm_instance()
-        self.tools = []
-    def bind_tools(self, tools: List):
+    def __init__(self, llm_instance: Optional[LLMInterface] = None, cache: Optional[LLMResponseCache] = None):
+        self.llm_instance = llm_instance or LLMFactory.create_llm_instance()
+        self.cache = cache or LLMResponseCache(
+            max_entries=int(os.getenv('LLM_CACHE_SIZE', 512)),
+            sqlite_path=os.getenv('LLM_CACHE_PATH'),
+        )
+        self._bound_runnables = {}
+        self._lock = threading.Lock()
+
+    def get_runnable(self, tools: Optional[List] = None):
         """
-        Binds tools to the LLM instance if supported. This method allows dynamic tool binding based on the context.
+        Returns a runnable with `tools` bound. Bindings are built once per tool set and cached;
+        the returned runnables are never mutated, so they can be shared across threads and coroutines.
         """
-        if isinstance(self.llm_instance, LLMInterface):
-            self.llm_instance.bind_tools(tools)
-            self.tools = tools
+        if not tools:
+            return self.llm_instance
+        key = tool_set_key(tools)
+        runnable = self._bound_runnables.get(key)
+        if runnable is None:
+            with self._lock:
+                runnable = self._bound_runnables.get(key)
+                if runnable is None:
+                    runnable = self.llm_instance.bind_tools(tools)
+                    self._bound_runnables[key] = runnable
+        return runnable
 
-    def reset_tools(self):
+    def cache_key(self, messages: List[SystemMessage], tools: Optional[List] = None) -> str:
+        return make_cache_key(
+            getattr(self.llm_instance, "model_name", type(self.llm_instance).__name__),
+            getattr(self.llm_instance, "temperature", None),
+            tools,
+            messages,
+        )
+
+    def caches_responses(self) -> bool:
         """
-        Resets the tool bindings on the LLM instance by unbinding all tools.
-        This method clears both the internal `self.tools` list and any bindings in the LLM.
+        Answers are only reused at temperature 0 (TEMPERATURE); above it the provider is meant to vary them.
         """
-        if isinstance(self.llm_instance, LLMInterface):
-            self.llm_instance.unbind_tools()
-        self.tools = []
+        return not getattr(self.llm_instance, "temperature", 0)
 
-    def generate_response(self, messages: List[SystemMessage], bind_tools: bool = False) -> AIMessage:
+    def generate_response(self, messages: List[SystemMessage], tools: Optional[List] = None, cache: bool = False, config: Optional[RunnableConfig] = None) -> AIMessage:
         """
-        Generates a response using the configured LLM instance. Optionally binds tools if specified.
+        Generates a response using the configured LLM instance.
         :param messages: List of system messages to send to the LLM.
-        :param bind_tools: Whether to use tools during this invocation.
+        :param tools: Tools the LLM may call during this invocation.
+        :param cache: Reuse the answer of an identical earlier call. Only opt in for calls that are deterministic at temperature 0; ignored above it.
+        :param config: RunnableConfig of the calling graph node. Pass it so the node's callbacks (stream_mode="messages") see the call; Python < 3.11 does not propagate them through asyncio contextvars.
         :return: AIMessage object with the response.
         """
-        if bind_tools and self.tools:
-            self.llm_instance.bind_tools(self.tools)
-
-        response = self.llm_instance.invoke(messages)
+        runnable = self.get_runnable(tools)
+        if not cache or not self.caches_responses():
+            return runnable.invoke(messages, config=config)
+        return self.cache.get_or_call(self.cache_key(messages, tools), lambda: runnable.invoke(messages, config=config))
 
-        if bind_tools:
-            self.reset_tools()
+    async def agenerate_response(self, messages: List[SystemMessage], tools: Optional[List] = None, cache: bool = False, config: Optional[RunnableConfig] = None) -> AIMessage:
+        """
+        Async counterpart of `generate_response`, awaits the provider call instead of blocking the worker.
+        :param messages: List of system messages to send to the LLM.
+        :param tools: Tools the LLM may call during this invocation.
+        :param cache: Reuse the answer of an identical earlier call. Only opt in for calls that are deterministic at temperature 0; ignored above it.
+        :param config: RunnableConfig of the calling graph node. Pass it so the node's callbacks (stream_mode="messages") see the call; Python < 3.11 does not propagate them through asyncio contextvars.
+        :return: AIMessage object with the response.
+        """
+        runnable = self.get_runnable(tools)
+        if not cache or not self.caches_responses():
+            return await runnable.ainvoke(messages, config=config)
+        return await self.cache.aget_or_call(self.cache_key(messages, tools), lambda: runnable.ainvoke(messages, config=config))
 
-        return response
+    def stats(self):
+        return self.cache.stats()
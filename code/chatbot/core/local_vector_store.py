@@ -0,0 +1,209 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import uuid
+import numpy as np
+from langchain_core.documents import Document
+from .vector_store import VectorStore
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def top_k(scores, k):
+    if len(scores) <= k:
+        best = np.arange(len(scores))
+    else:
+        best = np.argpartition(scores, -k)[-k:]
+    return best[np.argsort(-scores[best])]
+
+def exact_search(matrix, query, k, start=0, chunk_rows=65536):
+    """
+    Brute-force cosine top-k over matrix[start:], streaming the memory map in chunks.
+    """
+    best_rows = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    for offset in range(start, len(matrix), chunk_rows):
+        scores = np.asarray(matrix[offset:offset + chunk_rows]) @ query
+        keep = top_k(scores, k)
+        best_rows = np.concatenate([best_rows, keep + offset])
+        best_scores = np.concatenate([best_scores, scores[keep]])
+        keep = top_k(best_scores, k)
+        best_rows, best_scores = best_rows[keep], best_scores[keep]
+    return best_rows, best_scores
+
+class IVFIndex:
+    """
+    Inverted-file partitioning: rows are grouped under their nearest k-means centroid, and a query only
+    scores the rows of its `nprobe` closest centroids. Covers the first `count` rows of the matrix.
+    """
+    def __init__(self, centroids, order, offsets, count):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.count = count
+
+    @classmethod
+    def build(cls, matrix, nlist=None, iterations=10, sample_per_list=64, seed=0, chunk_rows=65536):
+        count = len(matrix)
+        nlist = min(nlist or max(1, int(math.sqrt(count))), count)
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(matrix[np.sort(rng.choice(count, min(count, nlist * sample_per_list), replace=False))])
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(nlist):
+                members = sample[assignment == i]
+                centroids[i] = members.mean(axis=0) if len(members) else sample[rng.integers(len(sample))]
+            centroids = normalize(centroids)
+        assignment = np.concatenate([
+            np.argmax(np.asarray(matrix[offset:offset + chunk_rows]) @ centroids.T, axis=1)
+            for offset in range(0, count, chunk_rows)
+        ])
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        return cls(centroids, order, offsets, count)
+
+    def search(self, matrix, query, k, nprobe):
+        probes = top_k(self.centroids @ query, nprobe)
+        rows = np.concatenate([self.order[self.offsets[p]:self.offsets[p + 1]] for p in probes])
+        if len(rows) == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        rows.sort()
+        scores = np.asarray(matrix[rows]) @ query
+        keep = top_k(scores, k)
+        return rows[keep], scores[keep]
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, order=self.order, offsets=self.offsets, count=self.count)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["centroids"], data["order"], data["offsets"], int(data["count"]))
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store kept on local disk: normalized float32 embeddings in a memory-mapped matrix file,
+    document text and metadata in a SQLite sidecar keyed by row. Appends go to the end of the matrix;
+    re-adding an id tombstones its old row. Search is exact until the store reaches `ivf_min_vectors`,
+    then an IVF index is built and rebuilt whenever the unindexed tail passes `reindex_fraction` of it.
+    """
+    def __init__(self, path, embeddings, nprobe=16, ivf_min_vectors=50000, reindex_fraction=0.2):
+        super().__init__(embeddings)
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.nprobe = nprobe
+        self.ivf_min_vectors = ivf_min_vectors
+        self.reindex_fraction = reindex_fraction
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.meta_path = os.path.join(path, "meta.json")
+        self.ivf_path = os.path.join(path, "ivf.npz")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, "documents.sqlite"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS documents (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL)")
+        self._db.commit()
+        meta = {"dim": None, "count": 0}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        self.dim = meta["dim"]
+        self.count = meta["count"]
+        self.matrix = self._open_matrix()
+        self.ivf = IVFIndex.load(self.ivf_path) if os.path.exists(self.ivf_path) else None
+
+    def _open_matrix(self):
+        if self.count == 0:
+            return None
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+
+    def _save_meta(self):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "count": self.count}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def __len__(self):
+        return self.count
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        vectors = normalize(embeddings)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}")
+            start = self.count
+            # The meta file is the source of truth: anything past `count` is a torn write and gets overwritten.
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(start * self.dim * 4)
+                f.write(vectors.tobytes())
+            self._db.executemany("DELETE FROM documents WHERE id = ?", [(id,) for id in ids])
+            self._db.executemany(
+                "INSERT INTO documents (row, id, text, metadata) VALUES (?, ?, ?, ?)",
+                [(start + i, id, text, json.dumps(metadata)) for i, (id, text, metadata) in enumerate(zip(ids, texts, metadatas))],
+            )
+            self._db.commit()
+            self.count += len(vectors)
+            self._save_meta()
+            self.matrix = self._open_matrix()
+            if self._needs_index():
+                self.build_index()
+        return ids
+
+    def _needs_index(self):
+        if self.count < self.ivf_min_vectors:
+            return False
+        return self.ivf is None or self.count - self.ivf.count > self.reindex_fraction * self.ivf.count
+
+    def build_index(self, nlist=None):
+        self.ivf = IVFIndex.build(self.matrix, nlist)
+        self.ivf.save(self.ivf_path)
+
+    def search_rows(self, embedding, k=4, exact=False, nprobe=None):
+        """
+        Returns (rows, scores) of the k nearest stored vectors, tombstoned rows included.
+        """
+        matrix, ivf = self.matrix, self.ivf
+        if matrix is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = normalize(embedding)[0]
+        if exact or ivf is None:
+            return exact_search(matrix, query, k)
+        rows, scores = ivf.search(matrix, query, k, nprobe or self.nprobe)
+        if ivf.count < len(matrix):
+            tail_rows, tail_scores = exact_search(matrix, query, k, start=ivf.count)
+            rows, scores = np.concatenate([rows, tail_rows]), np.concatenate([scores, tail_scores])
+            keep = top_k(scores, k)
+            rows, scores = rows[keep], scores[keep]
+        return rows, scores
+
+    def documents(self, rows):
+        """
+        Returns (row, document) pairs in the order of `rows`, skipping tombstoned rows.
+        """
+        rows = [int(row) for row in rows]
+        with self._lock:
+            found = self._db.execute(
+                f"SELECT row, text, metadata FROM documents WHERE row IN ({','.join('?' * len(rows))})", rows
+            ).fetchall()
+        by_row = {row: Document(page_content=text, metadata=json.loads(metadata)) for row, text, metadata in found}
+        return [(row, by_row[row]) for row in rows if row in by_row]
+
+    def search_by_vector(self, embedding, k=4):
+        return [doc for doc, _ in self.search_with_embeddings(embedding, k)]
+
+    def search_with_embeddings(self, embedding, k=4):
+        # Over-fetch a little so rows replaced by a later add do not leave the result short.
+        rows, _ = self.search_rows(embedding, k * 2)
+        found = self.documents(rows)[:k]
+        if not found:
+            return []
+        vectors = np.asarray(self.matrix[[row for row, _ in found]])
+        return [(doc, vector.tolist()) for (_, doc), vector in zip(found, vectors)]
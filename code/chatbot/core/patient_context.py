@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from patients.models import Patient
+
+DEFAULT_PATIENT_EMAIL = os.getenv('DEFAULT_PATIENT_EMAIL', 'john.doe@example.com')
+
+@dataclass(frozen=True)
+class PatientContext:
+    patient_id: int
+    email: str
+    first_name: str
+    last_name: str
+    next_appointment: datetime
+    doctor_name: str
+    context: str
+
+def render_patient_context(patient):
+    return (
+    f"My name is {patient.first_name} {patient.last_name}. "
+    f"I was born on {patient.date_of_birth.strftime('%Y-%m-%d')}. "
+    f"My phone number is {patient.phone_number}. "
+    f"My email address is {patient.email}. "
+    f"My medical condition is {patient.medical_condition}. "
+    f"I am taking {patient.medication_regimen}. "
+    f"My last appointment was on {patient.last_appointment.strftime('%Y-%m-%d %H:%M')}. "
+    f"My next appointment is on {patient.next_appointment.strftime('%Y-%m-%d %H:%M')} "
+    f"with {patient.doctor_name}."
+        )
+
+def build_patient_context(patient):
+    return PatientContext(
+        patient_id=patient.pk,
+        email=patient.email,
+        first_name=patient.first_name,
+        last_name=patient.last_name,
+        next_appointment=patient.next_appointment,
+        doctor_name=patient.doctor_name,
+        context=render_patient_context(patient),
+    )
+
+_MISSING = object()
+
+class PatientContextProvider:
+    """
+    LRU + TTL cache of rendered patient contexts keyed by patient email.
+    Entries are dropped by the Patient post_save/post_delete signal handlers in `chatbot.signals`,
+    so a warm turn does not query the patients table at all. Emails without a patient (staff and admin
+    accounts) are cached too, as None.
+    """
+    def __init__(self, max_entries=256, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, email):
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is not None:
+                expires_at, patient_context = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(email)
+                    self.hits += 1
+                    return patient_context
+                del self._entries[email]
+            self.misses += 1
+            return _MISSING
+
+    def _store(self, email, patient_context):
+        with self._lock:
+            self._entries[email] = (time.monotonic() + self.ttl_seconds, patient_context)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return patient_context
+
+    def get(self, email):
+        """
+        Returns the PatientContext for `email`, or None when no patient has that email.
+        """
+        patient_context = self._lookup(email)
+        if patient_context is _MISSING:
+            patient = Patient.objects.filter(email=email).first()
+            patient_context = self._store(email, build_patient_context(patient) if patient is not None else None)
+        return patient_context
+
+    async def aget(self, email):
+        patient_context = self._lookup(email)
+        if patient_context is _MISSING:
+            patient = await Patient.objects.filter(email=email).afirst()
+            patient_context = self._store(email, build_patient_context(patient) if patient is not None else None)
+        return patient_context
+
+    def invalidate(self, patient):
+        """
+        Drops every entry belonging to `patient`, matched on primary key so an email change is covered too.
+        """
+        with self._lock:
+            stale = [email for email, (_, patient_context) in self._entries.items()
+                     if email == patient.email or (patient_context is not None and patient_context.patient_id == patient.pk)]
+            for email in stale:
+                del self._entries[email]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def patient_email_from_config(config):
+    return config.get("configurable", {}).get("patient_email") or DEFAULT_PATIENT_EMAIL
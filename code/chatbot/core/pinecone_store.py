@@ -2,15 +2,40 @@
 from pinecone import Pinecone
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_pinecone import PineconeVectorStore
-import os
+from langchain_core.documents import Document
+from .vector_store import VectorStore
+import uuid
 
-class PineconeStore:
-    def __init__(self, api_key, index_name):
+class PineconeStore(VectorStore):
+    def __init__(self, api_key, index_name, embeddings=None):
+        super().__init__(embeddings or HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2"))
         self.pc = Pinecone(api_key=api_key)
         self.index_name = index_name
         self.index = self.pc.Index(index_name)
-        self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
         self.vector_store = PineconeVectorStore(index=self.index, embedding=self.embeddings)
 
-    def search(self, query):
-        return self.vector_store.similarity_search(query)
+    def search_by_vector(self, embedding, k=4):
+        docs_and_scores = self.vector_store.similarity_search_by_vector_with_score(embedding, k=k)
+        return [doc for doc, _ in docs_and_scores]
+
+    def search_with_embeddings(self, embedding, k=4):
+        # Same query as PineconeVectorStore, but asking for the stored vectors too.
+        results = self.index.query(vector=embedding, top_k=k, include_metadata=True, include_values=True)
+        pairs = []
+        for match in results["matches"]:
+            metadata = dict(match["metadata"] or {})
+            if self.vector_store._text_key in metadata:
+                text = metadata.pop(self.vector_store._text_key)
+                pairs.append((Document(id=match["id"], page_content=text, metadata=metadata), match["values"]))
+        return pairs
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        # Same layout as PineconeVectorStore.add_texts: the text lives in the "text" metadata field.
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = [
+            (id, list(embedding), {**metadata, self.vector_store._text_key: text})
+            for id, text, embedding, metadata in zip(ids, texts, embeddings, metadatas)
+        ]
+        self.index.upsert(vectors=vectors)
+        return ids
@@ -0,0 +1,54 @@
+import gc
+import os
+import random
+import sys
+import time
+from .services import services
+
+# Built in the master before forking: the embedding model is most of a worker's memory, the compiled graph
+# and the router/tokenizer tables are read-only afterwards. Connections and background threads are not.
+DEFAULT_PRELOAD = ["embeddings", "intent_router", "context_packer", "graph"]
+
+def preload_names():
+    names = os.getenv('PRELOAD_SERVICES')
+    if names is None:
+        return DEFAULT_PRELOAD
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+def set_torch_threads(threads):
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    else:
+        # Picked up if the worker imports torch later.
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+
+def preload(names=None):
+    """
+    Runs in the master process. Builds the shared services, then freezes everything allocated so far out
+    of the garbage collector, so workers do not copy those pages just by scanning them.
+    Returns the load time of each service in seconds.
+    """
+    from django.db import connections
+    timings = {}
+    for name in names if names is not None else preload_names():
+        started = time.perf_counter()
+        instance = services.get(name)
+        if name == "embeddings":
+            # Torch must not start its thread pool before the fork, or workers can deadlock in it.
+            set_torch_threads(1)
+            # The model weights load lazily on the first forward pass.
+            instance.embed_query("warmup")
+        timings[name] = time.perf_counter() - started
+    # Anything that opened a database connection while loading must not hand it to every worker.
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
+    return timings
+
+def after_fork(torch_threads=None):
+    """
+    Runs first thing in every worker.
+    """
+    services.after_fork()
+    random.seed()
+    set_torch_threads(torch_threads or int(os.getenv('TORCH_THREADS', 1)))
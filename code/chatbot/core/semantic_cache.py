@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def document_set_key(docs):
+    """
+    Fingerprint of a retrieved document set. Cached answers are only reused for the same set,
+    so they go stale on their own when the corpus behind the index changes.
+    """
+    fingerprints = sorted(
+        doc.id or hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+        for doc in docs
+    )
+    return hashlib.sha1("\n".join(fingerprints).encode("utf-8")).hexdigest()
+
+def normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class SemanticResponseCache:
+    """
+    Answers for near-identical questions, matched on cosine similarity of the question embedding.
+    Entries are grouped by retrieved-document set and evicted LRU first, or when their TTL runs out.
+    Answers are added by `fill_later`, which generates them on a background thread, at most
+    `max_pending_fills` at a time.
+    """
+    def __init__(self, threshold=0.92, max_entries=1024, ttl_seconds=3600, max_pending_fills=32):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_pending_fills = max_pending_fills
+        self._fill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-cache")
+        self._pending_fills = 0
+        # doc set key -> OrderedDict(entry id -> (expires_at, embedding, response))
+        self._groups = {}
+        # entry id -> doc set key, in LRU order across all groups
+        self._lru = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fills_submitted = 0
+        self.fills = 0
+        self.fill_failures = 0
+        self.fills_dropped = 0
+
+    def _drop(self, entry_id):
+        doc_key = self._lru.pop(entry_id)
+        group = self._groups[doc_key]
+        del group[entry_id]
+        if not group:
+            del self._groups[doc_key]
+
+    def lookup(self, embedding, doc_key):
+        """
+        Returns the cached answer closest to `embedding` for this document set, or None
+        when nothing is above the similarity threshold.
+        """
+        with self._lock:
+            response = self._closest(normalize(embedding), doc_key)
+            if response is not None:
+                self.hits += 1
+                return response
+            self.misses += 1
+            return None
+
+    def _closest(self, query, doc_key):
+        group = self._groups.get(doc_key, {})
+        now = time.monotonic()
+        for entry_id in [entry_id for entry_id, (expires_at, _, _) in group.items() if expires_at <= now]:
+            self._drop(entry_id)
+        group = self._groups.get(doc_key)
+        if group:
+            entry_ids = list(group)
+            similarities = np.stack([group[entry_id][1] for entry_id in entry_ids]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                self._lru.move_to_end(entry_ids[best])
+                return group[entry_ids[best]][2]
+        return None
+
+    def store(self, embedding, doc_key, response):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._groups.setdefault(doc_key, OrderedDict())[entry_id] = (
+                time.monotonic() + self.ttl_seconds, normalize(embedding), response)
+            self._lru[entry_id] = doc_key
+            while len(self._lru) > self.max_entries:
+                self._drop(next(iter(self._lru)))
+
+    def fill_later(self, embedding, doc_key, generate):
+        """
+        Stores the answer `generate()` returns, generated on the cache's thread so the turn does not wait for it.
+        Returns False when too many fills are already waiting.
+        """
+        with self._lock:
+            if self._pending_fills >= self.max_pending_fills:
+                self.fills_dropped += 1
+                return False
+            self._pending_fills += 1
+            self.fills_submitted += 1
+        self._fill_executor.submit(self._fill, embedding, doc_key, generate)
+        return True
+
+    def _fill(self, embedding, doc_key, generate):
+        try:
+            with self._lock:
+                # A near-identical question that missed at the same time may have filled it already.
+                cached = self._closest(normalize(embedding), doc_key) is not None
+            if not cached:
+                self.store(embedding, doc_key, generate())
+            self.fills += 1
+        except Exception:
+            self.fill_failures += 1
+            logger.exception("Generating a shared answer for the semantic cache failed")
+        finally:
+            with self._lock:
+                self._pending_fills -= 1
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
+            self._lru.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "pending_fills": self._pending_fills,
+            "fills_submitted": self.fills_submitted,
+            "fills": self.fills,
+            "fill_failures": self.fill_failures,
+            "fills_dropped": self.fills_dropped,
+        }
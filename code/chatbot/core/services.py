@@ -0,0 +1,260 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class ServiceRegistry:
+    """
+    Lazily constructs the heavy backends (LLM clients, Neo4j driver, vector store, compiled graph).
+    Nothing is built at import time; a service is created on first `get` and reused afterwards.
+    """
+    def __init__(self):
+        self._factories = {}
+        self._fork_safe = set()
+        self._instances = {}
+        self._lock = threading.RLock()
+        self.timings = {}
+
+    def register(self, name, factory, fork_safe=False):
+        """
+        `fork_safe` services hold no sockets, threads or open transactions, so an instance built in a
+        preforking server's master can be inherited by the workers.
+        """
+        self._factories[name] = factory
+        if fork_safe:
+            self._fork_safe.add(name)
+
+    def names(self):
+        return list(self._factories)
+
+    def is_loaded(self, name):
+        return name in self._instances
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError(f"Unknown service: {name}")
+                started = time.perf_counter()
+                self._instances[name] = self._factories[name]()
+                self.timings[name] = time.perf_counter() - started
+            return self._instances[name]
+
+    def warmup(self, names=None):
+        """
+        Builds the given services (all of them by default) and returns their construction time in seconds.
+        """
+        for name in names or self.names():
+            self.get(name)
+        return {name: self.timings[name] for name in names or self.names() if name in self.timings}
+
+    def after_fork(self):
+        """
+        Runs in a freshly forked worker: keeps the fork-safe instances the master preloaded (their memory
+        stays shared copy-on-write) and forgets the rest, which the worker builds again on first use.
+        """
+        self._lock = threading.RLock()
+        for name in list(self._instances):
+            if name not in self._fork_safe:
+                del self._instances[name]
+            elif callable(getattr(self._instances[name], "after_fork", None)):
+                self._instances[name].after_fork()
+
+    def stats(self):
+        """
+        Runtime counters of the loaded services that expose them (pool usage, queue depth, cache hit rates).
+        """
+        return {name: instance.stats() for name, instance in list(self._instances.items()) if callable(getattr(instance, "stats", None))}
+
+
+def _create_llm():
+    from .llm_adapters.llm_manager import LLMManager
+    return LLMManager()
+
+def _create_kg():
+    from .knowledge_graph import KnowledgeGraph
+    kg = KnowledgeGraph(os.getenv('NEO4J_URI'), os.getenv('NEO4J_USER'), os.getenv('NEO4J_PASSWORD'))
+    # One pooled driver for the whole process, closed only when the process exits.
+    atexit.register(kg.shutdown)
+    return kg
+
+def _create_embeddings():
+    from .embedding_cache import CachedEmbeddings
+    socket_path = os.getenv('EMBEDDING_SERVER_SOCKET')
+    if socket_path:
+        # The model lives in the embedding_server process; workers never import torch.
+        from .embedding_server import EmbeddingClient
+        embeddings = EmbeddingClient(socket_path)
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    max_entries = int(os.getenv('EMBEDDING_CACHE_SIZE', 4096))
+    if max_entries <= 0:
+        return embeddings
+    return CachedEmbeddings(
+        embeddings,
+        max_entries=max_entries,
+        path=os.getenv('EMBEDDING_CACHE_PATH', 'data/embedding_cache') or None,
+        dtype=os.getenv('EMBEDDING_CACHE_DTYPE', 'float16'),
+    )
+
+def _create_vector_store():
+    # VECTOR_STORE=local serves retrieval from a memory-mapped store on disk instead of Pinecone.
+    if os.getenv('VECTOR_STORE', 'pinecone') == 'local':
+        from .local_vector_store import LocalVectorStore
+        return LocalVectorStore(
+            os.getenv('LOCAL_VECTOR_STORE_PATH', 'data/vector_store'),
+            embeddings=get_embeddings(),
+            nprobe=int(os.getenv('LOCAL_VECTOR_STORE_NPROBE', 16)),
+            ivf_min_vectors=int(os.getenv('LOCAL_VECTOR_STORE_IVF_MIN', 50000)),
+        )
+    from .pinecone_store import PineconeStore
+    return PineconeStore(api_key=os.getenv('PINECONE_API_KEY'), index_name="healthmate", embeddings=get_embeddings())
+
+def _create_semantic_cache():
+    from .semantic_cache import SemanticResponseCache
+    return SemanticResponseCache(
+        threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92)),
+        max_entries=int(os.getenv('SEMANTIC_CACHE_SIZE', 1024)),
+        ttl_seconds=float(os.getenv('SEMANTIC_CACHE_TTL', 3600)),
+        max_pending_fills=int(os.getenv('SEMANTIC_CACHE_PENDING_FILLS', 32)),
+    )
+
+def _create_context_packer():
+    from .context_packing import ContextPacker
+    return ContextPacker(
+        token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500)),
+        fetch_k=int(os.getenv('CONTEXT_FETCH_K', 12)),
+        mmr_lambda=float(os.getenv('CONTEXT_MMR_LAMBDA', 0.7)),
+        model_name=os.getenv('MODEL_NAME'),
+    )
+
+def _create_intent_router():
+    """
+    The local router, or None (every message goes to the LLM orchestrator) until `manage.py train_intent_router`
+    has saved a model whose held-out local routes are at least INTENT_ROUTER_MIN_ACCURACY accurate.
+    """
+    from .intent_router import IntentRouter
+    path = os.getenv('INTENT_ROUTER_PATH', 'models/intent_router.npz')
+    if not os.path.exists(path):
+        return None
+    router = IntentRouter.load(path, threshold=float(os.getenv('INTENT_ROUTER_THRESHOLD', 0.85)))
+    if not router.trusted(float(os.getenv('INTENT_ROUTER_MIN_ACCURACY', 0.95)), int(os.getenv('INTENT_ROUTER_MIN_EVAL_EXAMPLES', 100))):
+        logger.warning("Intent router at %s is not evaluated as accurate enough, routing with the LLM only: %s", path, router.evaluation)
+        return None
+    return router
+
+def _create_extraction_worker():
+    from .extraction_worker import KnowledgeExtractionWorker
+    from .healthmate_graph import extract_knowledge
+    return KnowledgeExtractionWorker(
+        extract_knowledge,
+        workers=int(os.getenv('KNOWLEDGE_EXTRACTION_WORKERS', 2)),
+        max_queue=int(os.getenv('KNOWLEDGE_EXTRACTION_QUEUE_SIZE', 100)),
+        max_retries=int(os.getenv('KNOWLEDGE_EXTRACTION_RETRIES', 3)),
+    )
+
+def _create_summarizer():
+    from .conversation_summary import ConversationSummarizer, DatabaseSummaryStore, MemorySummaryStore
+    from .healthmate_graph import summarize_conversation
+    # The next turn may run in another worker, so finished summaries are kept where the checkpoints are.
+    ttl = float(os.getenv('SUMMARY_PENDING_TTL', 600))
+    store = MemorySummaryStore(ttl) if os.getenv('GRAPH_CHECKPOINTER', 'database') == 'memory' else DatabaseSummaryStore(ttl)
+    return ConversationSummarizer(
+        summarize_conversation,
+        store=store,
+        trigger_messages=int(os.getenv('SUMMARY_TRIGGER_MESSAGES', 14)),
+        keep_last=int(os.getenv('SUMMARY_KEEP_LAST', 2)),
+    )
+
+def _create_turn_logger():
+    from .turn_log import TurnLogger
+    from ..history import store_turns
+    return TurnLogger(
+        store_turns,
+        max_batch=int(os.getenv('TURN_LOG_BATCH_SIZE', 50)),
+        flush_interval=float(os.getenv('TURN_LOG_FLUSH_SECONDS', 1.0)),
+        spool_path=os.getenv('TURN_LOG_SPOOL_PATH', 'data/turn_log_spool.jsonl') or None,
+    )
+
+def _create_patient_contexts():
+    from .patient_context import PatientContextProvider
+    return PatientContextProvider(
+        max_entries=int(os.getenv('PATIENT_CONTEXT_CACHE_SIZE', 256)),
+        ttl_seconds=float(os.getenv('PATIENT_CONTEXT_TTL', 300)),
+    )
+
+def _create_checkpointer():
+    if os.getenv('GRAPH_CHECKPOINTER', 'database') == 'memory':
+        from langgraph.checkpoint.memory import MemorySaver
+        return MemorySaver()
+    from .checkpointer import DjangoCheckpointSaver
+    return DjangoCheckpointSaver(
+        keep_latest=int(os.getenv('CHECKPOINT_KEEP_LATEST', 10)),
+        compress_min_bytes=int(os.getenv('CHECKPOINT_COMPRESS_MIN_BYTES', 1024)),
+    )
+
+def _create_graph():
+    from .healthmate_graph import compile_graph
+    return compile_graph()
+
+
+services = ServiceRegistry()
+services.register("llm", _create_llm)
+services.register("kg", _create_kg)
+services.register("embeddings", _create_embeddings, fork_safe=True)
+services.register("vector_store", _create_vector_store)
+services.register("semantic_cache", _create_semantic_cache)
+services.register("context_packer", _create_context_packer, fork_safe=True)
+services.register("intent_router", _create_intent_router, fork_safe=True)
+services.register("extraction_worker", _create_extraction_worker)
+services.register("summarizer", _create_summarizer)
+services.register("turn_logger", _create_turn_logger)
+services.register("patient_contexts", _create_patient_contexts)
+services.register("checkpointer", _create_checkpointer, fork_safe=True)
+services.register("graph", _create_graph, fork_safe=True)
+
+def get_llm():
+    return services.get("llm")
+
+def get_kg():
+    return services.get("kg")
+
+def get_embeddings():
+    return services.get("embeddings")
+
+def get_vector_store():
+    return services.get("vector_store")
+
+def get_semantic_cache():
+    return services.get("semantic_cache")
+
+def get_context_packer():
+    return services.get("context_packer")
+
+def get_intent_router():
+    return services.get("intent_router")
+
+def get_extraction_worker():
+    return services.get("extraction_worker")
+
+def get_summarizer():
+    return services.get("summarizer")
+
+def get_turn_logger():
+    return services.get("turn_logger")
+
+def get_patient_contexts():
+    return services.get("patient_contexts")
+
+def get_checkpointer():
+    return services.get("checkpointer")
+
+def get_graph():
+    return services.get("graph")
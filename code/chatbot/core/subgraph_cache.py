@@ -0,0 +1,270 @@
+import threading
+import time
+from collections import OrderedDict
+import networkx as nx
+from .cypher_templates import UserVocabulary
+
+# Rough per-item footprint of a networkx MultiDiGraph (adjacency dicts + attribute dicts), used for the memory cap.
+NODE_BYTES = 600
+EDGE_BYTES = 500
+# Trails grow exponentially on densely linked graphs; past this many path steps a query goes to Neo4j instead.
+MAX_QUERY_STEPS = 20000
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+class Path:
+    """
+    Quacks like a neo4j Path as far as `process_path` is concerned.
+    """
+    def __init__(self, nodes, relationships):
+        self.nodes = nodes
+        self.relationships = relationships
+
+def node_key(name, entity_type):
+    return (name, entity_type)
+
+def node_dict(node):
+    return {"name": node[0], "type": node[1]}
+
+def build_subgraph(rows):
+    """
+    Builds a graph from (name, type, edges) rows, edges being (relationship type, target name, target type).
+    """
+    graph = nx.MultiDiGraph()
+    add_rows(graph, rows)
+    return graph
+
+def add_rows(graph, rows):
+    for name, entity_type, edges in rows:
+        graph.add_node(node_key(name, entity_type))
+        for relationship_type, target_name, target_type in edges:
+            if relationship_type is None:
+                continue
+            graph.add_edge(node_key(name, entity_type), node_key(target_name, target_type), key=relationship_type)
+
+def estimate_bytes(graph):
+    text = sum(len(name or "") + len(entity_type or "") for name, entity_type in graph.nodes)
+    return graph.number_of_nodes() * NODE_BYTES + graph.number_of_edges() * EDGE_BYTES + text
+
+def walk_paths(graph, start, budget=None):
+    """
+    Yields every path of length >= 1 from `start` without repeating a relationship, like Cypher's -[*]->.
+    `budget` is a one-item list of steps left, shared between walks; QueryBudgetExceeded is raised at 0.
+    """
+    nodes = [start]
+    relationships = []
+    used = set()
+
+    def extend(node):
+        for _, target, key in graph.out_edges(node, keys=True):
+            edge = (node, target, key)
+            if edge in used:
+                continue
+            if budget is not None:
+                budget[0] -= 1
+                if budget[0] < 0:
+                    raise QueryBudgetExceeded
+            used.add(edge)
+            nodes.append(target)
+            relationships.append(key)
+            yield Path([node_dict(n) for n in nodes], [{"type": r} for r in relationships])
+            yield from extend(target)
+            nodes.pop()
+            relationships.pop()
+            used.discard(edge)
+
+    yield from extend(start)
+
+def template_filter(template, params):
+    """
+    Local equivalent of the WHERE clause of each Cypher template.
+    """
+    if template == "entities":
+        types = set(params.get("types") or [])
+        names = set(params.get("names") or [])
+        return lambda path: path.nodes[-1]["type"] in types or (path.nodes[-1]["name"] or "").lower() in names
+    if template == "relationships":
+        relationships = set(params.get("relationships") or [])
+        return lambda path: any((r["type"] or "").lower() in relationships for r in path.relationships)
+    if template == "overview":
+        return lambda path: True
+    return None
+
+class UserSubgraph:
+    """
+    Immutable snapshot of everything reachable from one user node. Writes build a new snapshot, which keeps
+    the load time of the original: it only adds this process's writes, not those of other workers.
+    """
+    def __init__(self, user_name, graph, loaded_at=None):
+        self.user_name = user_name
+        self.graph = graph
+        self.loaded_at = loaded_at if loaded_at is not None else time.monotonic()
+        self.user = node_key(user_name, "Person")
+        # Keep the user node even before any facts exist, so the first write-through can attach to it.
+        self.graph.add_node(self.user)
+        self.size = estimate_bytes(graph)
+
+    def direct_facts(self):
+        return [(target, key) for _, target, key in self.graph.out_edges(self.user, keys=True)]
+
+    def vocabulary(self):
+        return UserVocabulary.from_records((target[0], target[1], key) for target, key in self.direct_facts())
+
+    def entities_and_relationships(self):
+        # Same as FETCH_USER_ENTITIES_QUERY: one entry per distinct (entity type, relationship type) pair.
+        entities = []
+        relationships = []
+        for entity_type, relationship_type in dict.fromkeys((target[1], key) for target, key in self.direct_facts()):
+            if entity_type:
+                entities.append(entity_type)
+            if relationship_type:
+                relationships.append(relationship_type)
+        return entities, relationships
+
+    def query(self, template, params, max_steps=MAX_QUERY_STEPS):
+        """
+        Rows of (path1, path2) for a template, as the template's Cypher would return them. Paths are walked
+        lazily, so LIMIT stops the walk; QueryBudgetExceeded is raised after `max_steps` path steps.
+        """
+        keep = template_filter(template, params)
+        limit = params.get("limit")
+        budget = [max_steps]
+        rows = []
+        for path1 in walk_paths(self.graph, self.user, budget):
+            if not keep(path1):
+                continue
+            target = node_key(path1.nodes[-1]["name"], path1.nodes[-1]["type"])
+            continued = False
+            for path2 in walk_paths(self.graph, target, budget):
+                continued = True
+                rows.append({"path1": path1, "path2": path2})
+                if limit is not None and len(rows) >= limit:
+                    return rows
+            if not continued:
+                rows.append({"path1": path1, "path2": None})
+                if limit is not None and len(rows) >= limit:
+                    return rows
+        return rows
+
+    def with_write(self, relationships, descendants):
+        """
+        Returns a new snapshot with the written relationships applied, or None if none of them touch this user.
+        `descendants` is the graph below every written relationship target, loaded after the write committed.
+        """
+        nodes_by_name = {}
+        for node in self.graph.nodes:
+            nodes_by_name.setdefault(node[0], []).append(node)
+        targets_by_name = {}
+        for node in descendants.nodes:
+            targets_by_name.setdefault(node[0], []).append(node)
+
+        new_edges = []
+        for rel in relationships:
+            for source in nodes_by_name.get(rel['from'], []):
+                for target in targets_by_name.get(rel['to'], []):
+                    new_edges.append((source, target, rel['relationship']))
+        if not new_edges:
+            return None
+        graph = self.graph.copy()
+        for source, target, key in new_edges:
+            graph.add_edge(source, target, key=key)
+            below = nx.descendants(descendants, target) | {target}
+            graph.add_edges_from(descendants.subgraph(below).edges(keys=True))
+        return UserSubgraph(self.user_name, graph, self.loaded_at)
+
+class SubgraphCache:
+    """
+    Per-user subgraphs kept in memory, evicted least recently used once their estimated size passes `max_bytes`.
+    Write-through only reaches the process that wrote, so a subgraph is reloaded from Neo4j once it is
+    `ttl_seconds` old; that bounds how long other workers miss facts extracted elsewhere.
+    """
+    def __init__(self, max_bytes, ttl_seconds=30):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._subgraphs = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, user_name):
+        with self._lock:
+            subgraph = self._subgraphs.get(user_name)
+            if subgraph is not None and time.monotonic() - subgraph.loaded_at >= self.ttl_seconds:
+                self._subgraphs.pop(user_name)
+                self.bytes -= subgraph.size
+                self.expired += 1
+                subgraph = None
+            if subgraph is None:
+                self.misses += 1
+                return None
+            self._subgraphs.move_to_end(user_name)
+            self.hits += 1
+            return subgraph
+
+    def put(self, subgraph, generation):
+        """
+        Caches a freshly loaded subgraph unless a write landed while it was being loaded.
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._replace(subgraph)
+
+    def _replace(self, subgraph):
+        previous = self._subgraphs.pop(subgraph.user_name, None)
+        if previous is not None:
+            self.bytes -= previous.size
+        self._subgraphs[subgraph.user_name] = subgraph
+        self.bytes += subgraph.size
+        while self.bytes > self.max_bytes and len(self._subgraphs) > 1:
+            _, evicted = self._subgraphs.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+
+    def write_targets(self, relationships):
+        """
+        Marks a write and returns the relationship targets whose subgraph the cached users now need.
+        """
+        with self._lock:
+            self.generation += 1
+            cached = list(self._subgraphs.values())
+        names = set()
+        for subgraph in cached:
+            sources = {node[0] for node in subgraph.graph.nodes}
+            names.update(rel['to'] for rel in relationships if rel['from'] in sources)
+        return sorted(names)
+
+    def apply_write(self, relationships, rows):
+        descendants = build_subgraph(rows)
+        with self._lock:
+            for subgraph in list(self._subgraphs.values()):
+                updated = subgraph.with_write(relationships, descendants)
+                if updated is not None:
+                    self._replace(updated)
+
+    def invalidate(self, user_name=None):
+        with self._lock:
+            self.generation += 1
+            if user_name is None:
+                self._subgraphs.clear()
+                self.bytes = 0
+            else:
+                subgraph = self._subgraphs.pop(user_name, None)
+                if subgraph is not None:
+                    self.bytes -= subgraph.size
+
+    def stats(self):
+        return {
+            "users": len(self._subgraphs),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
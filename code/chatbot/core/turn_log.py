@@ -0,0 +1,242 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process spools, as before
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class TurnLogger:
+    """
+    Write-behind log of chat turns. `log` only appends to an in-memory buffer; a background thread hands
+    the buffer to `write` (one bulk insert) once `max_batch` turns are waiting or every `flush_interval`
+    seconds. Batches that cannot be written, and whatever is left when the process exits and the database
+    is unreachable, are appended to the JSON-lines file at `spool_path` and written on the next successful
+    flush (by this or any other process). Without a spool file failed batches are kept in memory, up to
+    `max_pending` turns.
+    """
+    def __init__(self, write, max_batch=50, flush_interval=1.0, spool_path=None, max_pending=10000):
+        self.write = write
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self.max_pending = max_pending
+        self._buffer = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._spool_dirty = bool(spool_path and os.path.exists(spool_path))
+        self.logged = 0
+        self.written = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.corrupt = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="turn-log", daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def log(self, turn):
+        """
+        Queues one turn (keyword arguments of a ConversationHistory row). Never touches the database.
+        """
+        self._ensure_started()
+        with self._condition:
+            self._buffer.append(turn)
+            self.logged += 1
+            if len(self._buffer) >= self.max_batch:
+                self._condition.notify()
+
+    def pending(self):
+        return len(self._buffer)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopping and len(self._buffer) < self.max_batch:
+                    self._condition.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            self.flush()
+
+    def flush(self):
+        """
+        Writes everything buffered so far, then anything spooled. Returns the number of turns written.
+        """
+        with self._flush_lock:
+            with self._condition:
+                batch, self._buffer = self._buffer, []
+            written = 0
+            for start in range(0, len(batch), self.max_batch):
+                chunk = batch[start:start + self.max_batch]
+                if not self._write(chunk):
+                    self._keep(batch[start:])
+                    return written
+                written += len(chunk)
+            if self._spool_dirty:
+                written += self._replay_spool()
+            return written
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            self.write(batch)
+        except Exception:
+            self.failed_batches += 1
+            logger.exception("Writing %d chat turns failed", len(batch))
+            return False
+        elapsed = time.perf_counter() - started
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.batches += 1
+        self.written += len(batch)
+        return True
+
+    def _keep(self, turns, replayed=False):
+        if self.spool_path:
+            try:
+                self._spool(turns, replayed)
+                return
+            except OSError:
+                logger.exception("Spooling %d chat turns to %s failed", len(turns), self.spool_path)
+        with self._condition:
+            self._buffer[:0] = turns
+            overflow = len(self._buffer) - self.max_pending
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+                logger.error("Dropped %d unwritten chat turns", overflow)
+
+    def _spool(self, turns, replayed=False):
+        os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+        with open(self.spool_path, "ab+") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # After a crash mid-append the last line is cut short; start on a new one so only that line is lost.
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            for turn in turns:
+                f.write((json.dumps(turn, default=str) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        if not replayed:
+            self.spooled += len(turns)
+        self._spool_dirty = True
+
+    def _replay_spool(self):
+        # Claim the file first so other processes spooling meanwhile start a new one.
+        claimed = f"{self.spool_path}.{os.getpid()}.replay"
+        self._spool_dirty = False
+        try:
+            os.replace(self.spool_path, claimed)
+        except FileNotFoundError:
+            return 0
+        try:
+            turns = self._read_spool(claimed)
+        except OSError:
+            # Put the claimed file back rather than lose it; the next flush tries again.
+            logger.exception("Reading spooled chat turns from %s failed", claimed)
+            self._requeue_spool(claimed)
+            return 0
+        written = 0
+        for start in range(0, len(turns), self.max_batch):
+            chunk = turns[start:start + self.max_batch]
+            if not self._write(chunk):
+                self._keep(turns[start:], replayed=True)
+                break
+            written += len(chunk)
+        os.unlink(claimed)
+        self.replayed += written
+        return written
+
+    def _read_spool(self, path):
+        """
+        Spooled turns, skipping lines that are not valid JSON (e.g. cut short by a crash mid-append).
+        Skipped lines are copied to `<spool_path>.bad` so they can be inspected.
+        """
+        turns = []
+        bad = []
+        with open(path, encoding="utf-8", errors="replace") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # Waits for a writer that opened it before the rename.
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    turns.append(json.loads(line))
+                except ValueError:
+                    logger.warning("Skipping unreadable line %d of spooled chat turns in %s", number, path)
+                    bad.append(line if line.endswith("\n") else line + "\n")
+        if bad:
+            self.corrupt += len(bad)
+            try:
+                with open(f"{self.spool_path}.bad", "a", encoding="utf-8") as f:
+                    f.writelines(bad)
+            except OSError:
+                logger.exception("Could not keep %d unreadable spooled chat turns", len(bad))
+        return turns
+
+    def _requeue_spool(self, claimed):
+        try:
+            with open(claimed, "rb") as source, open(self.spool_path, "ab") as spool:
+                if fcntl is not None:
+                    fcntl.flock(spool, fcntl.LOCK_EX)
+                spool.write(source.read())
+                spool.flush()
+                os.fsync(spool.fileno())
+            os.unlink(claimed)
+        except OSError:
+            logger.exception("Could not put %s back into the spool; replay it by moving it to %s", claimed, self.spool_path)
+        self._spool_dirty = True
+
+    def stats(self):
+        return {
+            "pending": self.pending(),
+            "logged": self.logged,
+            "written": self.written,
+            "batches": self.batches,
+            "avg_batch": self.written / self.batches if self.batches else 0.0,
+            "failed_batches": self.failed_batches,
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "dropped": self.dropped,
+            "corrupt": self.corrupt,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+
+    def shutdown(self, timeout=10.0):
+        """
+        Stops the flush thread and writes what is still buffered, spooling it if the write fails.
+        """
+        with self._condition:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+            self._condition.notify()
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+        if self._buffer:
+            logger.error("Exiting with %d chat turns that could not be written", len(self._buffer))
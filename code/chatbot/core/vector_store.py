@@ -0,0 +1,60 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional
+import asyncio
+from langchain_core.documents import Document
+from .embedding_utils import aembed_query
+
+class VectorStore(ABC):
+    """
+    Abstract Base Class for the document stores the assistant retrieves from.
+    Backends (Pinecone, the local memory-mapped store) only implement vector search and appends;
+    query embedding and the async wrappers are shared.
+    """
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    @abstractmethod
+    def search_by_vector(self, embedding: List[float], k: int = 4) -> List[Document]:
+        """
+        Returns the k documents closest to the embedding, best first.
+        """
+        pass
+
+    @abstractmethod
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None):
+        """
+        Appends already embedded texts to the store.
+        """
+        pass
+
+    def search_with_embeddings(self, embedding: List[float], k: int = 4):
+        """
+        Returns (document, embedding) pairs, best first, for local re-ranking. Backends that can
+        return stored vectors override this; the fallback re-embeds the documents.
+        """
+        docs = self.search_by_vector(embedding, k)
+        return list(zip(docs, self.embeddings.embed_documents([doc.page_content for doc in docs])))
+
+    def add_texts(self, texts: List[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None):
+        return self.add_embeddings(texts, self.embeddings.embed_documents(texts), metadatas, ids)
+
+    def embed_query(self, query):
+        return self.embeddings.embed_query(query)
+
+    def search(self, query, k=4):
+        return self.search_by_vector(self.embed_query(query), k)
+
+    async def aembed_query(self, query):
+        return await aembed_query(self.embeddings, query)
+
+    async def asearch_by_vector(self, embedding, k=4):
+        # Remote backends block on the network and the local one on numpy, either way keep it off the event loop.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.search_by_vector, embedding, k)
+
+    async def asearch_with_embeddings(self, embedding, k=4):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.search_with_embeddings, embedding, k)
+
+    async def asearch(self, query, k=4):
+        return await self.asearch_by_vector(await self.aembed_query(query), k)
@@ -0,0 +1,72 @@
+import datetime
+import os
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Q
+from .models import ConversationHistory
+
+HISTORY_DATES_CACHE_SECONDS = int(os.getenv('HISTORY_DATES_CACHE_SECONDS', 300))
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = 200
+
+def dates_cache_key(session_id):
+    return f"history_dates:{session_id}"
+
+async def cached_history_dates(session_id):
+    """
+    Dates the session has conversation history for, oldest first. Cached per session until the next turn is
+    stored (see invalidate_history_dates).
+    """
+    if not session_id:
+        return []
+    key = dates_cache_key(session_id)
+    dates = await cache.aget(key)
+    if dates is None:
+        rows = ConversationHistory.objects.filter(session_id=session_id).values_list('date', flat=True).distinct().order_by('date')
+        dates = [date async for date in rows]
+        await cache.aset(key, dates, HISTORY_DATES_CACHE_SECONDS)
+    return dates
+
+def invalidate_history_dates(session_id):
+    cache.delete(dates_cache_key(session_id))
+
+def store_turns(turns):
+    """
+    Inserts a batch of turns from the turn logger in one statement. bulk_create sends no post_save, so the
+    cached date lists of the sessions involved are dropped here.
+    """
+    # The logger's thread lives as long as the process; do not keep using a connection the database dropped.
+    close_old_connections()
+    ConversationHistory.objects.bulk_create([ConversationHistory(**turn) for turn in turns])
+    for session_id in {turn['session_id'] for turn in turns}:
+        invalidate_history_dates(session_id)
+
+def encode_cursor(row):
+    return f"{row['timestamp'].isoformat()}|{row['id']}"
+
+def decode_cursor(cursor):
+    """
+    Returns the (timestamp, id) of the last turn of the previous page; raises ValueError for a malformed cursor.
+    """
+    timestamp, _, row_id = cursor.rpartition("|")
+    return datetime.datetime.fromisoformat(timestamp), int(row_id)
+
+async def conversation_page(session_id, date, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    One page of the session's turns on `date` in the order they happened, continuing after `cursor`.
+    Keyset pagination on (timestamp, id), served by the (session_id, date, timestamp, id) index, so a page
+    costs the same however far into the day it is. Returns (messages, next_cursor); next_cursor is None on
+    the last page.
+    """
+    limit = min(max(1, limit), MAX_PAGE_SIZE)
+    turns = ConversationHistory.objects.filter(session_id=session_id, date=date)
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        turns = turns.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=row_id))
+    rows = [row async for row in turns.order_by('timestamp', 'id').values('id', 'timestamp', 'user_message', 'bot_response')[:limit + 1]]
+    messages = []
+    for row in rows[:limit]:
+        messages.append({'sender': 'user', 'message': row['user_message']})
+        messages.append({'sender': 'bot', 'message': row['bot_response']})
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return messages, next_cursor
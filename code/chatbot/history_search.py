@@ -0,0 +1,51 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import BooleanField, ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Coalesce
+from .models import SEARCH_CONFIG
+
+# (sender, text column, search vector column) of the two sides of a turn.
+SIDES = [("user", "user_message", "user_search"), ("bot", "bot_response", "bot_search")]
+MAX_PAGE_SIZE = 100
+
+def side_match(column, vector, keyword, query, case_sensitive):
+    """
+    A message matches when it contains the keyword or, for case-insensitive searches, when full-text search
+    finds it (so "headaches" also finds "headache"). Substring matches go through the trigram index on
+    UPPER(column); the case-sensitive check is a recheck on the rows that index returns.
+    """
+    substring = Q(**{f"{column}__icontains": keyword})
+    if case_sensitive:
+        return substring & Q(**{f"{column}__contains": keyword})
+    return substring | Q(**{vector: query})
+
+def search_history(queryset, keyword, case_sensitive=False, filter_user=False, filter_bot=False, page=1, page_size=20):
+    """
+    Ranked, paginated search over ConversationHistory rows. Returns (matches, has_next), where matches
+    lists each matching message of the page's turns as {date, sender, message, keyword, rank}.
+    """
+    sides = [side for side in SIDES if not (filter_user and side[0] != "user") and not (filter_bot and side[0] != "bot")]
+    keyword = keyword.strip()
+    if not keyword or not sides:
+        return [], False
+    page = max(1, page)
+    page_size = min(max(1, page_size), MAX_PAGE_SIZE)
+    query = SearchQuery(keyword, search_type="websearch", config=SEARCH_CONFIG)
+    matches = {sender: side_match(column, vector, keyword, query, case_sensitive) for sender, column, vector in sides}
+    rank = sum((SearchRank(F(vector), query) for _, _, vector in sides), Value(0.0))
+    rows = (
+        queryset.filter(Q.create(list(matches.values()), connector=Q.OR))
+        .annotate(rank=Coalesce(rank, Value(0.0)), **{
+            f"{sender}_hit": ExpressionWrapper(match, output_field=BooleanField()) for sender, match in matches.items()
+        })
+        .order_by("-rank", "-timestamp", "-id")
+        .values("date", "user_message", "bot_response", "rank", *[f"{sender}_hit" for sender in matches])
+    )
+    offset = (page - 1) * page_size
+    rows = list(rows[offset:offset + page_size + 1])
+    has_next = len(rows) > page_size
+    results = []
+    for row in rows[:page_size]:
+        for sender, column, _ in sides:
+            if row[f"{sender}_hit"]:
+                results.append({"date": str(row["date"]), "sender": sender, "message": row[column], "keyword": keyword, "rank": row["rank"]})
+    return results, has_next
@@ -0,0 +1,25 @@
+import asyncio
+import os
+from django.core.management.base import BaseCommand
+from chatbot.core.embedding_server import EmbeddingServer
+
+
+class Command(BaseCommand):
+    help = ("Loads the sentence-transformers model once and serves embeddings to every worker on this machine "
+            "over a Unix socket, batching concurrent requests. Point the workers at it with EMBEDDING_SERVER_SOCKET.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=os.getenv('EMBEDDING_SERVER_SOCKET') or '/tmp/healthmate-embeddings.sock')
+        parser.add_argument('--model', default="sentence-transformers/all-MiniLM-L6-v2")
+        parser.add_argument('--max-batch', type=int, default=int(os.getenv('EMBEDDING_SERVER_MAX_BATCH', 64)))
+        parser.add_argument('--max-wait-ms', type=float, default=float(os.getenv('EMBEDDING_SERVER_MAX_WAIT_MS', 5)))
+
+    def handle(self, *args, **options):
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=options['model'])
+        server = EmbeddingServer(embeddings, options['socket'], options['max_batch'], options['max_wait_ms'] / 1000)
+        self.stdout.write(f"Serving {options['model']} on {options['socket']}")
+        try:
+            asyncio.run(server.serve())
+        except KeyboardInterrupt:
+            pass
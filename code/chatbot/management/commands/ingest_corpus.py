@@ -0,0 +1,51 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from chatbot.core.ingestion import CorpusIngestor, IngestState
+from chatbot.core.services import get_vector_store
+
+
+class Command(BaseCommand):
+    help = ("Streams documents from disk into the configured vector store: chunks them, embeds them in batches and "
+            "upserts batches in parallel. Unchanged chunks and files are skipped, so interrupted runs resume.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Files or directories to ingest.")
+        parser.add_argument('--extensions', nargs='+', default=['.txt', '.md'])
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--chunk-overlap', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=64, help="Chunks per embedding call and upsert.")
+        parser.add_argument('--upsert-workers', type=int, default=4)
+        parser.add_argument('--state', default=None,
+                            help="Checkpoint file, one per vector backend by default (data/ingest_state_<backend>.sqlite).")
+        parser.add_argument('--reset', action='store_true', help="Forget the checkpoint and ingest everything again.")
+
+    def handle(self, *args, **options):
+        missing = [path for path in options['paths'] if not os.path.exists(path)]
+        if missing:
+            raise CommandError(f"No such file or directory: {', '.join(missing)}")
+        backend = os.getenv('VECTOR_STORE', 'pinecone')
+        state = IngestState(options['state'] or os.path.join('data', f'ingest_state_{backend}.sqlite'))
+        if options['reset']:
+            state.reset()
+
+        splitter = RecursiveCharacterTextSplitter(chunk_size=options['chunk_size'], chunk_overlap=options['chunk_overlap'])
+        ingestor = CorpusIngestor(
+            get_vector_store(), state, splitter,
+            batch_size=options['batch_size'],
+            upsert_workers=options['upsert_workers'],
+            progress=self.report_progress,
+        )
+        extensions = {extension.lower() if extension.startswith('.') else f".{extension.lower()}" for extension in options['extensions']}
+        stats = ingestor.run(options['paths'], extensions)
+
+        self.stdout.write(
+            f"Files: {stats.files} ingested, {stats.files_skipped} unchanged. "
+            f"Chunks: {stats.upserted} upserted, {stats.chunks_skipped} unchanged, {stats.failed_batches} failed batches."
+        )
+        if stats.failed_batches:
+            raise CommandError(f"{stats.failed_batches} batches failed, re-run to retry them. Last error: {stats.errors[-1]}")
+
+    def report_progress(self, stats):
+        if stats.batches % 10 == 0:
+            self.stdout.write(f"  {stats.upserted} chunks upserted from {stats.files} files")
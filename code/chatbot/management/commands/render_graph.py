@@ -0,0 +1,24 @@
+import os
+from django.core.management.base import BaseCommand
+from chatbot.core.healthmate_graph import compile_graph
+
+
+def save_graph(graph, file_name='graph.png', output_dir='graphs'):
+    os.makedirs(output_dir, exist_ok=True)
+    graph_image = graph.get_graph().draw_mermaid_png()
+    file_path = os.path.join(output_dir, file_name)
+    with open(file_path, 'wb') as f:
+        f.write(graph_image)
+    return file_path
+
+
+class Command(BaseCommand):
+    help = "Renders the assistant logic graph to a mermaid PNG."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default='graphs')
+        parser.add_argument('--file-name', default='graph.png')
+
+    def handle(self, *args, **options):
+        file_path = save_graph(compile_graph(), file_name=options['file_name'], output_dir=options['output_dir'])
+        self.stdout.write(f"Graph saved at: {file_path}")
@@ -0,0 +1,101 @@
+import os
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.models import ConversationHistory
+from chatbot.core.embedding_cache import CachedEmbeddings
+from chatbot.core.intent_router import IntentRouter, INTENT_TOOLS, routing_text, seed_training_set
+from chatbot.core.services import get_embeddings
+
+
+def history_examples():
+    """
+    (routing text, route) of every logged turn the LLM orchestrator routed, with its session's previous turn
+    as the orchestrator node builds it.
+    """
+    previous = None
+    rows = ConversationHistory.objects.order_by('session_id', 'timestamp', 'id').values_list('session_id', 'user_message', 'bot_response', 'route')
+    for session_id, user_message, bot_response, route in rows.iterator():
+        if route in INTENT_TOOLS:
+            if previous is not None and previous[0] == session_id:
+                yield routing_text(user_message, previous[1], previous[2]), route
+            else:
+                yield routing_text(user_message), route
+        previous = (session_id, user_message, bot_response)
+
+
+class Command(BaseCommand):
+    help = ("Trains the local intent router from the seed examples and the routes logged in ConversationHistory, "
+            "prints an offline accuracy and latency report and saves the model with its held-out evaluation. "
+            "The chat only routes locally with a model evaluated as accurate enough (INTENT_ROUTER_MIN_ACCURACY).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=os.getenv('INTENT_ROUTER_PATH', 'models/intent_router.npz'))
+        parser.add_argument('--threshold', type=float, default=float(os.getenv('INTENT_ROUTER_THRESHOLD', 0.85)))
+        parser.add_argument('--test-size', type=float, default=0.2)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-history', action='store_true', help="Train on the seed examples only.")
+        parser.add_argument('--dry-run', action='store_true', help="Print the report without saving the model.")
+
+    def handle(self, *args, **options):
+        texts, labels = seed_training_set()
+        seed_count = len(texts)
+        if not options['no_history']:
+            for text, route in history_examples():
+                texts.append(text)
+                labels.append(route)
+        self.stdout.write(f"Training examples: {len(texts)} ({len(texts) - seed_count} from history)")
+
+        embeddings = np.asarray(get_embeddings().embed_documents(texts), dtype=np.float32)
+        labels = np.asarray(labels)
+
+        rng = np.random.default_rng(options['seed'])
+        order = rng.permutation(len(texts))
+        test_count = int(len(texts) * options['test_size'])
+        test, train = order[:test_count], order[test_count:]
+        if test_count == 0 or len(set(labels[train])) < 2:
+            raise CommandError("Not enough labelled examples for a train/test split.")
+
+        router = IntentRouter.fit(embeddings[train], labels[train], threshold=options['threshold'])
+        evaluation = self.report(router, [texts[i] for i in test], embeddings[test], labels[test])
+
+        router = IntentRouter.fit(embeddings, labels, threshold=options['threshold'], evaluation=evaluation)
+        min_accuracy = float(os.getenv('INTENT_ROUTER_MIN_ACCURACY', 0.95))
+        min_examples = int(os.getenv('INTENT_ROUTER_MIN_EVAL_EXAMPLES', 100))
+        if not router.trusted(min_accuracy, min_examples):
+            self.stdout.write(f"Not used for routing: needs local accuracy >= {min_accuracy:.2f} on >= {min_examples} held-out messages")
+        if not options['dry_run']:
+            router.save(options['output'])
+            self.stdout.write(f"Saved intent router to {options['output']}")
+
+    def report(self, router, texts, embeddings, labels):
+        """
+        Prints the held-out report and returns the evaluation saved with the model.
+        """
+        probabilities = router.predict_proba(embeddings)
+        predicted = np.asarray(router.labels)[probabilities.argmax(axis=1)]
+        confident = router.confident(embeddings)
+
+        self.stdout.write(f"Held-out accuracy (all):        {np.mean(predicted == labels):.3f} on {len(labels)} messages")
+        self.stdout.write(f"Routed locally at {router.threshold:.2f}:        {np.mean(confident):.3f} of messages")
+        if confident.any():
+            self.stdout.write(f"Accuracy of local routes:        {np.mean(predicted[confident] == labels[confident]):.3f}")
+        for label in router.labels:
+            mask = labels == label
+            if mask.any():
+                self.stdout.write(f"  {label:<28} accuracy {np.mean(predicted[mask] == label):.3f}  local {np.mean(confident[mask]):.3f}")
+
+        # Latency of one routing decision for a message not seen before: embed it with the model itself (the
+        # embedding cache already holds every text above), then classify.
+        embedder = get_embeddings()
+        if isinstance(embedder, CachedEmbeddings):
+            embedder = embedder.embeddings
+        timings = []
+        for text in texts[:50]:
+            started = time.perf_counter()
+            router.route(embedder.embed_query(text))
+            timings.append(time.perf_counter() - started)
+        timings = np.asarray(timings) * 1000
+        self.stdout.write(f"Routing latency: p50 {np.percentile(timings, 50):.1f} ms, p95 {np.percentile(timings, 95):.1f} ms")
+        local_accuracy = float(np.mean(predicted[confident] == labels[confident])) if confident.any() else 0.0
+        return {"examples": len(labels), "threshold": router.threshold, "local_accuracy": local_accuracy}
@@ -0,0 +1,68 @@
+import importlib
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.core.services import services
+
+# Modules that dominate cold start, in the order a first chat turn pulls them in.
+REPORTED_MODULES = [
+    "neo4j",
+    "pinecone",
+    "langchain_pinecone",
+    "langchain_huggingface",
+    "sentence_transformers",
+    "langchain_openai",
+    "langchain_google_genai",
+    "langchain_mistralai",
+    "chatbot.core.healthmate_graph",
+    "chatbot.views",
+]
+
+
+class Command(BaseCommand):
+    help = "Preloads the chat backends and reports import and construction times."
+
+    def add_arguments(self, parser):
+        parser.add_argument('services', nargs='*', choices=services.names(),
+                            help="Services to build, all of them when omitted.")
+        parser.add_argument('--skip-imports', action='store_true', help="Do not print the import-time report.")
+        parser.add_argument('--max-seconds', type=float, default=None,
+                            help="Fail when the total cold start takes longer than this.")
+
+    def handle(self, *args, **options):
+        total = 0.0
+        if not options['skip_imports']:
+            self.stdout.write("Import times:")
+            for module_name in REPORTED_MODULES:
+                if module_name in sys.modules:
+                    self.stdout.write(f"  {module_name:<32} already imported")
+                    continue
+                started = time.perf_counter()
+                try:
+                    importlib.import_module(module_name)
+                except ImportError as e:
+                    self.stdout.write(f"  {module_name:<32} not available ({e})")
+                    continue
+                elapsed = time.perf_counter() - started
+                total += elapsed
+                self.stdout.write(f"  {module_name:<32} {elapsed * 1000:8.1f} ms")
+
+        self.stdout.write("Service construction times:")
+        for name in options['services'] or services.names():
+            was_loaded = services.is_loaded(name)
+            started = time.perf_counter()
+            try:
+                instance = services.get(name)
+            except Exception as e:
+                raise CommandError(f"Could not build {name}: {e}")
+            if name == "embeddings":
+                # The model weights load lazily on the first forward pass.
+                instance.embed_query("warmup")
+            elapsed = time.perf_counter() - started
+            total += elapsed
+            status = "already loaded" if was_loaded else f"{elapsed * 1000:8.1f} ms"
+            self.stdout.write(f"  {name:<32} {status}")
+
+        self.stdout.write(f"Total: {total * 1000:.1f} ms")
+        if options['max_seconds'] is not None and total > options['max_seconds']:
+            raise CommandError(f"Cold start took {total:.2f}s, above the {options['max_seconds']:.2f}s cap")
@@ -1,13 +1,111 @@
 # chatbot/models.py
+import datetime
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+# Text search configuration of the history search vectors; queries must use the same one.
+SEARCH_CONFIG = "english"
 
 class ConversationHistory(models.Model):
     user_message = models.TextField()
     bot_response = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
-    date = models.DateField(auto_now_add=True)
+    # Defaults rather than auto_now_add, so turns written behind (see core/turn_log.py) keep the time they happened.
+    timestamp = models.DateTimeField(default=timezone.now)
+    date = models.DateField(default=datetime.date.today)
     session_id = models.CharField(max_length=100)  # Track different sessions/conversations
     patient_email = models.EmailField()  # To associate the conversation with the patient
+    route = models.CharField(max_length=50, blank=True, default="")  # Orchestrator tool chosen by the LLM, used to train the intent router
+    # Maintained by Postgres on every insert/update, one per side so the user-only and bot-only filters stay indexed.
+    user_search = models.GeneratedField(
+        expression=SearchVector("user_message", config=SEARCH_CONFIG), output_field=SearchVectorField(), db_persist=True,
+    )
+    bot_search = models.GeneratedField(
+        expression=SearchVector("bot_response", config=SEARCH_CONFIG), output_field=SearchVectorField(), db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            # History browsing (dates of a session, a day's turns in order) and the per-patient search filter.
+            models.Index(fields=["session_id", "date", "timestamp", "id"], name="history_session_date"),
+            models.Index(fields=["patient_email", "date", "timestamp"], name="history_patient_date"),
+            GinIndex(fields=["user_search"], name="history_user_search"),
+            GinIndex(fields=["bot_search"], name="history_bot_search"),
+            # Trigram indexes serve substring matches, which full-text search does not cover. On UPPER() because
+            # that is what icontains compares; case-sensitive matches are rechecked on the rows they return.
+            GinIndex(OpClass(Upper("user_message"), name="gin_trgm_ops"), name="history_user_trgm"),
+            GinIndex(OpClass(Upper("bot_response"), name="gin_trgm_ops"), name="history_bot_trgm"),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.patient_email}"
+
+class GraphCheckpoint(models.Model):
+    """
+    One LangGraph checkpoint without its channel values, which live in GraphCheckpointBlob.
+    """
+    thread_id = models.CharField(max_length=255)
+    checkpoint_ns = models.CharField(max_length=255, blank=True, default="")
+    checkpoint_id = models.CharField(max_length=64)  # uuid6, so ids sort by creation time
+    parent_checkpoint_id = models.CharField(max_length=64, null=True, blank=True)
+    type = models.CharField(max_length=32)
+    checkpoint = models.BinaryField()
+    metadata = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["thread_id", "checkpoint_ns", "checkpoint_id"], name="graph_checkpoint_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.thread_id} - {self.checkpoint_id}"
+
+class GraphCheckpointBlob(models.Model):
+    """
+    A channel value at one version. Checkpoints that did not change a channel share its blob.
+    """
+    thread_id = models.CharField(max_length=255)
+    checkpoint_ns = models.CharField(max_length=255, blank=True, default="")
+    channel = models.CharField(max_length=255)
+    version = models.CharField(max_length=64)
+    type = models.CharField(max_length=32)
+    value = models.BinaryField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["thread_id", "checkpoint_ns", "channel", "version"], name="graph_checkpoint_blob_unique"),
+        ]
+
+class GraphCheckpointWrite(models.Model):
+    """
+    A pending write of a task, kept so an interrupted step can resume without re-running finished tasks.
+    """
+    thread_id = models.CharField(max_length=255)
+    checkpoint_ns = models.CharField(max_length=255, blank=True, default="")
+    checkpoint_id = models.CharField(max_length=64)
+    task_id = models.CharField(max_length=64)
+    idx = models.IntegerField()
+    channel = models.CharField(max_length=255)
+    type = models.CharField(max_length=32)
+    value = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"], name="graph_checkpoint_write_unique"),
+        ]
+
+class PendingSummary(models.Model):
+    """
+    A background conversation summary: claimed when its job is queued, filled in when it finishes and deleted
+    by the turn that applies it. Kept in the database because that turn may run in another worker.
+    """
+    thread_id = models.CharField(max_length=255, unique=True)
+    summary = models.TextField(null=True, blank=True)  # None while the job is in flight
+    watermark = models.CharField(max_length=255, blank=True, default="")
+    claimed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.thread_id} - {self.claimed_at}"
@@ -0,0 +1,27 @@
+from django.db import connections
+from django.db.models.signals import post_save, post_delete, pre_migrate
+from django.dispatch import receiver
+from patients.models import Patient
+from .core.services import services
+from .history import invalidate_history_dates
+from .models import ConversationHistory
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidate_patient_context(sender, instance, **kwargs):
+    # Nothing to invalidate until a chat turn has built the provider.
+    if services.is_loaded("patient_contexts"):
+        services.get("patient_contexts").invalidate(instance)
+
+@receiver(post_save, sender=ConversationHistory)
+def invalidate_session_history_dates(sender, instance, **kwargs):
+    invalidate_history_dates(instance.session_id)
+
+@receiver(pre_migrate)
+def create_search_extensions(sender, using="default", **kwargs):
+    # The history trigram indexes need pg_trgm before the migration creating them runs. Migrations are
+    # generated with makemigrations, so the extension is created here rather than in a migration.
+    if sender.name != "chatbot" or connections[using].vendor != "postgresql":
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
@@ -1,3 +1,583 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from collections import Counter
+from unittest import mock
+from django.test import SimpleTestCase, TestCase
+from types import SimpleNamespace
+from typing import Annotated
+from typing_extensions import TypedDict
+from asgiref.sync import async_to_sync
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from patients.models import Patient
+from .core.patient_context import PatientContextProvider
+from .core import healthmate_graph
+from .core.healthmate_graph import doctor_name, patient_context_text
+from .core.semantic_cache import SemanticResponseCache
+from .core.llm_adapters.llm_cache import LLMResponseCache
+from .core.llm_adapters.llm_manager import LLMManager
+from .core.intent_router import IntentRouter, routing_text
+from .core.services import _create_intent_router
+from .management.commands.train_intent_router import history_examples
+from .models import ConversationHistory
+from .core.conversation_summary import ConversationSummarizer, DatabaseSummaryStore, MemorySummaryStore
+from .core.cypher_templates import select_template
+from .core.knowledge_graph import LOAD_USER_SUBGRAPH_QUERY, KnowledgeGraph, fetch_subgraph_rows, format_path_record
+from .models import GraphCheckpoint, GraphCheckpointBlob, PendingSummary
+from .core.checkpointer import DjangoCheckpointSaver
+from .core.turn_log import TurnLogger
+from .core.embedding_cache import EmbeddingDiskCache
+from .core.cypher_templates import UserVocabulary, match_template, parse_template_selection
+from .history import conversation_page
+from .history_search import search_history
+from .core.subgraph_cache import QueryBudgetExceeded, SubgraphCache, UserSubgraph, build_subgraph
 
-# Create your tests here.
+NEO4J_TEST_URI = os.getenv('NEO4J_TEST_URI')
+
+class SubgraphCacheTTLTests(SimpleTestCase):
+    def test_subgraph_is_reloaded_after_ttl(self):
+        cache = SubgraphCache(max_bytes=1024 * 1024, ttl_seconds=30)
+        subgraph = UserSubgraph("User", build_subgraph([("User", "Person", [("takes", "Metformin", "Medication")])]))
+        cache.put(subgraph, cache.generation)
+        self.assertIs(cache.get("User"), subgraph)
+        with mock.patch("chatbot.core.subgraph_cache.time.monotonic", return_value=time.monotonic() + 31):
+            self.assertIsNone(cache.get("User"))
+        self.assertEqual(cache.stats()["expired"], 1)
+        self.assertEqual(cache.bytes, 0)
+
+    def test_write_through_keeps_load_time(self):
+        subgraph = UserSubgraph("User", build_subgraph([("User", "Person", [])]), loaded_at=100.0)
+        updated = subgraph.with_write([{"from": "User", "relationship": "takes", "to": "Metformin"}],
+                                      build_subgraph([("Metformin", "Medication", [])]))
+        self.assertEqual(updated.loaded_at, 100.0)
+
+def dense_subgraph(size):
+    names = [f"Entity {i}" for i in range(size)]
+    rows = [("User", "Person", [("has", name, "Condition") for name in names])]
+    rows += [(name, "Condition", [("affects", other, "Condition") for other in names if other != name]) for name in names]
+    return UserSubgraph("User", build_subgraph(rows))
+
+class SubgraphQueryBudgetTests(SimpleTestCase):
+    def test_limit_stops_walk_on_dense_graph(self):
+        started = time.perf_counter()
+        rows = dense_subgraph(8).query("overview", select_template("overview", "User").params)
+        self.assertEqual(len(rows), 50)
+        self.assertLess(time.perf_counter() - started, 1)
+
+    def test_unmatched_filter_on_dense_graph_exceeds_budget(self):
+        selection = select_template("relationships", "User", relationships=["prescribed"])
+        with self.assertRaises(QueryBudgetExceeded):
+            dense_subgraph(8).query(selection.template, selection.params)
+
+    def test_leaf_rows_have_no_continuation(self):
+        subgraph = UserSubgraph("User", build_subgraph([("User", "Person", [("takes", "Metformin", "Medication")])]))
+        rows = subgraph.query("overview", select_template("overview", "User").params)
+        self.assertEqual([(row["path1"].nodes[-1]["name"], row["path2"]) for row in rows], [("Metformin", None)])
+
+@unittest.skipUnless(NEO4J_TEST_URI, "set NEO4J_TEST_URI (and NEO4J_TEST_USER/NEO4J_TEST_PASSWORD) to a scratch Neo4j database")
+class SubgraphQueryMatchesCypherTests(SimpleTestCase):
+    """
+    UserSubgraph.query reimplements the templates' -[*]-> matching and LIMIT; its rows must be the ones the
+    Cypher returns. Every entity name carries a random suffix, so the test never touches other data.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.kg = KnowledgeGraph(NEO4J_TEST_URI, os.getenv('NEO4J_TEST_USER', 'neo4j'), os.getenv('NEO4J_TEST_PASSWORD', ''),
+                                subgraph_cache_mb=0)
+        suffix = uuid.uuid4().hex[:8]
+        cls.names = {name: f"{name} {suffix}" for name in ["User", "Metformin", "Diabetes", "Fatigue", "Martha", "Walking"]}
+        n = cls.names
+        entities = [{"name": n["User"], "type": "Person"}, {"name": n["Metformin"], "type": "Medication"},
+                    {"name": n["Diabetes"], "type": "Condition"}, {"name": n["Fatigue"], "type": "Symptom"},
+                    {"name": n["Martha"], "type": "Pet"}, {"name": n["Walking"], "type": "Lifestyle"}]
+        # Branches, a shared descendant (Diabetes via two routes), a cycle (Fatigue <-> Diabetes) and a leaf.
+        relationships = [(n["User"], "takes", n["Metformin"]), (n["User"], "has", n["Diabetes"]),
+                         (n["Metformin"], "treats", n["Diabetes"]), (n["Diabetes"], "causes", n["Fatigue"]),
+                         (n["Fatigue"], "worsens", n["Diabetes"]), (n["User"], "owns", n["Martha"]),
+                         (n["Martha"], "needs", n["Walking"]), (n["Walking"], "improves", n["Diabetes"])]
+        cls.kg.store_entities_and_relationships(entities, [{"from": a, "relationship": r, "to": b} for a, r, b in relationships])
+        rows = cls.kg.read(fetch_subgraph_rows, LOAD_USER_SUBGRAPH_QUERY, {"user_name": n["User"]})
+        cls.subgraph = UserSubgraph(n["User"], build_subgraph(rows))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.kg.write(lambda tx: tx.run("MATCH (e:Entity) WHERE e.name IN $names DETACH DELETE e", names=list(cls.names.values())).consume())
+        cls.kg.shutdown()
+        super().tearDownClass()
+
+    def selections(self, limit):
+        user = self.names["User"]
+        return [
+            select_template("entities", user, types=["Condition"], limit=limit),
+            select_template("entities", user, names=[self.names["Martha"]], limit=limit),
+            select_template("relationships", user, relationships=["treats", "improves"], limit=limit),
+            select_template("overview", user, limit=limit),
+        ]
+
+    def local_rows(self, selection):
+        return [format_path_record(record) for record in self.subgraph.query(selection.template, selection.params)]
+
+    def test_rows_match_cypher(self):
+        for selection in self.selections(limit=10000):
+            with self.subTest(template=selection.template, params=selection.params):
+                self.assertEqual(Counter(self.local_rows(selection)), Counter(self.kg.execute_cypher_query(selection.query, selection.params)))
+
+    def test_limit_matches_cypher(self):
+        # LIMIT without ORDER BY picks any rows, so compare how many and check they all belong to the full result.
+        for unlimited, limited in zip(self.selections(limit=10000), self.selections(limit=3)):
+            with self.subTest(template=limited.template, params=limited.params):
+                full = Counter(self.kg.execute_cypher_query(unlimited.query, unlimited.params))
+                local = Counter(self.local_rows(limited))
+                self.assertEqual(sum(local.values()), sum(Counter(self.kg.execute_cypher_query(limited.query, limited.params)).values()))
+                self.assertFalse(local - full)
+
+def long_conversation(turns=8):
+    messages = []
+    for i in range(turns):
+        messages += [HumanMessage(f"question {i}", id=f"h{i}"), AIMessage(f"answer {i}", id=f"a{i}")]
+    return messages
+
+def run_jobs(summarizer):
+    summarizer._ensure_started()
+    summarizer._queue.join()
+
+class MemorySummaryStoreTests(SimpleTestCase):
+    def test_one_job_per_thread_until_taken(self):
+        summarizer = ConversationSummarizer(lambda summary, messages: "summary", store=MemorySummaryStore())
+        messages = long_conversation()
+        self.assertTrue(summarizer.maybe_submit("t", "", messages))
+        self.assertFalse(summarizer.maybe_submit("t", "", messages))
+        run_jobs(summarizer)
+        self.assertFalse(summarizer.maybe_submit("t", "", messages))
+        update = summarizer.compaction("t", messages)
+        self.assertEqual(update["summary"], "summary")
+        self.assertEqual(len(update["messages"]), len(messages) - 2)
+        self.assertTrue(summarizer.maybe_submit("t", "", messages))
+        summarizer.shutdown()
+
+    def test_unapplied_summaries_expire(self):
+        store = MemorySummaryStore(ttl_seconds=600)
+        self.assertTrue(store.claim("ended"))
+        with mock.patch("chatbot.core.conversation_summary.time.monotonic", return_value=time.monotonic() + 601):
+            self.assertTrue(store.claim("other"))
+        self.assertEqual(len(store), 1)
+
+    def test_failed_job_frees_the_thread(self):
+        def fail(summary, messages):
+            raise RuntimeError("LLM down")
+        summarizer = ConversationSummarizer(fail, store=MemorySummaryStore())
+        messages = long_conversation()
+        with self.assertLogs("chatbot.core.conversation_summary", "ERROR"):
+            summarizer.maybe_submit("t", "", messages)
+            run_jobs(summarizer)
+        self.assertIsNone(summarizer.compaction("t", messages))
+        self.assertTrue(summarizer.store.claim("t"))
+        summarizer.shutdown()
+
+class DatabaseSummaryStoreTests(TestCase):
+    def test_summary_is_applied_by_another_worker(self):
+        # Each summarizer stands for one worker process; the conversation's next turn lands on the second.
+        first = ConversationSummarizer(lambda summary, messages: "summary", store=DatabaseSummaryStore())
+        second = ConversationSummarizer(lambda summary, messages: "other", store=DatabaseSummaryStore())
+        messages = long_conversation()
+        # Jobs run here rather than on the summarizer thread, which would not see the test's transaction.
+        with mock.patch.object(ConversationSummarizer, "_ensure_started"), \
+                mock.patch("chatbot.core.conversation_summary.close_old_connections"):
+            self.assertTrue(first.maybe_submit("t", "", messages))
+            self.assertFalse(second.maybe_submit("t", "", messages))
+            first._process(first._queue.get_nowait())
+        update = second.compaction("t", messages)
+        self.assertEqual(update["summary"], "summary")
+        self.assertFalse(PendingSummary.objects.exists())
+        self.assertIsNone(first.compaction("t", messages))
+
+    def test_stale_claims_are_deleted(self):
+        store = DatabaseSummaryStore(ttl_seconds=600)
+        self.assertTrue(store.claim("lost"))
+        PendingSummary.objects.update(claimed_at=PendingSummary.objects.get().claimed_at - datetime.timedelta(seconds=601))
+        self.assertTrue(store.claim("other"))
+        self.assertEqual(list(PendingSummary.objects.values_list("thread_id", flat=True)), ["other"])
+
+class PatientContextProviderTests(TestCase):
+    def test_email_without_patient_gets_no_context(self):
+        provider = PatientContextProvider()
+        self.assertIsNone(provider.get("admin@example.com"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(provider.get("admin@example.com"))
+        self.assertEqual(doctor_name(None), "Doctor")
+        self.assertEqual(patient_context_text(None), "No patient record.")
+
+    def test_new_patient_replaces_cached_miss(self):
+        provider = PatientContextProvider()
+        self.assertIsNone(provider.get("jane@example.com"))
+        now = datetime.datetime(2024, 5, 1, 9, 0, tzinfo=datetime.timezone.utc)
+        patient = Patient.objects.create(first_name="Jane", last_name="Roe", date_of_birth=datetime.date(1980, 1, 2),
+                                         phone_number="555", email="jane@example.com", medical_condition="asthma",
+                                         medication_regimen="inhaler", last_appointment=now, next_appointment=now,
+                                         doctor_name="Dr. Lee")
+        provider.invalidate(patient)
+        self.assertEqual(provider.get("jane@example.com").doctor_name, "Dr. Lee")
+
+def opening_general_question(question):
+    return {"messages": [HumanMessage(question), AIMessage("", tool_calls=[{"name": "assistant_tool", "args": {}, "id": "call"}]),
+                         ToolMessage("", tool_call_id="call")]}
+
+class RecordingLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def generate_response(self, messages, config=None):
+        self.prompts.append((" ".join(message.content for message in messages), config))
+        return AIMessage(f"answer {len(self.prompts)}")
+
+class SharedAnswerTests(SimpleTestCase):
+    def setUp(self):
+        self.llm = RecordingLLM()
+        self.cache = SemanticResponseCache(threshold=0.9)
+        patients = {"a@example.com": SimpleNamespace(context="My name is Alice Smith."),
+                    "b@example.com": SimpleNamespace(context="My name is Bob Jones.")}
+        store = mock.Mock(embed_query=lambda text: [1.0, 0.0], search_with_embeddings=lambda embedding, k: [])
+        packer = mock.Mock(fetch_k=4, pack=lambda embedding, results: SimpleNamespace(text="Rest and fluids.", tokens=3, docs=[], candidates=0))
+        packer.record.return_value = 10
+        for name, value in [("get_llm", self.llm), ("get_semantic_cache", self.cache), ("get_vector_store", store),
+                            ("get_context_packer", packer), ("get_patient_contexts", mock.Mock(get=patients.get))]:
+            patcher = mock.patch.object(healthmate_graph, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def wait_for_fills(self):
+        deadline = time.monotonic() + 5
+        while self.cache.stats()["pending_fills"] and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def test_miss_answers_from_personalized_prompt_and_caches_a_patient_free_one(self):
+        config = {"configurable": {"patient_email": "a@example.com"}}
+        update = healthmate_graph.assistant(opening_general_question("What helps with a cold?"), config)
+        self.wait_for_fills()
+        (personal, personal_config), (shared, shared_config) = self.llm.prompts
+        self.assertIn("Alice", personal)
+        self.assertIs(personal_config, config)
+        self.assertNotIn("Alice", shared)
+        self.assertIsNone(shared_config)
+        self.assertEqual(update["messages"][0].content, "answer 1")
+
+        update = healthmate_graph.assistant(opening_general_question("What helps with a cold?"), {"configurable": {"patient_email": "b@example.com"}})
+        self.assertEqual(update["messages"][0].content, "answer 2")
+        self.assertEqual(len(self.llm.prompts), 2)
+
+    def test_follow_up_questions_do_not_use_the_cache(self):
+        state = opening_general_question("And for a cough?")
+        state["messages"] = [HumanMessage("What helps with a cold?"), AIMessage("Rest.")] + state["messages"]
+        healthmate_graph.assistant(state, {"configurable": {"patient_email": "a@example.com"}})
+        self.wait_for_fills()
+        self.assertEqual(len(self.llm.prompts), 1)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_failed_fill_is_counted(self):
+        def fail():
+            raise RuntimeError("LLM down")
+        with self.assertLogs("chatbot.core.semantic_cache", "ERROR"):
+            self.cache.fill_later([1.0, 0.0], "docs", fail)
+            self.wait_for_fills()
+        self.assertEqual(self.cache.stats()["fill_failures"], 1)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+def fitted_router(evaluation=None, threshold=0.85):
+    return IntentRouter.fit([[1.0, 0.0], [0.0, 1.0]], ["assistant_tool", "end_tool"], threshold=threshold, evaluation=evaluation)
+
+class IntentRouterGatingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "router.npz")
+
+    def load_service(self, **environ):
+        with mock.patch.dict(os.environ, {"INTENT_ROUTER_PATH": self.path, **environ}):
+            return _create_intent_router()
+
+    def test_off_without_a_trained_model(self):
+        self.assertIsNone(self.load_service())
+
+    def test_off_when_evaluation_is_missing_or_weak(self):
+        fitted_router().save(self.path)
+        with self.assertLogs("chatbot.core.services", "WARNING"):
+            self.assertIsNone(self.load_service())
+        fitted_router({"examples": 200, "threshold": 0.85, "local_accuracy": 0.9}).save(self.path)
+        with self.assertLogs("chatbot.core.services", "WARNING"):
+            self.assertIsNone(self.load_service())
+
+    def test_on_when_evaluated_accurate_at_the_same_threshold(self):
+        fitted_router({"examples": 200, "threshold": 0.85, "local_accuracy": 0.97}).save(self.path)
+        router = self.load_service()
+        self.assertEqual(router.evaluation["local_accuracy"], 0.97)
+        with self.assertLogs("chatbot.core.services", "WARNING"):
+            self.assertIsNone(self.load_service(INTENT_ROUTER_THRESHOLD="0.5"))
+
+    def test_follow_ups_are_routed_with_the_previous_turn(self):
+        messages = [HumanMessage("What helps with knee pain?"), AIMessage("", tool_calls=[{"name": "assistant_tool", "args": {}, "id": "call"}]),
+                    ToolMessage("", tool_call_id="call"), AIMessage("Rest and ice."), HumanMessage("And for my back?")]
+        self.assertEqual(healthmate_graph.routing_input(messages[:1]), "What helps with knee pain?")
+        self.assertEqual(healthmate_graph.routing_input(messages), routing_text("And for my back?", "What helps with knee pain?", "Rest and ice."))
+
+class IntentRouterTrainingTests(TestCase):
+    def test_history_examples_carry_the_previous_turn(self):
+        for session_id, user_message, bot_response, route in [("s1", "Hi", "Hello!", "assistant_tool"), ("s1", "And my dosage?", "10 mg.", "query_knowledge_graph_tool"),
+                                                              ("s2", "Tell me a joke", "No.", "end_tool"), ("s2", "Thanks", "Bye.", "")]:
+            ConversationHistory.objects.create(session_id=session_id, user_message=user_message, bot_response=bot_response, route=route,
+                                               patient_email="a@example.com")
+        self.assertEqual(list(history_examples()), [("Hi", "assistant_tool"), (routing_text("And my dosage?", "Hi", "Hello!"), "query_knowledge_graph_tool"),
+                                                    ("Tell me a joke", "end_tool")])
+
+class CountingLLM:
+    def __init__(self, temperature=0):
+        self.temperature = temperature
+        self.calls = 0
+
+    def invoke(self, messages, config=None):
+        self.calls += 1
+        return AIMessage(f"answer {self.calls}")
+
+class LLMResponseCacheFailureTests(SimpleTestCase):
+    def test_waiters_are_released_when_the_cache_write_fails(self):
+        cache = LLMResponseCache()
+        started, release = threading.Event(), threading.Event()
+
+        def leader_call():
+            started.set()
+            release.wait(5)
+            return AIMessage("answer")
+
+        results = []
+        with mock.patch.object(cache, "put", side_effect=sqlite3.OperationalError("disk I/O error")), \
+                self.assertLogs("chatbot.core.llm_adapters.llm_cache", "ERROR"):
+            leader = threading.Thread(target=lambda: results.append(cache.get_or_call("key", leader_call)))
+            leader.start()
+            started.wait(5)
+            waiter = threading.Thread(target=lambda: results.append(cache.get_or_call("key", lambda: AIMessage("second call"))))
+            waiter.start()
+            while cache.coalesced == 0 and waiter.is_alive():
+                time.sleep(0.001)
+            release.set()
+            leader.join(5)
+            waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual([message.content for message in results], ["answer", "answer"])
+
+    def test_cache_is_bypassed_above_temperature_zero(self):
+        manager = LLMManager(llm_instance=CountingLLM(temperature=0.7), cache=LLMResponseCache())
+        self.assertEqual(manager.generate_response([HumanMessage("hi")], cache=True).content, "answer 1")
+        self.assertEqual(manager.generate_response([HumanMessage("hi")], cache=True).content, "answer 2")
+        self.assertEqual(manager.stats()["misses"], 0)
+
+        manager = LLMManager(llm_instance=CountingLLM(temperature=0), cache=LLMResponseCache())
+        manager.generate_response([HumanMessage("hi")], cache=True)
+        self.assertEqual(manager.generate_response([HumanMessage("hi")], cache=True).content, "answer 1")
+
+class LLMResponseCacheTests(SimpleTestCase):
+    def test_concurrent_identical_calls_share_one_round_trip(self):
+        cache = LLMResponseCache()
+        llm = CountingLLM()
+
+        async def call():
+            await asyncio.sleep(0.05)
+            return llm.invoke([])
+
+        async def ask_twice():
+            return await asyncio.gather(cache.aget_or_call("key", call), cache.aget_or_call("key", call))
+
+        first, second = async_to_sync(ask_twice)()
+        self.assertEqual(llm.calls, 1)
+        self.assertEqual((first.content, second.content), ("answer 1", "answer 1"))
+        self.assertEqual(cache.coalesced, 1)
+        self.assertEqual(cache.get_or_call("key", lambda: llm.invoke([])).content, "answer 1")
+        self.assertEqual(cache.hits, 1)
+
+    def test_leader_error_reaches_waiters_and_is_not_cached(self):
+        cache = LLMResponseCache()
+
+        async def failing_call():
+            await asyncio.sleep(0.05)
+            raise RuntimeError("provider down")
+
+        async def ask_twice():
+            return await asyncio.gather(cache.aget_or_call("key", failing_call), cache.aget_or_call("key", failing_call),
+                                        return_exceptions=True)
+
+        results = async_to_sync(ask_twice)()
+        self.assertEqual([str(result) for result in results], ["provider down", "provider down"])
+        self.assertEqual(cache.get_or_call("key", lambda: AIMessage("retried")).content, "retried")
+
+    def test_cached_tool_calls_get_new_ids(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "llm_cache.sqlite3")
+            message = AIMessage("", tool_calls=[{"name": "assistant_tool", "args": {}, "id": "call_1"}])
+            LLMResponseCache(sqlite_path=path).get_or_call("key", lambda: message)
+            cache = LLMResponseCache(sqlite_path=path)
+            cached = cache.get_or_call("key", lambda: AIMessage("not cached"))
+        self.assertEqual(cache.disk_hits, 1)
+        self.assertEqual(cached.tool_calls[0]["name"], "assistant_tool")
+        self.assertNotEqual(cached.tool_calls[0]["id"], "call_1")
+
+class EmbeddingDiskCacheTests(SimpleTestCase):
+    def test_vectors_survive_a_reopen(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = EmbeddingDiskCache(directory)
+            cache.put_many([("a", [0.5, -1.0, 2.0]), ("b", [1.0, 0.0, 0.25])])
+            cache.put_many([("a", [9.0, 9.0, 9.0])])
+            reopened = EmbeddingDiskCache(directory)
+            self.assertEqual(len(reopened), 2)
+            self.assertEqual(reopened.get("a"), [0.5, -1.0, 2.0])
+            self.assertEqual(reopened.get("b"), [1.0, 0.0, 0.25])
+            self.assertIsNone(reopened.get("c"))
+
+    def test_half_written_row_is_dropped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = EmbeddingDiskCache(directory, dtype="float32")
+            cache.put_many([("a", [1.0, 2.0])])
+            with open(cache.vectors_path, "ab") as f:
+                f.write(b"\0\0")
+            with open(cache.index_path, "a") as f:
+                f.write("b 1 2\n")
+            reopened = EmbeddingDiskCache(directory, dtype="float32")
+            self.assertEqual(len(reopened), 1)
+            reopened.put_many([("c", [3.0, 4.0])])
+            self.assertEqual(EmbeddingDiskCache(directory, dtype="float32").get("c"), [3.0, 4.0])
+
+class TurnLoggerSpoolTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spool_path = os.path.join(directory.name, "turns.jsonl")
+        # Flush by hand instead of on the logger's thread.
+        patcher = mock.patch.object(TurnLogger, "_ensure_started")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_batch_is_spooled_and_replayed(self):
+        written = []
+        failing = TurnLogger(mock.Mock(side_effect=RuntimeError("database down")), spool_path=self.spool_path)
+        failing.log({"user_message": "hi"})
+        with self.assertLogs("chatbot.core.turn_log", "ERROR"):
+            self.assertEqual(failing.flush(), 0)
+        self.assertEqual(failing.stats()["spooled"], 1)
+
+        logger = TurnLogger(written.extend, spool_path=self.spool_path)
+        self.assertEqual(logger.flush(), 1)
+        self.assertEqual(written, [{"user_message": "hi"}])
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    def test_corrupt_lines_are_skipped_and_kept(self):
+        with open(self.spool_path, "w") as f:
+            f.write(json.dumps({"user_message": "first"}) + "\n")
+            f.write('{"user_message": "cut sh\n')
+            f.write(json.dumps({"user_message": "second"}) + "\n")
+            f.write('{"user_message": "last')
+        written = []
+        logger = TurnLogger(written.extend, spool_path=self.spool_path)
+        with self.assertLogs("chatbot.core.turn_log", "WARNING"):
+            self.assertEqual(logger.flush(), 2)
+        self.assertEqual([turn["user_message"] for turn in written], ["first", "second"])
+        self.assertEqual(logger.stats()["corrupt"], 2)
+        with open(f"{self.spool_path}.bad") as f:
+            self.assertEqual(f.read(), '{"user_message": "cut sh\n{"user_message": "last\n')
+
+class TemplateSelectionTests(SimpleTestCase):
+    vocabulary = UserVocabulary(names=["User", "Metformin", "Headache"], types=["Medication", "Symptom"],
+                                relationships=["takes", "has"])
+
+    def test_local_match(self):
+        selection = match_template("Can I take Metformin with food?", self.vocabulary)
+        self.assertEqual((selection.template, selection.params["names"]), ("entities", ["metformin"]))
+        self.assertEqual(match_template("What do I takes daily?", self.vocabulary).template, "relationships")
+        self.assertEqual(match_template("Tell me everything about me", self.vocabulary).template, "overview")
+        self.assertIsNone(match_template("What has changed?", self.vocabulary))
+
+    def test_llm_reply_parsing(self):
+        fenced = '```json\n{"template": "entities", "names": ["metformin", "Aspirin"], "types": []}\n```'
+        selection = parse_template_selection(fenced, self.vocabulary)
+        self.assertEqual((selection.template, selection.params["names"]), ("entities", ["metformin"]))
+        self.assertEqual(parse_template_selection('{"template": "entities", "names": ["Aspirin"]}', self.vocabulary).template, "overview")
+        self.assertEqual(parse_template_selection('{"template": "relationships", "relationships": ["takes"]}', self.vocabulary).template, "relationships")
+        self.assertEqual(parse_template_selection("I cannot help with that", self.vocabulary).template, "overview")
+        free_form = parse_template_selection('{"template": "none", "query": "MATCH (n) RETURN n"}', self.vocabulary)
+        self.assertEqual((free_form.template, free_form.query), (None, "MATCH (n) RETURN n"))
+        self.assertEqual(parse_template_selection("MATCH (n) RETURN n", self.vocabulary).source, "free-form")
+
+class CountingState(TypedDict):
+    messages: Annotated[list, add_messages]
+    n: int
+
+def counting_graph(checkpointer):
+    graph = StateGraph(CountingState)
+    graph.add_node("reply", lambda state: {"messages": [AIMessage("a" * 3000)], "n": state.get("n", 0) + 1})
+    graph.add_node("count", lambda state: {"n": state["n"] + 1})
+    graph.add_edge(START, "reply")
+    graph.add_edge("reply", "count")
+    graph.add_edge("count", END)
+    return graph.compile(checkpointer=checkpointer)
+
+class DjangoCheckpointSaverTests(TestCase):
+    def test_state_survives_pruning(self):
+        saver = DjangoCheckpointSaver(keep_latest=4)
+        graph = counting_graph(saver)
+        config = {"configurable": {"thread_id": "thread"}}
+        for turn in range(5):
+            graph.invoke({"messages": [HumanMessage(f"turn {turn}")]}, config)
+        state = counting_graph(DjangoCheckpointSaver(keep_latest=4)).get_state(config)
+        self.assertEqual((len(state.values["messages"]), state.values["n"]), (10, 10))
+        self.assertEqual(state.next, ())
+
+        saver.prune("thread")
+        self.assertEqual(GraphCheckpoint.objects.filter(thread_id="thread").count(), 4)
+        self.assertEqual(len(graph.get_state(config).values["messages"]), 10)
+        self.assertTrue(GraphCheckpointBlob.objects.filter(channel="messages", type__endswith="+zlib").exists())
+
+    def test_threads_are_separate(self):
+        saver = DjangoCheckpointSaver()
+        graph = counting_graph(saver)
+        graph.invoke({"messages": [HumanMessage("hi")]}, {"configurable": {"thread_id": "one"}})
+        self.assertIsNone(saver.get_tuple({"configurable": {"thread_id": "two"}}))
+        saver.delete_thread("one")
+        self.assertIsNone(saver.get_tuple({"configurable": {"thread_id": "one"}}))
+
+def add_turns(session_id, *messages, date=datetime.date(2024, 5, 1)):
+    timestamp = datetime.datetime(2024, 5, 1, 9, tzinfo=datetime.timezone.utc)
+    return [ConversationHistory.objects.create(session_id=session_id, patient_email="john@example.com", date=date,
+                                               timestamp=timestamp, user_message=message, bot_response=f"About {message}")
+            for message in messages]
+
+class HistoryQueryTests(TestCase):
+    def test_search_is_scoped_to_the_session(self):
+        add_turns("mine", "my headache", "my diet")
+        add_turns("theirs", "their headache")
+        matches, has_next = search_history(ConversationHistory.objects.filter(session_id="mine"), "headache", filter_user=True)
+        self.assertEqual([match["message"] for match in matches], ["my headache"])
+        self.assertFalse(has_next)
+
+        session_key = self.client.session.session_key
+        add_turns(session_key, "headaches again")
+        response = self.client.post("/search_conversation_history/", {"search_keyword": "headache", "filter_user": "true"})
+        self.assertEqual([match["message"] for match in response.json()["matching_conversations"]], ["headaches again"])
+
+    def test_pages_continue_after_turns_with_the_same_timestamp(self):
+        turns = add_turns("mine", *[f"question {i}" for i in range(5)])
+        add_turns("mine", "another day", date=datetime.date(2024, 5, 2))
+        seen, cursor = [], None
+        while True:
+            messages, cursor = async_to_sync(conversation_page)("mine", "2024-05-01", cursor, 2)
+            seen += [message["message"] for message in messages if message["sender"] == "user"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [turn.user_message for turn in turns])
+        with self.assertRaises(ValueError):
+            async_to_sync(conversation_page)("mine", "2024-05-01", "not a cursor", 2)
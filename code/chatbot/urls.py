@@ -1,9 +1,11 @@
 from django.urls import path
-from .views import landing_page, get_conversation_by_date, search_conversation_history
+from .views import landing_page, get_conversation_by_date, search_conversation_history, stream_chat, service_stats
 
 urlpatterns = [
     path('', landing_page, name='landing_page'),
+    path('stream_chat/', stream_chat, name='stream_chat'),
     path('get_conversation_by_date/', get_conversation_by_date, name='get_conversation_by_date'),
     path('search_conversation_history/', search_conversation_history, name='search_conversation_history'),  # New URL path for searching
+    path('service_stats/', service_stats, name='service_stats'),
 
 ]
@@ -1,18 +1,31 @@
 from django.shortcuts import render
-from django.http import JsonResponse
-from .core.healthmate_graph import compile_graph, save_graph
-from .models import ConversationHistory 
+from django.http import JsonResponse, StreamingHttpResponse
+from .core.services import get_graph, get_turn_logger, services
+from .core.patient_context import DEFAULT_PATIENT_EMAIL
+from .models import ConversationHistory
+from .history import cached_history_dates, conversation_page, HISTORY_PAGE_SIZE
+from .history_search import search_history
+from asgiref.sync import sync_to_async
 import uuid
-from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+import json
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
 import datetime
+import os
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
 
-graph = compile_graph()
-save_graph(graph)
 def format_date_to_iso(date_str):
     month_replacements = {
         "Jan.": "Jan", "Feb.": "Feb", "Mar.": "Mar", "Apr.": "Apr", "May.": "May", "Jun.": "Jun",
         "Jul.": "Jul", "Aug.": "Aug", "Sept.": "Sep", "Oct.": "Oct", "Nov.": "Nov", "Dec.": "Dec"
     }
+    try:
+        # Dates added to the sidebar during a chat are already ISO.
+        return datetime.date.fromisoformat(date_str).isoformat()
+    except ValueError:
+        pass
     for long_month, short_month in month_replacements.items():
         date_str = date_str.replace(long_month, short_month)
     try:
@@ -22,34 +35,96 @@ def format_date_to_iso(date_str):
     return date_obj.strftime("%Y-%m-%d")
 
 
-config = {"configurable": {"thread_id": str(uuid.uuid4())}}
-first_user_message = True
-def landing_page(request):
-    global first_user_message
+# Messages of the latest turns kept in the session; the full history is read from ConversationHistory.
+SESSION_HISTORY_WINDOW = int(os.getenv('SESSION_HISTORY_WINDOW', 20))
+
+# Nodes whose LLM output is shown to the user and therefore streamed token by token.
+STREAMED_NODES = ("assistant", "appt_rescheduler", "treatment_change")
+
+async def session_thread(request):
+    """
+    Returns the graph thread of the session's conversation and whether this turn starts it.
+    """
+    thread_id = await request.session.aget('graph_thread_id')
+    if thread_id:
+        return thread_id, False
+    thread_id = str(uuid.uuid4())
+    await request.session.aset('graph_thread_id', thread_id)
+    return thread_id, True
+
+def build_input_message(user_message, new_thread):
+    if new_thread:
+        return {"messages": [HumanMessage(content=user_message)], "current_state": "Orchestrator", "message_counter": 0}
+    return {"messages": [HumanMessage(content=user_message)]}
+
+async def session_patient_email(request):
+    """
+    Resolves the patient the session is chatting as: the signed-in user's, otherwise the default patient.
+    Never taken from the request body, which any client can set to someone else's email.
+    """
+    user = await request.auser()
+    if user.is_authenticated and user.email:
+        return user.email
+    return DEFAULT_PATIENT_EMAIL
+
+def turn_config(thread_id, patient_email):
+    return {"configurable": {"thread_id": thread_id, "patient_email": patient_email}}
+
+async def record_turn(request, session_id, patient_email, user_message, bot_response, route=""):
+    """
+    Queues a finished turn for the ConversationHistory table, written behind in batches by the turn logger,
+    and keeps the last SESSION_HISTORY_WINDOW messages in the session.
+    Returns the list of dates the session has history for.
+    """
+    today = datetime.date.today()
+    get_turn_logger().log({
+        "session_id": session_id,
+        "patient_email": patient_email,
+        "timestamp": timezone.now(),
+        "date": today,
+        "user_message": user_message,
+        "bot_response": bot_response,
+        "route": route,
+    })
+    recent_messages = await request.session.aget('recent_messages', [])
+    recent_messages.append({'date': str(today), 'sender': 'user', 'message': user_message})
+    recent_messages.append({'date': str(today), 'sender': 'bot', 'message': bot_response})
+    await request.session.aset('recent_messages', recent_messages[-SESSION_HISTORY_WINDOW:])
+    # Sessions from before the window kept their whole history here.
+    await request.session.apop('conversation_history', None)
+
+    # The turn may not be in the table yet.
+    history_dates = [str(date) for date in await cached_history_dates(session_id)]
+    if str(today) not in history_dates:
+        history_dates.append(str(today))
+    return history_dates
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def landing_page(request):
     summary = ""
-    session_id = request.session.session_key or str(uuid.uuid4()) 
 
     if request.method == 'POST':
-        conversation_history = request.session.get('conversation_history', {})
-        if not isinstance(conversation_history, dict):
-            conversation_history = {}  
-
-        current_date = str(datetime.date.today())
+        # Turns are stored under the session key, which a new session only gets once saved.
+        if not request.session.session_key:
+            await request.session.asave()
+        session_id = request.session.session_key
         additional_message = None
         user_message = request.POST.get('message')
+        patient_email = await session_patient_email(request)
         bot_response = ""
-
-        if first_user_message:
-            input_message = {"messages": [HumanMessage(content=user_message)], "current_state": "Orchestrator", "message_counter": 0}
-            first_user_message = False
-        else:
-            input_message = {"messages": [HumanMessage(content=user_message)]}
-
-        for output in graph.stream(input_message, config=config, stream_mode="updates"):
-            if "final_state" in output:
-                if summary != output['final_state'].get('summary', []):
-                    summary = output['final_state'].get('summary', [])
-                    print(summary)
+        route = ""
+        thread_id, new_thread = await session_thread(request)
+        input_message = build_input_message(user_message, new_thread)
+
+        async for output in get_graph().astream(input_message, config=turn_config(thread_id, patient_email), stream_mode="updates"):
+            if "compact_history" in output:
+                if summary != output['compact_history'].get('summary', []):
+                    summary = output['compact_history'].get('summary', [])
+                    logger.debug("Conversation summary of thread %s: %s", thread_id, summary)
+            elif 'orchestrator' in output:
+                route = output['orchestrator'].get('route', "")
             elif 'assistant' in output:
                 bot_response = output['assistant'].get('messages', [])[0].content
             elif 'appt_rescheduler' in output:
@@ -61,73 +136,120 @@ def landing_page(request):
                 additional_message = output['change_state'].get('messages', [])[0].content
 
         if bot_response != "":
-            if current_date not in conversation_history:
-                conversation_history[current_date] = [] 
-            conversation_history[current_date].append({'sender': 'user', 'message': user_message})
-            conversation_history[current_date].append({'sender': 'bot', 'message': bot_response})
-            
-            request.session['conversation_history'] = conversation_history
-
-            ConversationHistory.objects.create(
-                session_id=session_id,
-                date=current_date,
-                user_message=user_message,
-                bot_response=bot_response,
-            )
-
-            return JsonResponse({"response": bot_response, "history_dates": list(conversation_history.keys()), "additional_info": additional_message})
+            history_dates = await record_turn(request, session_id, patient_email, user_message, bot_response, route)
+            return JsonResponse({"response": bot_response, "history_dates": history_dates, "additional_info": additional_message})
         else:
             return JsonResponse({"response": ""})
 
-    history_dates = ConversationHistory.objects.values_list('date', flat=True).distinct()
-    history_dates = list(history_dates) 
-    return render(request, 'landing_page.html', {'history_dates': history_dates})
+    return render(request, 'landing_page.html', {'history_dates': await cached_history_dates(request.session.session_key)})
+
+async def stream_chat(request):
+    """
+    Runs one chat turn and streams the reply as Server-Sent Events.
+    Emits `token` events while the user facing nodes generate, followed by
+    `additional_info`, `history_dates` and a closing `done` event.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST required"}, status=405)
+
+    # The session middleware saves before the stream body runs, so make sure
+    # the session exists now and save it explicitly once the turn is recorded.
+    if not request.session.session_key:
+        await request.session.asave()
+    session_id = request.session.session_key
+    user_message = request.POST.get('message')
+    patient_email = await session_patient_email(request)
+    thread_id, new_thread = await session_thread(request)
+    input_message = build_input_message(user_message, new_thread)
+
+    async def event_stream():
+        bot_response = ""
+        additional_message = None
+        route = ""
+        streamed_nodes = set()
+        async for mode, chunk in get_graph().astream(input_message, config=turn_config(thread_id, patient_email), stream_mode=["messages", "updates"]):
+            if mode == "messages":
+                message, metadata = chunk
+                node = metadata.get("langgraph_node")
+                if node not in STREAMED_NODES:
+                    continue
+                if isinstance(message, AIMessageChunk):
+                    token = message.content
+                elif isinstance(message, AIMessage) and node not in streamed_nodes:
+                    # Model did not stream (e.g. provider without streaming), send the whole message once.
+                    token = message.content
+                else:
+                    continue
+                if isinstance(token, str) and token:
+                    streamed_nodes.add(node)
+                    bot_response += token
+                    yield sse_event("token", {"token": token})
+            elif 'orchestrator' in chunk:
+                route = chunk['orchestrator'].get('route', "")
+            elif 'change_state' in chunk:
+                token = chunk['change_state'].get('messages', [])[1].content
+                additional_message = chunk['change_state'].get('messages', [])[0].content
+                if bot_response:
+                    token = "\n\n" + token
+                bot_response += token
+                yield sse_event("token", {"token": token})
 
-def get_conversation_by_date(request):
+        if bot_response != "":
+            history_dates = await record_turn(request, session_id, patient_email, user_message, bot_response, route)
+            await request.session.asave()
+            if additional_message:
+                yield sse_event("additional_info", {"additional_info": additional_message})
+            yield sse_event("history_dates", {"history_dates": history_dates})
+        yield sse_event("done", {})
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+async def get_conversation_by_date(request):
+    """
+    The session's conversation on `selected_date`, `page_size` turns at a time. Pass the returned
+    `next_cursor` back as `cursor` for the following page; it is null after the last one.
+    """
     if request.method == 'POST':
-        selected_date = request.POST.get('selected_date')
-        session_id = request.session.session_key
-        conversations = ConversationHistory.objects.filter(date=format_date_to_iso(selected_date)).values('user_message', 'bot_response')
-        conversation = []
-        for convo in conversations:
-            conversation.append({'sender': 'user', 'message': convo['user_message']})
-            conversation.append({'sender': 'bot', 'message': convo['bot_response']})
-        return JsonResponse({"conversation": conversation})
-    
-def search_conversation_history(request):
+        selected_date = request.POST.get('selected_date', "")
+        try:
+            page_size = int(request.POST.get('page_size', HISTORY_PAGE_SIZE))
+            conversation, next_cursor = await conversation_page(
+                request.session.session_key, format_date_to_iso(selected_date), request.POST.get('cursor'), page_size,
+            )
+        except ValueError:
+            return JsonResponse({"error": "invalid page_size or cursor"}, status=400)
+        return JsonResponse({"conversation": conversation, "next_cursor": next_cursor})
+
+async def search_conversation_history(request):
+    """
+    Searches the session's stored conversation history, best matches first, `page_size` turns per page.
+    """
     if request.method == 'POST':
-        # Retrieve the search keyword from the POST request
-        search_keyword = request.POST.get('search_keyword', "").lower()
+        search_keyword = request.POST.get('search_keyword', "")
         case_sensitive = request.POST.get('case_sensitive', 'false') == 'true'
         filter_user = request.POST.get('filter_user', 'false') == 'true'
         filter_bot = request.POST.get('filter_bot', 'false') == 'true'
-        
-        session_id = request.session.session_key
-        matching_conversations = []
-
-        # Retrieve conversation history from session
-        conversation_history = request.session.get('conversation_history', {})
-
-        # Search through each conversation for the keyword
-        for date, conversations in conversation_history.items():
-            for convo in conversations:
-                message = convo['message']
-                sender = convo['sender']
-
-                # Apply case sensitivity if needed
-                if not case_sensitive:
-                    message = message.lower()
-                    search_keyword = search_keyword.lower()
-
-                # Apply sender filters
-                if filter_user and sender != 'user':
-                    continue
-                if filter_bot and sender != 'bot':
-                    continue
-
-                # Check if the message contains the search keyword
-                if search_keyword in message:
-                    matching_conversations.append({'date': date, 'sender': sender, 'message': convo['message'], 'keyword': search_keyword})
-
-        # Return the matching conversations as a JSON response
-        return JsonResponse({"matching_conversations": matching_conversations})
+        try:
+            page = int(request.POST.get('page', 1))
+            page_size = int(request.POST.get('page_size', 20))
+        except ValueError:
+            return JsonResponse({"error": "page and page_size must be integers"}, status=400)
+
+        # Only the caller's own session: the patient email is whatever the client posted, so it proves nothing.
+        history = ConversationHistory.objects.filter(session_id=request.session.session_key)
+        matching_conversations, has_next = await sync_to_async(search_history)(
+            history, search_keyword, case_sensitive, filter_user, filter_bot, page, page_size,
+        )
+        return JsonResponse({"matching_conversations": matching_conversations, "page": page, "has_next": has_next})
+
+async def service_stats(request):
+    """
+    Staff-only JSON snapshot of the backend counters, e.g. Neo4j pool utilization and acquisition wait.
+    """
+    user = await request.auser()
+    if not user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return JsonResponse(services.stats())
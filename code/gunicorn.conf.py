@@ -0,0 +1,40 @@
+# Production server: gunicorn loads the project once in the master, preloads the shared models there and
+# forks the workers, which inherit them copy-on-write.
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# WEB_CONCURRENCY workers (default: one per core), each an ASGI (uvicorn) worker with one event loop. The views
+# are async and the Neo4j driver and async LLM clients are created once per process, bound to that loop, so
+# the app is only served over ASGI: under WSGI every request would run on a new loop, and SSE would be buffered.
+import multiprocessing
+import os
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+wsgi_app = 'healthmate.asgi:application'
+timeout = int(os.getenv('WEB_TIMEOUT', 120))
+graceful_timeout = 30
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+preload_app = True
+accesslog = '-'
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported and before any worker is forked.
+    from chatbot.core.prefork import preload
+    for name, seconds in preload().items():
+        server.log.info("Preloaded %s in %.2fs", name, seconds)
+
+
+def post_fork(server, worker):
+    from chatbot.core.prefork import after_fork
+    after_fork()
+
+
+def worker_exit(server, worker):
+    # Writes the chat turns this worker still buffers while the master waits for it (graceful_timeout).
+    from chatbot.core.services import services
+    if services.is_loaded("turn_logger"):
+        services.get("turn_logger").shutdown()